@@ -7,12 +7,50 @@ import pathlib
 import typing as ty
 import collections
 from enum import Enum
-from voluptuous import Schema
+from voluptuous import Any, Optional, Required, Schema
 
 import yaml
 
+# the loader and dumper implemented in C are much faster, but only available if PyYAML was built with libyaml
+_SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+_SafeDumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
 CONFIG_FILE_NAME = '.aiida-testing-config.yml'
 
+#: Settings of the storage backend of a mock code label
+MOCK_CODE_BACKEND_SCHEMA = {
+    Required('type'): Any('local', 'http'),
+    Optional('path'): str,
+    Optional('url'): str,
+    Optional('cache_dir'): str,
+    Optional('cache_size'): int,
+}
+
+#: Declarative normalization rules of the input files of a mock code label, see ``mock_code._normalize``
+MOCK_CODE_NORMALIZE_SCHEMA = {
+    Optional('exclude'): [str],
+    Optional('remove_lines'): [str],
+    Optional('mask'): [{
+        Required('path'): str,
+        Required('start'): int,
+        Required('end'): int
+    }],
+    Optional('round'): {
+        Required('digits'): int,
+        Optional('path'): str
+    },
+}
+
+#: Settings of a mock code label, given either as the path of the executable or as a mapping
+MOCK_CODE_LABEL_SCHEMA = {
+    Optional('executable'): str,
+    Optional('max_concurrent_runs'): int,
+    Optional('version'): str,
+    Optional('version_command'): Any(str, [str]),
+    Optional('backend'): MOCK_CODE_BACKEND_SCHEMA,
+    Optional('normalize'): MOCK_CODE_NORMALIZE_SCHEMA,
+}
+
 
 class ConfigActions(Enum):
     """
@@ -27,7 +65,7 @@ class Config(collections.abc.MutableMapping):
     """Configuration of aiida-testing package."""
 
     schema = Schema({
-        'mock_code': Schema({str: str}),
+        'mock_code': Schema({str: Any(str, MOCK_CODE_LABEL_SCHEMA)}),
         'archive_cache': {
             'default_cache_dir': str,
             'ignore': {
@@ -61,7 +99,7 @@ class Config(collections.abc.MutableMapping):
             config_file_path = (dir_path / CONFIG_FILE_NAME)
             if config_file_path.exists():
                 with open(config_file_path, encoding='utf8') as config_file:
-                    config = yaml.load(config_file, Loader=yaml.SafeLoader)
+                    config = yaml.load(config_file, Loader=_SafeLoader)
                     break
         else:
             config = {}
@@ -76,7 +114,7 @@ class Config(collections.abc.MutableMapping):
         :param handle: File handle to write config file to.
         """
         with open(self.file_path, 'w', encoding='utf8') as handle:
-            yaml.dump(self._dict, handle, Dumper=yaml.SafeDumper)
+            yaml.dump(self._dict, handle, Dumper=_SafeDumper)
 
     @property
     def file_path(self):
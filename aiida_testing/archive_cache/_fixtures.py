@@ -13,16 +13,11 @@ import typing as ty
 
 import pytest
 
-from aiida import plugins
-from aiida.common.links import LinkType
-from aiida.orm import Code, Dict, SinglefileData, List, FolderData, RemoteData, StructureData
-from aiida.orm import CalcJobNode, QueryBuilder
-from aiida.manage.caching import enable_caching
-
-from ._utils import monkeypatch_hash_objects, get_node_from_hash_objects_caller
-from ._utils import load_node_archive, create_node_archive
 from .._config import Config
 
+# aiida.orm and the archive tools are slow to import, hence they are only imported in the fixtures
+# pylint: disable=import-outside-toplevel
+
 __all__ = (
     "pytest_addoption", "absolute_archive_path", "enable_archive_cache", "liberal_hash",
     "archive_cache_forbid_migration", "archive_cache_overwrite"
@@ -157,6 +152,10 @@ def enable_archive_cache(
     Requires an absolute path to the export file to load or export to.
     Export the provenance of all calcjobs nodes within the test.
     """
+    from aiida.manage.caching import enable_caching
+    from aiida.orm import CalcJobNode, QueryBuilder
+
+    from ._utils import load_node_archive, create_node_archive
 
     @contextmanager
     def _enable_archive_cache(
@@ -221,6 +220,11 @@ def liberal_hash(monkeypatch: pytest.MonkeyPatch, testing_config: Config) -> Non
     to not include the uuid of the computer and less information of the code node in the hash
     and remove aiida-core version from hash
     """
+    from aiida import orm, plugins
+    from aiida.common.links import LinkType
+
+    from ._utils import monkeypatch_hash_objects, get_node_from_hash_objects_caller
+
     hash_ignore_config = testing_config.get('archive_cache', {}).get('ignore', {})
 
     #Load the corresponding entry points
@@ -284,11 +288,12 @@ def liberal_hash(monkeypatch: pytest.MonkeyPatch, testing_config: Config) -> Non
         ]
         return objects
 
-    monkeypatch_hash_objects(monkeypatch, Code, mock_objects_to_hash_code)
-    monkeypatch_hash_objects(monkeypatch, CalcJobNode, mock_objects_to_hash_calcjob)
+    monkeypatch_hash_objects(monkeypatch, orm.Code, mock_objects_to_hash_code)
+    monkeypatch_hash_objects(monkeypatch, orm.CalcJobNode, mock_objects_to_hash_calcjob)
 
-    nodes_to_patch = [Dict, SinglefileData, List, FolderData, RemoteData, StructureData]
-    for node_class in nodes_to_patch:
+    for node_class in (
+        orm.Dict, orm.SinglefileData, orm.List, orm.FolderData, orm.RemoteData, orm.StructureData
+    ):
         monkeypatch_hash_objects(
             monkeypatch,
             node_class,  #type: ignore[arg-type]
@@ -2,19 +2,66 @@
 """
 Defines fixtures for mocking AiiDA codes, with caching at the level of
 the executable.
+
+The fixtures are loaded lazily on first attribute access, so that the
+``aiida-mock-code`` executable (which only needs :mod:`._cli`, :mod:`._env_keys`
+and :mod:`._hasher`) does not import aiida-core or pytest on startup.
+
+Loading the pytest plugin does not import aiida-core either. The fixtures rely on the fixtures of
+aiida-core, which projects enable in their ``conftest.py`` with
+``pytest_plugins = ['aiida.manage.tests.pytest_fixtures']``.
 """
+import importlib
+import typing as ty
 
 from ._hasher import InputHasher
-from ._fixtures import *
 
 # Note: This is necessary for the sphinx doc - otherwise it does not find aiida_testing.mock_code.mock_code_factory
 __all__ = (
     "pytest_addoption",
+    "pytest_configure",
     "testing_config_action",
     "mock_regenerate_test_data",
+    "mock_regenerate_selection",
+    "mock_code_versions",
+    "mock_fail_on_missing",
+    "mock_disable_mpi",
+    "mock_replay_in_process",
+    "mock_max_concurrent_runs",
+    "mock_cpu_affinity",
     "testing_config",
+    "mock_code_server",
+    "mock_code_pool",
     "mock_code_factory",
 )
 
-# ensure aiida's pytest plugin is loaded, which we rely on
-pytest_plugins = ['aiida.manage.tests.pytest_fixtures']
+if ty.TYPE_CHECKING:
+    from ._fixtures import (
+        pytest_addoption,
+        pytest_configure,
+        testing_config_action,
+        mock_regenerate_test_data,
+        mock_regenerate_selection,
+        mock_code_versions,
+        mock_fail_on_missing,
+        mock_disable_mpi,
+        mock_replay_in_process,
+        mock_max_concurrent_runs,
+        mock_cpu_affinity,
+        testing_config,
+        mock_code_server,
+        mock_code_pool,
+        mock_code_factory,
+    )
+
+
+def __getattr__(name: str) -> ty.Any:
+    """Import the pytest fixtures and hooks only when they are requested."""
+    if name in __all__:
+        return getattr(importlib.import_module('._fixtures', __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__() -> ty.List[str]:
+    """Expose the lazily loaded names, which pytest uses to discover hooks and fixtures."""
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,384 @@
+# -*- coding: utf-8 -*-
+"""
+Storage backends for sharing mock code results beyond the local data directory.
+
+A backend stores results directories by name and transfers them as plain files,
+independent of the storage layout used locally. Backends are configured per code
+label in the ``.aiida-testing-config.yml`` file, see :func:`create_backend`.
+"""
+import abc
+import hashlib
+import io
+import os
+from pathlib import Path, PurePosixPath
+import shutil
+import stat
+import tarfile
+import tempfile
+import typing as ty
+
+from ._restore import FileRestorer
+from ._storage import META_PREFIX, read_metadata
+
+__all__ = ("StorageBackend", "LocalBackend", "HttpBackend", "CachedBackend", "create_backend")
+
+#: Type of the files of a results directory, mapping relative paths to functions opening the content
+FileOpeners = ty.Mapping[str, ty.Callable[[], ty.BinaryIO]]
+
+#: Default maximum size of the local tier of remote backends, in bytes
+DEFAULT_CACHE_SIZE = 1024**3
+
+#: Default location of the local tiers of remote backends
+_CACHE_HOME = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+DEFAULT_CACHE_DIR = Path(_CACHE_HOME) / 'aiida-testing' / 'mock-code'
+
+_BLOCK_SIZE = 1024**2
+
+
+class StorageBackend(abc.ABC):
+    """
+    Storage of results directories, identified by their name ``mock-{label}-{hash}``.
+    """
+
+    @abc.abstractmethod
+    def lookup(self, name: str) -> bool:
+        """Return whether results of the given name are stored."""
+
+    @abc.abstractmethod
+    def fetch(
+        self,
+        name: str,
+        dest_dir: Path,
+        restorer: FileRestorer,
+        include: ty.Optional[ty.Callable[[str], bool]] = None,
+    ) -> None:
+        """Restore the results of the given name into the destination directory.
+
+        :param include: If given, only files whose relative path satisfies this predicate are restored.
+        :raises FileNotFoundError: If there are no results of the given name.
+        """
+
+    @abc.abstractmethod
+    def publish(self, name: str, files: FileOpeners) -> None:
+        """Store results under the given name, replacing existing results.
+
+        :param files: Mapping of relative paths to functions opening the file content.
+        """
+
+    def read_metadata(self, name: str) -> ty.Dict[str, ty.Any]:  # pylint: disable=unused-argument,no-self-use
+        """Return the metadata of the results of the given name, if available without transferring them."""
+        return {}
+
+    def pop_errors(self) -> ty.List[str]:  # pylint: disable=no-self-use
+        """Return and forget the errors of the backend that were treated as missing results."""
+        return []
+
+    def close(self) -> None:
+        """Release the resources held by the backend."""
+
+
+class LocalBackend(StorageBackend):
+    """
+    Backend storing results in another data directory, e.g. on a shared filesystem.
+    """
+
+    def __init__(self, path: Path) -> None:
+        from ._data_dir import DataDirectory  # pylint: disable=import-outside-toplevel,cyclic-import
+        self.data_directory = DataDirectory(path)
+
+    def lookup(self, name: str) -> bool:
+        return self.data_directory.contains(name)
+
+    def fetch(
+        self,
+        name: str,
+        dest_dir: Path,
+        restorer: FileRestorer,
+        include: ty.Optional[ty.Callable[[str], bool]] = None,
+    ) -> None:
+        self.data_directory.restore(name, dest_dir, restorer, include=include)
+
+    def publish(self, name: str, files: FileOpeners) -> None:
+        self.data_directory.path.mkdir(parents=True, exist_ok=True)
+        with self.data_directory.lock(name), self.data_directory.staging_dir(name) as staging:
+            write_files(files, staging)
+
+    def read_metadata(self, name: str) -> ty.Dict[str, ty.Any]:
+        return self.data_directory.read_metadata(name)
+
+    def close(self) -> None:
+        self.data_directory.close()
+
+
+class HttpBackend(StorageBackend):
+    """
+    Backend storing results on an HTTP server, e.g. the one of ``aiida-mock-data serve``.
+
+    Results are transferred as uncompressed tar streams: ``HEAD``, ``GET`` and ``PUT``
+    requests on ``{url}/entries/{name}`` look up, fetch and publish results. Errors on lookup
+    are treated as a missing result, such that tests fall back to running the actual code, and
+    are returned by :meth:`pop_errors`. The result of each lookup is kept for the lifetime of the
+    backend, and an unreachable server is not contacted again.
+
+    :param timeout: Timeout of fetching and publishing results, in seconds.
+    :param lookup_timeout: Timeout of looking up results, including connecting to the server, in seconds.
+    """
+
+    def __init__(self, url: str, timeout: float = 30., lookup_timeout: float = 5.) -> None:
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.lookup_timeout = lookup_timeout
+        self._found: ty.Dict[str, bool] = {}
+        self._errors: ty.List[str] = []
+        self._unreachable = False
+
+    def _request(  # pylint: disable=too-many-arguments
+        self,
+        name: str,
+        method: str,
+        data: ty.Optional[ty.IO[bytes]] = None,
+        size: int = 0,
+        timeout: ty.Optional[float] = None
+    ):
+        """Send a request for the results of the given name and return the response."""
+        # imported lazily, to keep the startup of the mock code executable fast
+        import urllib.parse  # pylint: disable=import-outside-toplevel
+        import urllib.request  # pylint: disable=import-outside-toplevel
+        request = urllib.request.Request(
+            f"{self.url}/entries/{urllib.parse.quote(name)}", data=data, method=method
+        )
+        if data is not None:
+            request.add_header('Content-Type', 'application/x-tar')
+            request.add_header('Content-Length', str(size))
+        return urllib.request.urlopen(request, timeout=timeout or self.timeout)  # pylint: disable=consider-using-with
+
+    def lookup(self, name: str) -> bool:
+        if name not in self._found and not self._unreachable:
+            self._found[name] = self._lookup(name)
+        return self._found.get(name, False)
+
+    def _lookup(self, name: str) -> bool:
+        """Send the request looking up the results of the given name."""
+        import urllib.error  # pylint: disable=import-outside-toplevel
+        try:
+            with self._request(name, 'HEAD', timeout=self.lookup_timeout):
+                return True
+        except urllib.error.HTTPError as exc:
+            if exc.code != 404:
+                self._errors.append(f"Looking up '{name}' at '{self.url}' failed: {exc}")
+        except OSError as exc:
+            self._unreachable = True
+            self._errors.append(f"Storage backend '{self.url}' is unreachable: {exc}")
+        return False
+
+    def pop_errors(self) -> ty.List[str]:
+        errors, self._errors = self._errors, []
+        return errors
+
+    def fetch(
+        self,
+        name: str,
+        dest_dir: Path,
+        restorer: FileRestorer,
+        include: ty.Optional[ty.Callable[[str], bool]] = None,
+    ) -> None:
+        import urllib.error  # pylint: disable=import-outside-toplevel
+        try:
+            with self._request(name, 'GET') as response:
+                count, size = extract_tar(
+                    response, dest_dir, exclude_prefix=META_PREFIX, include=include
+                )
+            restorer.counts['http'] += count
+            restorer.restored_bytes += size
+        except urllib.error.HTTPError as exc:
+            if exc.code == 404:
+                raise FileNotFoundError(f"No results '{name}' at '{self.url}'.") from exc
+            raise
+
+    def publish(self, name: str, files: FileOpeners) -> None:
+        with tempfile.TemporaryFile() as handle:
+            write_tar(handle, files)
+            size = handle.tell()
+            handle.seek(0)
+            with self._request(name, 'PUT', data=handle, size=size):
+                pass
+        self._found[name] = True
+
+
+class CachedBackend(StorageBackend):
+    """
+    Read-through local tier in front of a (remote) backend.
+
+    Fetched and published results are kept as read-only plain files in the cache directory,
+    such that repeated hits are restored locally (using hard links where possible). The least
+    recently used results are evicted when the total size exceeds ``max_size``.
+
+    :param backend: The backend behind the local tier.
+    :param path: Directory of the local tier.
+    :param max_size: Maximum total size of the local tier, in bytes.
+    """
+
+    def __init__(
+        self, backend: StorageBackend, path: Path, max_size: int = DEFAULT_CACHE_SIZE
+    ) -> None:
+        self.backend = backend
+        self.path = Path(path)
+        self.max_size = max_size
+
+    def lookup(self, name: str) -> bool:
+        return (self.path / name).is_dir() or self.backend.lookup(name)
+
+    def pop_errors(self) -> ty.List[str]:
+        return self.backend.pop_errors()
+
+    def fetch(
+        self,
+        name: str,
+        dest_dir: Path,
+        restorer: FileRestorer,
+        include: ty.Optional[ty.Callable[[str], bool]] = None,
+    ) -> None:
+        entry = self.path / name
+        if not entry.is_dir():
+            self._insert(
+                name, lambda tmp_dir: self.backend.fetch(name, tmp_dir, FileRestorer('copy'))
+            )
+        # the modification time of a results directory marks its last use
+        os.utime(entry)
+        restorer.restore_tree(entry, dest_dir, exclude_prefix=META_PREFIX, include=include)
+
+    def publish(self, name: str, files: FileOpeners) -> None:
+        self.backend.publish(name, files)
+        shutil.rmtree(self.path / name, ignore_errors=True)
+        self._insert(name, lambda tmp_dir: write_files(files, tmp_dir))
+
+    def read_metadata(self, name: str) -> ty.Dict[str, ty.Any]:
+        if (self.path / name).is_dir():
+            return read_metadata(self.path / name)
+        return self.backend.read_metadata(name)
+
+    def _insert(self, name: str, write: ty.Callable[[Path], None]) -> None:
+        """Atomically add results to the local tier and evict the least recently used results."""
+        self.path.mkdir(parents=True, exist_ok=True)
+        tmp_dir = Path(tempfile.mkdtemp(dir=self.path, prefix='.tmp-'))
+        try:
+            write(tmp_dir)
+            for dirpath, _, filenames in os.walk(tmp_dir):
+                for filename in filenames:
+                    os.chmod(
+                        os.path.join(dirpath, filename), stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+                    )
+            try:
+                tmp_dir.rename(self.path / name)
+            except OSError:
+                # inserted concurrently by another process
+                if not (self.path / name).is_dir():
+                    raise
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.evict(keep=name)
+
+    def evict(self, keep: ty.Optional[str] = None) -> int:
+        """Remove the least recently used results until the local tier fits into its maximum size.
+
+        :param keep: Name of results that are never evicted.
+        :return: The number of removed results.
+        """
+        entries = []
+        for entry in self.path.iterdir():
+            if entry.is_dir() and not entry.name.startswith('.'):
+                size = sum(path.stat().st_size for path in entry.rglob('*') if path.is_file())
+                entries.append((entry.stat().st_mtime, size, entry))
+        total_size = sum(size for _, size, _ in entries)
+        count = 0
+        for _, size, entry in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            if entry.name != keep:
+                shutil.rmtree(entry, ignore_errors=True)
+                total_size -= size
+                count += 1
+        return count
+
+
+def create_backend(config: ty.Mapping[str, ty.Any]) -> StorageBackend:
+    """Create a storage backend from its configuration.
+
+    The configuration contains the ``type`` of the backend (``'local'`` or ``'http'``), and its ``path``
+    or ``url``, respectively. HTTP backends always have a local tier, in ``cache_dir`` (defaults to a
+    directory in ``~/.cache``) with a maximum size of ``cache_size`` bytes (defaults to 1 GiB).
+    Local backends only get a local tier if one of these options is given.
+    """
+    backend: StorageBackend
+    if config['type'] == 'local':
+        backend = LocalBackend(Path(config['path']))
+    elif config['type'] == 'http':
+        backend = HttpBackend(config['url'])
+    else:
+        raise ValueError(f"Unknown storage backend '{config['type']}'.")
+
+    if config['type'] == 'http' or 'cache_dir' in config or 'cache_size' in config:
+        location = config.get('url') or os.path.abspath(config['path'])
+        cache_dir = config.get('cache_dir') or DEFAULT_CACHE_DIR / hashlib.sha256(
+            location.encode()
+        ).hexdigest()[:16]
+        backend = CachedBackend(
+            backend, Path(cache_dir), max_size=config.get('cache_size', DEFAULT_CACHE_SIZE)
+        )
+    return backend
+
+
+def write_files(files: FileOpeners, dest_dir: Path) -> None:
+    """Write files given by functions opening their content into a directory."""
+    for relative_path, opener in files.items():
+        dest = dest_dir / relative_path
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        with opener() as src, open(dest, 'wb') as handle:
+            shutil.copyfileobj(src, handle, _BLOCK_SIZE)
+
+
+def write_tar(handle: ty.IO[bytes], files: FileOpeners) -> None:
+    """Write files given by functions opening their content as an uncompressed tar stream."""
+    with tarfile.open(fileobj=handle, mode='w|') as tar:
+        for relative_path, opener in sorted(files.items()):
+            with opener() as src:
+                # the size has to be known before writing the content
+                info = tarfile.TarInfo(relative_path)
+                info.size = src.seek(0, io.SEEK_END)
+                info.mode = 0o644
+                src.seek(0)
+                tar.addfile(info, src)
+
+
+def extract_tar(
+    handle: ty.IO[bytes],
+    dest_dir: Path,
+    exclude_prefix: ty.Optional[str] = None,
+    include: ty.Optional[ty.Callable[[str], bool]] = None,
+) -> ty.Tuple[int, int]:
+    """Extract the regular files of an uncompressed tar stream into a directory.
+
+    :param exclude_prefix: Top-level files starting with this prefix are not extracted.
+    :param include: If given, only files whose relative path satisfies this predicate are extracted.
+    :return: The number of extracted files and their total size in bytes.
+    :raises ValueError: If the stream contains a path outside of the destination directory.
+    """
+    count = total_size = 0
+    with tarfile.open(fileobj=handle, mode='r|') as tar:
+        for member in tar:
+            path = PurePosixPath(member.name)
+            if path.is_absolute() or '..' in path.parts:
+                raise ValueError(f"Invalid path '{member.name}' in results.")
+            if not member.isfile() or (include is not None and not include(member.name)):
+                continue
+            if exclude_prefix and path.parts[0].startswith(exclude_prefix):
+                continue
+            dest = dest_dir / path
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            src = tar.extractfile(member)
+            assert src is not None
+            with open(dest, 'wb') as out:
+                shutil.copyfileobj(src, out, _BLOCK_SIZE)
+            count += 1
+            total_size += member.size
+    return count, total_size
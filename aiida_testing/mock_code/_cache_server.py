@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Reference HTTP server for the :class:`._backends.HttpBackend`, serving a data directory.
+
+The server is meant for sharing results within a team or with CI runners on a
+trusted network, and for tests. It does not implement authentication.
+"""
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import tarfile
+import tempfile
+import threading
+import typing as ty
+import urllib.parse
+
+from ._backends import extract_tar, write_tar
+from ._data_dir import DataDirectory
+from ._storage import split_entry_name
+
+__all__ = ("CacheServer", )
+
+_ENTRIES_PREFIX = '/entries/'
+
+
+class CacheServer(ThreadingHTTPServer):
+    """
+    HTTP server storing the results published by mock codes in a data directory.
+
+    :param address: Host and port to listen on. Port 0 selects a free port.
+    :param data_directory: Data directory in which results are stored.
+    """
+
+    daemon_threads = True
+
+    #: If True, requests are logged to stderr
+    verbose = False
+
+    def __init__(self, address: ty.Tuple[str, int], data_directory: DataDirectory) -> None:
+        super().__init__(address, _RequestHandler)
+        data_directory.path.mkdir(parents=True, exist_ok=True)
+        self.data_directory = data_directory
+        self._thread: ty.Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """URL of the server."""
+        host, port = self.server_address[:2]
+        if isinstance(host, bytes):
+            host = host.decode()
+        return f"http://{host}:{port}"
+
+    def start(self) -> None:
+        """Serve requests in a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop serving requests."""
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """Handles requests for results, see :class:`._backends.HttpBackend`."""
+
+    server: CacheServer
+
+    def _entry_name(self) -> ty.Optional[str]:
+        """Return the name of the requested results, or None after sending an error for invalid requests."""
+        if not self.path.startswith(_ENTRIES_PREFIX):
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return None
+        name = urllib.parse.unquote(self.path[len(_ENTRIES_PREFIX):])
+        try:
+            split_entry_name(name)
+        except ValueError:
+            self.send_error(HTTPStatus.BAD_REQUEST, f"Invalid results name '{name}'.")
+            return None
+        if '/' in name or name.startswith('.'):
+            self.send_error(HTTPStatus.BAD_REQUEST, f"Invalid results name '{name}'.")
+            return None
+        return name
+
+    def do_HEAD(self) -> None:  # pylint: disable=invalid-name
+        """Report whether results exist."""
+        name = self._entry_name()
+        if name is None:
+            return
+        if not self.server.data_directory.contains(name):
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        """Send results as a tar stream."""
+        name = self._entry_name()
+        if name is None:
+            return
+        data_directory = self.server.data_directory
+        if not data_directory.contains(name):
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        with tempfile.TemporaryFile() as handle:
+            write_tar(handle, data_directory.file_openers(name))
+            size = handle.tell()
+            handle.seek(0)
+            self.send_response(HTTPStatus.OK)
+            self.send_header('Content-Type', 'application/x-tar')
+            self.send_header('Content-Length', str(size))
+            self.end_headers()
+            for block in iter(lambda: handle.read(1024**2), b''):
+                self.wfile.write(block)
+
+    def do_PUT(self) -> None:  # pylint: disable=invalid-name
+        """Store results received as a tar stream, replacing existing results."""
+        name = self._entry_name()
+        if name is None:
+            return
+        size = int(self.headers.get('Content-Length', 0))
+        data_directory = self.server.data_directory
+        with tempfile.TemporaryFile() as handle:
+            remaining = size
+            while remaining > 0:
+                block = self.rfile.read(min(remaining, 1024**2))
+                if not block:
+                    break
+                handle.write(block)
+                remaining -= len(block)
+            handle.seek(0)
+            try:
+                with data_directory.lock(name), data_directory.staging_dir(name) as staging:
+                    extract_tar(handle, staging)
+            except (ValueError, OSError, tarfile.TarError) as exc:
+                self.send_error(HTTPStatus.BAD_REQUEST, str(exc))
+                return
+        self.send_response(HTTPStatus.CREATED)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format: str, *args: ty.Any) -> None:  # pylint: disable=redefined-builtin
+        """Log requests only when running as a command, see ``aiida-mock-data serve``."""
+        if self.server.verbose:
+            super().log_message(format, *args)
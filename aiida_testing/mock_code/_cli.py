@@ -3,94 +3,508 @@
 """
 Implements the executable for running a mock AiiDA code.
 """
+import contextlib
 from datetime import datetime
+import json
 import os
 import sys
 import shutil
+import socket
 import subprocess
+import tempfile
+import time
 import typing as ty
 import fnmatch
 from pathlib import Path
 
-from ._env_keys import MockVariables
+from ._env_keys import MockVariables, _EnvKeys
+from ._data_dir import DataDirectory
+from ._hasher import InputHasher
+from ._restore import FileRestorer
+from ._retrieve import RetrieveFilter, load_retrieve_patterns
+from ._stats import append_record
+from ._storage import ObjectStore, entry_name, write_manifest, write_metadata
+from ._throttle import RunSlots, cpu_partition, session_slots_dir
+from ._trace import configure, span, set_test_name
+from ._usage import UsageLog
+from ._verify import VERIFY_MARKER, compare_outputs, select_for_verification
 
 
-def run() -> None:  # pylint: disable=too-many-branches
+class HashedInputs(ty.NamedTuple):
+    """Hash of the inputs of a calculation, with the statistics of computing it."""
+
+    #: Name of the results of the inputs
+    name: str
+    #: Time spent hashing the inputs, in seconds
+    hash_time: ty.Optional[float] = None
+    #: Paths of the input files that contributed to the hash
+    inputs: ty.Optional[ty.List[str]] = None
+    #: Where the inputs were hashed: 'executable', 'server' or 'in-process'
+    source: str = 'executable'
+
+
+def run() -> None:
     """
     Run the mock AiiDA code. If the corresponding result exists, it is
     simply copied over to the current working directory. Otherwise,
     the code will replace the executable in the aiidasubmit file,
     launch the "real" code, and then copy the results into the data
     directory.
+
+    If a mock code server is running (see :mod:`._server`), cache hits are
+    delegated to it and this process only acts as a thin client.
+
+    On a cache miss, a lock on the results is held while running the code, and
+    the results are published atomically. Concurrent processes with the same
+    inputs wait for the lock and restore the published results.
     """
     # Get environment variables
     env = MockVariables.from_env()
+    configure_trace(env, 'aiida-mock-code')
+    with span('aiida-mock-code', 'run', label=env.label):
+        if run_on_server(Path('.'), env.server_socket):
+            return
+        with env.get_data_directory() as data_directory:
+            _run(env, data_directory)
 
-    def _log(msg: str, error=False) -> None:
-        """Write a message to the log file."""
-        if error:
-            msg = f"ERROR: {msg}"
-        with open(env.log_file, 'a', encoding='utf8') as log_file:
-            log_file.write(f"{datetime.now()}:{env.label}: {msg}\n")
-        if error:
-            sys.exit(msg)
+
+def _run(env: MockVariables, data_directory: DataDirectory) -> None:  # pylint: disable=too-many-branches
+    """Run the mock AiiDA code without a mock code server, see :func:`run`."""
+    _log = get_logger(env)
 
     _log('Init mock code')
 
+    hasher, hashed = _hash_inputs(env, _log)
+    name = hashed.name
+    res_dir = data_directory.entry_dir(name)
+
+    with span('lookup', 'lookup', key=name) as args:
+        args['hit'] = data_directory.contains(name)
+        regenerate = env.should_regenerate(data_directory,
+                                           name) if args['hit'] else env.regenerate_data
+    if data_directory.remote is not None:
+        for message in data_directory.remote.pop_errors():
+            _log(message)
+    if args['hit'] and not regenerate:
+        _log(f"Cache hit: {data_directory.find_dir(name) or res_dir}")
+        with verify_replay(env, data_directory, name, hasher, _log):
+            restore_files(data_directory, hashed, Path('.'), env, _log)
+        return
+    if not args['hit'] and env.fail_on_missing:
+        _log(f"No cache hit for: {res_dir}", error=True)
+
+    # Only one process runs the actual code for the same inputs, concurrent
+    # processes (e.g. pytest-xdist workers) wait for its results.
+    with data_directory.lock(name) as waited:
+        if data_directory.contains(name) and (waited or not regenerate):
+            _log(
+                f"Cache hit after waiting for concurrent run: {data_directory.find_dir(name) or res_dir}"
+            )
+            restore_files(data_directory, hashed, Path('.'), env, _log)
+            return
+
+        if data_directory.contains(name):
+            _log(f"Cache hit: {data_directory.find_dir(name) or res_dir}")
+            _log("Regenerating data")
+        else:
+            _log(f"No cache hit for: {res_dir}")
+
+        if not env.executable_path:
+            _log("No existing cache, and no executable specified.", error=True)
+
+        with acquire_run_slot(env, _log):
+            _log(f"Running with executable: {env.executable_path}")
+            start = time.perf_counter()
+            with span('actual code', 'run', executable=env.executable_path):
+                subprocess.call([env.executable_path, *sys.argv[1:]])
+            run_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        copied_bytes = _store_results(env, data_directory, name, run_time, _log)
+        record_use(data_directory=data_directory, name=name, env=env)
+        record_stats(
+            env,
+            key=name,
+            hit=False,
+            source=hashed.source,
+            hash_time=hashed.hash_time,
+            inputs=hashed.inputs,
+            copy_time=time.perf_counter() - start,
+            bytes=copied_bytes,
+            run_time=run_time,
+        )
+
+
+def _hash_inputs(env: MockVariables, log: ty.Callable[...,
+                                                      None]) -> ty.Tuple[InputHasher, HashedInputs]:
+    """Hash the inputs in the working directory.
+
+    :return: The hasher, which normalizes the outputs for verification, and the hash of the inputs.
+    """
     try:
         hasher_cls = env.get_hasher()
     except Exception as exc:  # pylint: disable=broad-except
-        _log(f"loading hasher: {exc}", error=True)
+        log(f"loading hasher: {exc}", error=True)
 
+    start = time.perf_counter()
     try:
-        hash_digest = hasher_cls(env, _log)(Path('.'))
+        hasher = hasher_cls(env, log)
+        hash_digest = hasher(Path('.'))
     except Exception as exc:  # pylint: disable=broad-except
-        _log(f"computing hash: {exc}", error=True)
+        log(f"computing hash: {exc}", error=True)
+    hashed = HashedInputs(
+        entry_name(env.label, hash_digest, env.version),
+        time.perf_counter() - start, hasher.hashed_paths
+    )
+    return hasher, hashed
 
-    res_dir = env.data_dir / f"mock-{env.label}-{hash_digest}"
 
-    if res_dir.exists():
-        _log(f"Cache hit: {res_dir}")
-        if env.regenerate_data:
-            _log("Regenerating data")
-            shutil.rmtree(res_dir)
-    elif env.fail_on_missing:
-        _log(f"No cache hit for: {res_dir}", error=True)
-    else:
-        _log(f"No cache hit for: {res_dir}")
+def _store_results(
+    env: MockVariables, data_directory: DataDirectory, name: str, run_time: float,
+    log: ty.Callable[..., None]
+) -> int:
+    """Store the outputs in the working directory as results in the data directory, or in the remote backend.
 
-    if not res_dir.exists():
-        if not env.executable_path:
-            _log("No existing cache, and no executable specified.", error=True)
+    :return: The total size of the stored files, in bytes.
+    """
+    use_object_store = env.storage != 'files' and data_directory.remote is None
+    try:
+        with span('store', 'store', key=name), data_directory.staging_dir(name) as staging_dir:
+            files = select_files(
+                Path('.'), env.ignore_files, env.ignore_paths, get_retrieve_filter(Path('.'), env)
+            )
+            copied_bytes = store_files(
+                Path('.'),
+                staging_dir,
+                files,
+                object_store=data_directory.object_store if use_object_store else None,
+                chunked=env.storage == 'chunks',
+            )
+            metadata: ty.Dict[str, ty.Any] = {
+                'run_time': run_time,
+                'created': datetime.now().isoformat(timespec='seconds')
+            }
+            if env.fingerprint is not None:
+                metadata['fingerprint'] = env.fingerprint
+            write_metadata(staging_dir, metadata)
+    except OSError as exc:
+        log(f"Can not store results '{name}': {exc}", error=True)
+    return copied_bytes
 
-        _log(f"Running with executable: {env.executable_path}")
 
-        subprocess.call([env.executable_path, *sys.argv[1:]])
+@contextlib.contextmanager
+def acquire_run_slot(env: MockVariables, log: ty.Callable[..., None]) -> ty.Iterator[None]:
+    """Wait until the actual code may run, given the limits on concurrent runs.
 
-        # back up results to data directory
-        os.makedirs(res_dir)
-        copy_files(
-            src_dir=Path('.'),
-            dest_dir=res_dir,
-            ignore_files=env.ignore_files,
-            ignore_paths=env.ignore_paths
-        )
+    The limit of the label is acquired before the session-wide limit. With CPU affinity enabled,
+    the process is pinned to the cores of its slot of the session-wide limit (or else of the label limit),
+    which the actual code inherits.
+
+    :param env: Variables of the mock code execution
+    :param log: Logging function of the mock code
+    """
+    limits = []
+    if env.label_max_concurrent_runs is not None:
+        limits.append((f'label-{env.label}', env.label_max_concurrent_runs))
+    if env.max_concurrent_runs is not None:
+        limits.append(('all', env.max_concurrent_runs))
+
+    with contextlib.ExitStack() as stack:
+        start = datetime.now()
+        slot, num_slots = None, 0
+        with span('wait for run slot', 'lock'):
+            for name, max_runs in limits:
+                slots = RunSlots(name, max_runs, directory=session_slots_dir(env.session))
+                slot, num_slots = stack.enter_context(slots.acquire()), max_runs
+        if slot is not None:
+            log(f"Acquired run slot {slot} of {num_slots} after {datetime.now() - start}")
+            if env.cpu_affinity and not hasattr(os, 'sched_setaffinity'):
+                log("CPU affinity is not supported on this platform, running on all cores")
+            elif env.cpu_affinity:
+                cores = cpu_partition(slot, num_slots)
+                os.sched_setaffinity(0, cores)
+                log(f"Running on CPU cores {sorted(cores)}")
+        yield
+
+
+@contextlib.contextmanager
+def verify_replay(
+    env: MockVariables, data_directory: DataDirectory, name: str, hasher: InputHasher,
+    log: ty.Callable[..., None]
+) -> ty.Iterator[None]:
+    """Verify a sample of the cache hits by running the actual code, see :mod:`._verify`.
+
+    If the cache hit is selected (here, or by the process that declined to replay it), the inputs in the
+    working directory are copied to a scratch directory before the enclosed restore. Afterwards, the actual
+    code runs on the copy, and its outputs are compared to the stored results.
+
+    :param env: Variables of the mock code execution, defining the verification sample
+    :param data_directory: Data directory containing the results
+    :param name: Name of the results directory
+    :param hasher: Hasher of the mock code, normalizing the outputs before comparing
+    :param log: Logging function of the mock code
+    """
+    marker = Path(VERIFY_MARKER)
+    requested = marker.exists()
+    if requested:
+        marker.unlink()
+    if not requested and not select_for_verification(env, data_directory, name):
+        yield
+        return
+
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix='aiida-mock-verify-') as scratch:
+        workdir = Path(scratch) / 'work'
+        shutil.copytree('.', workdir, symlinks=True)
+        yield
+
+        log(f"Verifying '{name}' with executable: {env.executable_path}")
+        with span('verify', 'run', key=name) as args:
+            differences = _run_verification(env, data_directory, name, hasher, Path(scratch))
+            args['match'] = not differences
 
+    if differences:
+        log(f"Verification of '{name}' failed, differing files: {differences}")
     else:
-        # copy outputs from data directory to working directory
-        for path in res_dir.iterdir():
-            if path.is_dir():
-                shutil.rmtree(path.name, ignore_errors=True)
-                shutil.copytree(path, path.name)
-            elif path.is_file():
-                shutil.copyfile(path, path.name)
+        log(f"Verification of '{name}' succeeded")
+    try:
+        UsageLog(data_directory.path).record_verification(name, not differences)
+        if env.verify_file is not None:
+            append_record(
+                env.verify_file, {
+                    'label': env.label,
+                    'key': name,
+                    'test': env.test_name,
+                    'time': time.perf_counter() - start,
+                    'match': not differences,
+                    'differences': differences,
+                }
+            )
+    except OSError:
+        pass
+
+
+def _run_verification(
+    env: MockVariables, data_directory: DataDirectory, name: str, hasher: InputHasher, scratch: Path
+) -> ty.List[str]:
+    """Run the actual code on the copy of the inputs in the scratch directory, and compare its outputs.
+
+    :return: The relative paths of the outputs that differ from the stored results.
+    """
+    workdir = scratch / 'work'
+    with _redirects(workdir, sys.argv[0]) as streams:
+        subprocess.call([env.executable_path, *sys.argv[1:]], cwd=workdir, **streams)
+    include = get_retrieve_filter(workdir, env)
+    actual_dir, expected_dir = scratch / 'actual', scratch / 'expected'
+    copy_files(workdir, actual_dir, env.ignore_files, env.ignore_paths, include=include)
+    expected_dir.mkdir()
+    data_directory.restore(name, expected_dir, FileRestorer('copy'), include=include)
+    return compare_outputs(expected_dir, actual_dir, hasher.normalize_output)
+
+
+@contextlib.contextmanager
+def _redirects(workdir: Path, executable: str) -> ty.Iterator[ty.Dict[str, ty.Any]]:
+    """Redirect the standard streams of the actual code to the corresponding files in the scratch directory.
+
+    The redirections are read from the code info of this executable in the job template written by AiiDA.
+    Streams without a redirection, or all streams if the job template can not be read, are discarded.
+
+    :param workdir: Scratch directory in which the actual code runs
+    :param executable: Path of the mock code executable, as called by the submit script
+    """
+    code_info = _find_code_info(workdir, executable)
+    with contextlib.ExitStack() as stack:
+        streams: ty.Dict[str, ty.Any] = {}
+        for key, mode in (('stdin', 'rb'), ('stdout', 'wb'), ('stderr', 'wb')):
+            filename = code_info.get(f'{key}_name')
+            if filename:
+                streams[key] = stack.enter_context(open(workdir / filename, mode))
             else:
-                _log(f"Can not copy '{path.name}'.", error=True)
+                streams[key] = subprocess.DEVNULL
+        if code_info.get('join_files'):
+            streams['stderr'] = subprocess.STDOUT
+        yield streams
 
 
-def copy_files(
-    src_dir: Path, dest_dir: Path, ignore_files: ty.Iterable[str], ignore_paths: ty.Iterable[str]
+def _find_code_info(workdir: Path, executable: str) -> ty.Dict[str, ty.Any]:
+    """Return the code info of the executable in the job template, or an empty dict if not found.
+
+    If the job template runs several codes, the first one called with this executable is used.
+    """
+    try:
+        with open(workdir / InputHasher.JOB_TEMPLATE_FILE, encoding='utf8') as handle:
+            codes_info = json.load(handle)['codes_info']
+    except (OSError, ValueError, KeyError, TypeError):
+        return {}
+    for code_info in codes_info:
+        cmdline_params = code_info.get('cmdline_params') or []
+        if len(codes_info) == 1 or (
+            cmdline_params and Path(cmdline_params[0]).name == Path(executable).name
+        ):
+            return ty.cast(ty.Dict[str, ty.Any], code_info)
+    return {}
+
+
+def configure_trace(env: MockVariables, process_name: str) -> None:
+    """Enable tracing of this process if requested by the variables, see :mod:`._trace`.
+
+    :param env: Variables of the mock code execution, defining the trace directory
+    :param process_name: Name of the process shown in the timeline
+    """
+    if env.trace_dir is None:
+        return
+    try:
+        configure(env.trace_dir, process_name, memory=env.trace_memory)
+    except OSError:
+        return
+    set_test_name(env.test_name)
+
+
+def get_logger(env: MockVariables, exit_on_error: bool = True) -> ty.Callable[..., None]:
+    """Return a function writing messages to the log file of the mock code.
+
+    :param env: Variables of the mock code execution.
+    :param exit_on_error: If True, logging an error exits the process. Otherwise, a RuntimeError is raised.
+    """
+
+    def _log(msg: str, error: bool = False) -> None:
+        """Write a message to the log file."""
+        if error:
+            msg = f"ERROR: {msg}"
+        with open(env.log_file, 'a', encoding='utf8') as log_file:
+            log_file.write(f"{datetime.now()}:{env.label}: {msg}\n")
+        if error:
+            if exit_on_error:
+                sys.exit(msg)
+            raise RuntimeError(msg)
+
+    return _log
+
+
+def run_on_server(cwd: Path, socket_path: ty.Optional[Path] = None) -> bool:
+    """Ask the mock code server to replay a cached result into ``cwd``.
+
+    The request consists of the working directory and the ``AIIDA_MOCK_*`` environment variables.
+
+    :param socket_path: Path of the socket of the server, defaults to the one in the environment variables.
+    :return: True if the server restored a cached result, False if there is no server or no cache hit.
+    """
+    address = str(socket_path) if socket_path is not None else os.environ.get(
+        _EnvKeys.SERVER_SOCKET.value, ''
+    )
+    if not address or not os.path.exists(address):
+        return False
+
+    request = {
+        'cwd': os.path.abspath(cwd),
+        'env': {key: value
+                for key, value in os.environ.items() if key.startswith('AIIDA_MOCK_')},
+    }
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(address)
+            sock.sendall(json.dumps(request).encode() + b'\n')
+            with sock.makefile('rb') as handle:
+                response: ty.Dict[str, ty.Any] = json.loads(handle.readline())
+    except (OSError, ValueError):
+        return False
+    return bool(response.get('status') == 'hit')
+
+
+def restore_files(
+    data_directory: DataDirectory, hashed: HashedInputs, dest_dir: Path, env: MockVariables,
+    log: ty.Callable[..., None]
 ) -> None:
+    """Copy the cached outputs from the data directory to the working directory, and record their use.
+
+    :param data_directory: Data directory containing the results
+    :param hashed: Hash of the inputs, naming the results and recorded in the statistics of the session
+    :param dest_dir: Working directory of the calculation
+    :param env: Variables of the mock code execution, defining the restore strategy
+    :param log: Logging function of the mock code
+    """
+    name = hashed.name
+    restorer = FileRestorer(env.restore_strategy)
+    start = time.perf_counter()
+    try:
+        with span('restore', 'restore', key=name, source=hashed.source) as args:
+            data_directory.restore(
+                name, dest_dir, restorer, include=get_retrieve_filter(dest_dir, env)
+            )
+            args['bytes'] = restorer.restored_bytes
+    except OSError as exc:
+        log(f"Can not restore '{name}': {exc}", error=True)
+    restore_time = time.perf_counter() - start
+    log(f"Restored outputs with strategies: {restorer.summary()}")
+    record_use(data_directory=data_directory, name=name, env=env)
+    if env.stats_file is not None:
+        record_stats(
+            env,
+            key=name,
+            hit=True,
+            source=hashed.source,
+            hash_time=hashed.hash_time,
+            inputs=hashed.inputs,
+            restore_time=restore_time,
+            bytes=restorer.restored_bytes,
+            run_time=data_directory.read_metadata(name).get('run_time'),
+        )
+
+
+def record_stats(env: MockVariables, **fields: ty.Any) -> None:
+    """Append a record of this invocation to the statistics file of the session, see :mod:`._stats`.
+
+    :param env: Variables of the mock code execution, defining the statistics file
+    :param fields: Fields of the record, in addition to the label, the test and the data directory
+    """
+    if env.stats_file is None:
+        return
+    record = {'label': env.label, 'test': env.test_name, 'data_dir': str(env.data_dir), **fields}
+    if env.test_id is not None:
+        record['test_id'] = env.test_id
+    if env.hasher_reference is not None:
+        record['hasher'] = env.hasher_reference
+    try:
+        append_record(env.stats_file, record)
+    except OSError:
+        pass
+
+
+def record_use(data_directory: DataDirectory, name: str, env: MockVariables) -> None:
+    """Record the use of the results in the usage log of the data directory, see :mod:`._usage`.
+
+    :param data_directory: Data directory containing the results
+    :param name: Name of the results directory
+    :param env: Variables of the mock code execution, defining the test session
+    """
+    if env.session is None:
+        return
+    try:
+        UsageLog(data_directory.path).record(env.session, name)
+    except OSError:
+        # e.g. read-only data directories, which are never garbage collected
+        pass
+
+
+def get_retrieve_filter(workdir: Path, env: MockVariables) -> ty.Optional[RetrieveFilter]:
+    """Return the filter selecting the files retrieved by AiiDA, or None if all files are stored and restored.
+
+    :param workdir: Working directory of the calculation
+    :param env: Variables of the mock code execution
+    """
+    if not env.retrieve_only:
+        return None
+    patterns = load_retrieve_patterns(workdir)
+    return RetrieveFilter(patterns) if patterns is not None else None
+
+
+def copy_files(
+    src_dir: Path,
+    dest_dir: Path,
+    ignore_files: ty.Iterable[str],
+    ignore_paths: ty.Iterable[str],
+    include: ty.Optional[ty.Callable[[str], bool]] = None,
+) -> int:
     """Copy files from source to destination directory while ignoring certain files/folders.
 
     :param src_dir: Source directory
@@ -98,7 +512,28 @@ def copy_files(
     :param ignore_files: A list of file names (UNIX shell style patterns allowed) which are not copied to the
         destination.
     :param ignore_paths: A list of paths (UNIX shell style patterns allowed) which are not copied to the destination.
+    :param include: If given, only files whose relative POSIX path satisfies this predicate are copied.
+    :return: The total size of the copied files, in bytes.
+    """
+    return store_files(
+        src_dir, dest_dir, select_files(src_dir, ignore_files, ignore_paths, include)
+    )
+
+
+def select_files(
+    src_dir: Path,
+    ignore_files: ty.Iterable[str],
+    ignore_paths: ty.Iterable[str],
+    include: ty.Optional[ty.Callable[[str], bool]] = None,
+) -> ty.List[str]:
+    """Return the relative POSIX paths of the files in the source directory, except ignored files/folders.
+
+    :param src_dir: Source directory
+    :param ignore_files: A list of file names (UNIX shell style patterns allowed) which are not selected.
+    :param ignore_paths: A list of paths (UNIX shell style patterns allowed) which are not selected.
+    :param include: If given, only files whose relative POSIX path satisfies this predicate are selected.
     """
+    selected = []
     exclude_paths: ty.Set = {filepath for path in ignore_paths for filepath in src_dir.glob(path)}
     exclude_files = {path.relative_to(src_dir) for path in exclude_paths if path.is_file()}
     exclude_dirs = {path.relative_to(src_dir) for path in exclude_paths if path.is_dir()}
@@ -122,7 +557,45 @@ def copy_files(
             if relative_dir / filename in exclude_files:
                 continue
 
-            os.makedirs(dest_dir / relative_dir, exist_ok=True)
+            relative_file_path = (relative_dir / filename).as_posix()
+            if include is not None and not include(relative_file_path):
+                continue
+            selected.append(relative_file_path)
+    return selected
+
+
+def store_files(
+    src_dir: Path,
+    dest_dir: Path,
+    files: ty.Iterable[str],
+    object_store: ty.Optional[ObjectStore] = None,
+    chunked: bool = False,
+) -> int:
+    """Copy the selected files from source to destination directory, or add them to an object store.
+
+    :param src_dir: Source directory
+    :param dest_dir: Destination directory
+    :param files: Relative POSIX paths of the files to copy, see :func:`select_files`
+    :param object_store: If given, files are added to this object store and the destination directory only
+        contains a manifest referencing them.
+    :param chunked: If True, files are split into content-defined chunks before adding them to the object store.
+    :return: The total size of the copied files, in bytes.
+    """
+    copied_bytes = 0
+    manifest: ty.Dict[str, str] = {}
+    manifest_chunks: ty.Dict[str, ty.List[str]] = {}
+    for relative_path in files:
+        src_path = src_dir / relative_path
+        copied_bytes += src_path.stat().st_size
+        if object_store is not None and chunked:
+            manifest_chunks[relative_path] = object_store.add_chunked_file(src_path)
+        elif object_store is not None:
+            manifest[relative_path] = object_store.add_file(src_path)
+        else:
+            dest_path = dest_dir / relative_path
+            dest_path.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(src_path, dest_path)
 
-            relative_file_path = relative_dir / filename
-            shutil.copyfile(src_dir / relative_file_path, dest_dir / relative_file_path)
+    if object_store is not None:
+        write_manifest(dest_dir, manifest, manifest_chunks)
+    return copied_bytes
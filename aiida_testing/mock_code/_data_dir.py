@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+"""
+Lookup of mock code results in a data directory, in any of the supported layouts.
+"""
+import contextlib
+import fcntl
+import functools
+import io
+import json
+import os
+from pathlib import Path
+import shutil
+import tempfile
+import typing as ty
+
+from ._pack import PACK_FILE, PackFile
+from ._restore import FileRestorer
+from ._storage import DATA_LAYOUTS, MANIFEST_FILE, META_PREFIX, METADATA_FILE, ObjectStore, entry_path, \
+    iter_entries, read_manifest, read_metadata, restore_entry
+from ._trace import span
+
+if ty.TYPE_CHECKING:
+    from ._backends import StorageBackend  # pylint: disable=unused-import,cyclic-import
+
+__all__ = ("DataDirectory", )
+
+#: Directory of the per-entry lock files, relative to the data directory
+LOCK_DIR = '.locks'
+
+#: Directory in which new results directories are written before publishing them, relative to the data directory
+STAGING_DIR = '.staging'
+
+
+class DataDirectory:
+    """
+    Data directory of the mock code, containing one results directory per set of inputs.
+
+    Results directories take precedence over entries of the same name in the pack file,
+    so regenerated results shadow outdated packed ones. Results directories are looked up
+    in all layouts, such that a data directory can be migrated between layouts gradually.
+
+    :param path: Path of the data directory.
+    :param object_store: Path of the object store, see :meth:`.ObjectStore.for_data_dir`.
+    :param layout: Layout of new results directories, one of ``DATA_LAYOUTS``.
+    :param remote: Storage backend consulted for results missing in the data directory. If given,
+        new results are published to the backend instead of the data directory.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        object_store: ty.Optional[Path] = None,
+        layout: str = 'flat',
+        remote: ty.Optional['StorageBackend'] = None,
+    ) -> None:
+        if layout not in DATA_LAYOUTS:
+            raise ValueError(
+                f"Unknown data directory layout '{layout}', choose from {DATA_LAYOUTS}."
+            )
+        self.path = Path(path)
+        self.object_store = ObjectStore.for_data_dir(self.path, object_store)
+        self.layout = layout
+        self.remote = remote
+        self._pack: ty.Optional[PackFile] = None
+
+    def close(self) -> None:
+        """Close the pack file and the remote backend. The pack file is opened again on the next access."""
+        if self._pack is not None:
+            self._pack.close()
+            self._pack = None
+        if self.remote is not None:
+            self.remote.close()
+
+    def __enter__(self) -> 'DataDirectory':
+        return self
+
+    def __exit__(self, *exc_info: ty.Any) -> None:
+        self.close()
+
+    @property
+    def pack(self) -> ty.Optional[PackFile]:
+        """The pack file of the data directory, if present."""
+        pack_path = self.path / PACK_FILE
+        if self._pack is None and pack_path.exists():
+            self._pack = PackFile(pack_path)
+        return self._pack
+
+    def entry_dir(self, name: str) -> Path:
+        """Return the path of the results directory of the given name in the layout of new results."""
+        return entry_path(self.path, name, self.layout)
+
+    def find_dir(self, name: str) -> ty.Optional[Path]:
+        """Return the path of the existing results directory of the given name, in any layout."""
+        layouts = (self.layout, ) + tuple(
+            layout for layout in DATA_LAYOUTS if layout != self.layout
+        )
+        for layout in layouts:
+            path = entry_path(self.path, name, layout)
+            if path.is_dir():
+                return path
+        return None
+
+    def contains(self, name: str) -> bool:
+        """Return whether results of the given name are present."""
+        if self.find_dir(name) is not None:
+            return True
+        if self.pack is not None and self.pack.find(name) is not None:
+            return True
+        return self.remote is not None and self.remote.lookup(name)
+
+    def names(self) -> ty.List[str]:
+        """Return the names of all results, in results directories and in the pack file."""
+        names = {name for name, _ in iter_entries(self.path)}
+        if self.pack is not None:
+            names.update(self.pack.names())
+        return sorted(names)
+
+    def remove(self, name: str) -> None:
+        """Remove the results directories of the given name, if present."""
+        res_dir = self.find_dir(name)
+        while res_dir is not None:
+            shutil.rmtree(res_dir)
+            self._remove_empty_parents(res_dir)
+            res_dir = self.find_dir(name)
+
+    @contextlib.contextmanager
+    def lock(self, name: str) -> ty.Iterator[bool]:
+        """Hold an exclusive lock on the results of the given name, across processes.
+
+        The lock is held by the process running the actual code for these results, such
+        that concurrent processes wait for its results instead of running the code again.
+
+        :return: Context manager yielding True if another process held the lock, i.e. this process had to wait.
+        """
+        lock_path = _create_private_dir(self.path / LOCK_DIR) / f'{name}.lock'
+        waited = False
+        while True:
+            with open(lock_path, 'w', encoding='utf8') as handle:
+                try:
+                    fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    with span('wait for lock', 'lock', key=name):
+                        fcntl.flock(handle, fcntl.LOCK_EX)
+                    waited = True
+                # the lock file may have been removed by :meth:`remove_lock` before it was locked
+                if not _is_same_file(handle, lock_path):
+                    continue
+                try:
+                    yield waited
+                finally:
+                    fcntl.flock(handle, fcntl.LOCK_UN)
+                return
+
+    def lock_names(self) -> ty.List[str]:
+        """Return the names of the results that have a lock file."""
+        lock_dir = self.path / LOCK_DIR
+        if not lock_dir.is_dir():
+            return []
+        return sorted(path.name[:-len('.lock')] for path in lock_dir.glob('*.lock'))
+
+    def remove_lock(self, name: str) -> bool:
+        """Remove the lock file of the given name, unless a process holds the lock.
+
+        :return: Whether the lock file was removed.
+        """
+        lock_path = self.path / LOCK_DIR / f'{name}.lock'
+        try:
+            with open(lock_path, 'r', encoding='utf8') as handle:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                if not _is_same_file(handle, lock_path):
+                    return False
+                lock_path.unlink()
+                return True
+        except (BlockingIOError, FileNotFoundError):
+            return False
+
+    @contextlib.contextmanager
+    def staging_dir(self, name: str) -> ty.Iterator[Path]:
+        """Provide a directory for writing new results, and publish it atomically as the results of the given name.
+
+        The results are only published if the context exits without an exception. Existing results of
+        the same name are replaced. The caller should hold the :meth:`lock` of the results.
+        """
+        staging_root = _create_private_dir(self.path / STAGING_DIR)
+        staging = Path(tempfile.mkdtemp(dir=staging_root, prefix=f'{name}-'))
+        try:
+            yield staging
+            self.remove(name)
+            if self.remote is not None:
+                self.remote.publish(name, self._dir_file_openers(staging))
+                return
+            target = self.entry_dir(name)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            staging.rename(target)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def restore(
+        self,
+        name: str,
+        dest_dir: Path,
+        restorer: FileRestorer,
+        include: ty.Optional[ty.Callable[[str], bool]] = None,
+    ) -> None:
+        """Restore the results of the given name into the destination directory.
+
+        :param include: If given, only files whose relative path satisfies this predicate are restored.
+        """
+        res_dir = self.find_dir(name)
+        if res_dir is not None:
+            restore_entry(res_dir, dest_dir, restorer, self.object_store, include=include)
+        elif self.pack is not None and self.pack.find(name) is not None:
+            count, size = self.pack.extract(
+                name, dest_dir, exclude_prefix=META_PREFIX, include=include
+            )
+            restorer.counts['pack'] += count
+            restorer.restored_bytes += size
+        elif self.remote is not None:
+            self.remote.fetch(name, dest_dir, restorer, include=include)
+        else:
+            raise FileNotFoundError(f"No results '{name}' in '{self.path}'.")
+
+    def read_metadata(self, name: str) -> ty.Dict[str, ty.Any]:
+        """Return the metadata of the results of the given name, or an empty dict if there is none."""
+        res_dir = self.find_dir(name)
+        if res_dir is not None:
+            return read_metadata(res_dir)
+        if self.pack is not None and self.pack.find(name) is not None:
+            try:
+                return ty.cast(
+                    ty.Dict[str, ty.Any], json.loads(self.pack.read(name, METADATA_FILE))
+                )
+            except (KeyError, ValueError):
+                return {}
+        if self.remote is not None:
+            return self.remote.read_metadata(name)
+        return {}
+
+    def file_openers(self, name: str) -> ty.Dict[str, ty.Callable[[], ty.BinaryIO]]:
+        """Return functions opening each file of the given results, keyed by relative path.
+
+        Files referenced by a manifest are resolved, such that the result is independent of the storage layout.
+        """
+        openers: ty.Dict[str, ty.Callable[[], ty.BinaryIO]] = {}
+        res_dir = self.find_dir(name)
+        if res_dir is None:
+            pack = self.pack
+            assert pack is not None
+            for path, *_ in pack.files(name):
+                openers[path] = functools.partial(_open_bytes, pack.read, name, path)
+            return openers
+        return self._dir_file_openers(res_dir)
+
+    def _dir_file_openers(self, res_dir: Path) -> ty.Dict[str, ty.Callable[[], ty.BinaryIO]]:
+        """Return functions opening each file of a results directory, keyed by relative path."""
+        openers: ty.Dict[str, ty.Callable[[], ty.BinaryIO]] = {}
+        manifest = read_manifest(res_dir) or {}
+        for dirpath, _, filenames in os.walk(res_dir):
+            for filename in filenames:
+                full_path = Path(dirpath) / filename
+                relative_path = full_path.relative_to(res_dir).as_posix()
+                if relative_path != MANIFEST_FILE:
+                    openers[relative_path] = functools.partial(_open_file, full_path)
+        for relative_path, digest in manifest.get('files', {}).items():
+            openers[relative_path] = functools.partial(
+                _open_file, self.object_store.object_path(digest)
+            )
+        for relative_path, digests in manifest.get('chunks', {}).items():
+            openers[relative_path] = functools.partial(_open_chunks, self.object_store, digests)
+        return openers
+
+    def migrate(self, name: str) -> bool:
+        """Move the results directory of the given name to the layout of new results.
+
+        The results directory is renamed, so the hash of the inputs is not recomputed.
+
+        :return: True if the results directory was moved.
+        """
+        res_dir = self.find_dir(name)
+        target = self.entry_dir(name)
+        if res_dir is None or res_dir == target:
+            return False
+        target.parent.mkdir(parents=True, exist_ok=True)
+        res_dir.rename(target)
+        self._remove_empty_parents(res_dir)
+        return True
+
+    def _remove_empty_parents(self, res_dir: Path) -> None:
+        """Remove the label and shard directories of a removed results directory, if empty."""
+        parent = res_dir.parent
+        while parent != self.path and not any(parent.iterdir()):
+            parent.rmdir()
+            parent = parent.parent
+
+
+def _create_private_dir(path: Path) -> Path:
+    """Create a directory for transient files, which is ignored by git."""
+    if not path.is_dir():
+        path.mkdir(exist_ok=True)
+        (path / '.gitignore').write_text('*\n', encoding='utf8')
+    return path
+
+
+def _is_same_file(handle: ty.IO, path: Path) -> bool:
+    """Return whether the open file is still present at the given path."""
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return False
+    handle_stat = os.fstat(handle.fileno())
+    return (handle_stat.st_dev, handle_stat.st_ino) == (stat.st_dev, stat.st_ino)
+
+
+def _open_file(path: Path) -> ty.BinaryIO:
+    """Open a file as a binary stream."""
+    return open(path, 'rb')  # pylint: disable=consider-using-with
+
+
+def _open_bytes(read: ty.Callable[[str, str], bytes], name: str, path: str) -> ty.BinaryIO:
+    """Open a file of a pack as a binary stream."""
+    return io.BytesIO(read(name, path))
+
+
+def _open_chunks(object_store: ObjectStore, digests: ty.List[str]) -> ty.BinaryIO:
+    """Open a chunked file as a binary stream."""
+    return io.BytesIO(b''.join(object_store.object_path(digest).read_bytes() for digest in digests))
@@ -2,14 +2,31 @@
 """
 Defines the environment variable names for the mock code execution.
 """
+import dataclasses
 from dataclasses import dataclass
+from datetime import datetime
 from enum import Enum
+import functools
+import hashlib
 import inspect
+import json
 import os
 from pathlib import Path
 import typing as ty
 
+from ._backends import create_backend
+from ._fingerprint import fingerprint_changed
 from ._hasher import InputHasher, load_hasher
+from ._normalize import NormalizationRules, compile_rules
+from ._data_dir import DataDirectory
+
+#: Fields of :class:`MockVariables` holding paths, stored as strings in snapshots
+_PATH_FIELDS = (
+    'log_file', 'data_dir', 'server_socket', 'object_store', 'stats_file', 'trace_dir',
+    'verify_file'
+)
+#: Fields of :class:`MockVariables` specific to the test using the code, see :meth:`MockVariables.test_env`
+_TEST_FIELDS = ('log_file', 'test_name', 'test_id')
 
 
 @dataclass
@@ -28,24 +45,123 @@ class MockVariables:  # pylint: disable=too-many-instance-attributes
     regenerate_data: bool
     fail_on_missing: bool
     _hasher: ty.Union[str, ty.Type[InputHasher]]
+    server_socket: ty.Optional[Path] = None
+    restore_strategy: str = 'auto'
+    storage: str = 'files'
+    object_store: ty.Optional[Path] = None
+    data_layout: str = 'flat'
+    retrieve_only: bool = True
+    max_concurrent_runs: ty.Optional[int] = None
+    label_max_concurrent_runs: ty.Optional[int] = None
+    cpu_affinity: bool = False
+    backend: ty.Optional[ty.Dict[str, ty.Any]] = None
+    session: ty.Optional[str] = None
+    stats_file: ty.Optional[Path] = None
+    trace_dir: ty.Optional[Path] = None
+    trace_memory: bool = False
+    fingerprint: ty.Optional[ty.Dict[str, str]] = None
+    regenerate_outdated: bool = False
+    regenerate_older_than: ty.Optional[float] = None
+    version: ty.Optional[str] = None
+    verify_sample: ty.Optional[float] = None
+    verify_budget: ty.Optional[float] = None
+    verify_file: ty.Optional[Path] = None
+    test_id: ty.Optional[str] = None
+    normalize: ty.Optional[ty.Dict[str, ty.Any]] = None
+    submit_hashing: str = 'script'
 
     @classmethod
-    def from_env(cls) -> "MockVariables":
+    def from_env(cls, environ: ty.Optional[ty.Mapping[str, str]] = None) -> "MockVariables":
         """
         Create a MockVariables instance from the environment variables.
+
+        :param environ: Mapping to read the variables from, defaults to ``os.environ``.
+        """
+        if environ is None:
+            environ = os.environ
+        snapshot = environ.get(_EnvKeys.SNAPSHOT.value)
+        if snapshot:
+            variables = cls.from_snapshot(_read_snapshot(snapshot))
+            # the variables of the test take precedence, since codes may be shared between tests
+            for name, value in _parse_env(environ, _TEST_FIELDS).items():
+                setattr(variables, name, value)
+            return variables
+        values = _parse_env(environ, [field.name for field in dataclasses.fields(cls)])
+        for field in dataclasses.fields(cls):
+            if field.name in values or field.name in _ENV_DEFAULTS:
+                continue
+            if field.default is dataclasses.MISSING:
+                raise KeyError(_ENV_FIELDS[field.name][0].value)
+        return cls(**{**_ENV_DEFAULTS, **values})
+
+    @classmethod
+    def from_snapshot(cls, snapshot: ty.Mapping[str, ty.Any]) -> "MockVariables":
+        """
+        Create a MockVariables instance from a snapshot, see :meth:`to_snapshot`.
+        """
+        values = dict(snapshot)
+        hasher = values.pop('hasher', None) or InputHasher
+        for name in _PATH_FIELDS:
+            if values.get(name) is not None:
+                values[name] = Path(values[name])
+        values.setdefault('log_file', Path(os.devnull))
+        values.setdefault('test_name', '')
+        return cls(_hasher=hasher, **values)
+
+    def to_snapshot(self, per_test: bool = True) -> ty.Dict[str, ty.Any]:
+        """
+        Return the fully resolved variables as a JSON-serializable mapping.
+
+        :param per_test: If False, leave out the variables of :meth:`test_env`, which are then inherited from the
+            environment of the calculation. This allows sharing a code between tests.
+        """
+        snapshot: ty.Dict[str, ty.Any] = {}
+        for field in dataclasses.fields(self):
+            value = getattr(self, field.name)
+            if field.name == '_hasher':
+                snapshot['hasher'] = self.hasher_reference
+                continue
+            if not per_test and field.name in _TEST_FIELDS:
+                continue
+            if field.name in _PATH_FIELDS and value is not None:
+                value = str(value)
+            elif field.name in ('ignore_files', 'ignore_paths'):
+                value = list(value)
+            snapshot[field.name] = value
+        return snapshot
+
+    def write_snapshot(self, directory: Path, per_test: bool = True) -> Path:
+        """
+        Write the snapshot of the variables to a file in the directory, named by the digest of its content.
+
+        :param per_test: If False, leave out the variables of :meth:`test_env`, see :meth:`to_snapshot`.
+        :return: The path of the snapshot file, to be passed to the mock code via :meth:`snapshot_to_env`.
+        """
+        content = json.dumps(self.to_snapshot(per_test), sort_keys=True).encode()
+        path = Path(directory) / f"snapshot-{hashlib.sha256(content).hexdigest()[:16]}.json"
+        if not path.exists():
+            tmp_path = path.with_name(f".{path.name}.{os.getpid()}")
+            tmp_path.write_bytes(content)
+            os.replace(tmp_path, path)
+        return path
+
+    @staticmethod
+    def snapshot_to_env(path: Path) -> str:
+        """
+        Return a string that can be used to export the pointer to a snapshot file
         """
-        return cls(
-            log_file=Path(os.environ[_EnvKeys.LOG_FILE.value]),
-            label=os.environ[_EnvKeys.LABEL.value],
-            test_name=os.environ[_EnvKeys.TEST_NAME.value],
-            data_dir=Path(os.environ[_EnvKeys.DATA_DIR.value]),
-            executable_path=os.environ[_EnvKeys.EXECUTABLE_PATH.value],
-            ignore_files=os.environ[_EnvKeys.IGNORE_FILES.value].split(":"),
-            ignore_paths=os.environ[_EnvKeys.IGNORE_PATHS.value].split(":"),
-            regenerate_data=os.environ[_EnvKeys.REGENERATE_DATA.value] == "True",
-            fail_on_missing=os.environ[_EnvKeys.FAIL_ON_MISSING.value] == "True",
-            _hasher=os.environ.get(_EnvKeys.HASHER.value, InputHasher),
-        )
+        return f'export {_EnvKeys.SNAPSHOT.value}="{path}"'
+
+    @property
+    def hasher_reference(self) -> ty.Optional[str]:
+        """
+        Return the ``path::ClassName`` reference of a custom hasher, or None for the default hasher.
+        """
+        if self._hasher is InputHasher:
+            return None
+        if isinstance(self._hasher, str):
+            return self._hasher
+        return f"{os.path.abspath(inspect.getfile(self._hasher))}::{self._hasher.__name__}"
 
     def get_hasher(self) -> ty.Type[InputHasher]:
         """
@@ -57,30 +173,73 @@ class MockVariables:  # pylint: disable=too-many-instance-attributes
             return load_hasher(file_path, class_name)
         return self._hasher
 
-    def to_env(self) -> str:
-        """
-        Return a string that can be used to export the environmental variables
-        """
-        string = inspect.cleandoc(
-            f"""
-                export {_EnvKeys.LOG_FILE.value}="{self.log_file}"
-                export {_EnvKeys.TEST_NAME.value}="{self.test_name.replace('"', "_")}"
-                export {_EnvKeys.LABEL.value}="{self.label}"
-                export {_EnvKeys.DATA_DIR.value}="{self.data_dir}"
-                export {_EnvKeys.EXECUTABLE_PATH.value}="{self.executable_path}"
-                export {_EnvKeys.IGNORE_FILES.value}="{':'.join(self.ignore_files)}"
-                export {_EnvKeys.IGNORE_PATHS.value}="{':'.join(self.ignore_paths)}"
-                export {_EnvKeys.REGENERATE_DATA.value}={'True' if self.regenerate_data else 'False'}
-                export {_EnvKeys.FAIL_ON_MISSING.value}={'True' if self.fail_on_missing else 'False'}
-                """
-        )
-        if self._hasher is not InputHasher:
-            if isinstance(self._hasher, str):
-                value = self._hasher
-            else:
-                value = f"{os.path.abspath(inspect.getfile(self._hasher))}::{self._hasher.__name__}"
-            string += f'\nexport {_EnvKeys.HASHER.value}="{value}"'
-        return string
+    def get_normalization(self) -> ty.Optional[NormalizationRules]:
+        """
+        Return the compiled normalization rules of the input files, or None if there are no rules.
+        """
+        return compile_rules(self.normalize) if self.normalize else None
+
+    def get_data_directory(self) -> DataDirectory:
+        """
+        Return the data directory, providing lookup of results in all layouts.
+        """
+        remote = create_backend(self.backend) if self.backend is not None else None
+        return DataDirectory(self.data_dir, self.object_store, self.data_layout, remote=remote)
+
+    def should_regenerate(self, data_directory: DataDirectory, name: str) -> bool:
+        """
+        Return whether the existing results of the given name are regenerated instead of restored.
+
+        Besides regenerating all results, results can be selected by their metadata: results created by an
+        executable with a different fingerprint, or created longer ago than ``regenerate_older_than`` seconds.
+        Results without a recorded creation time count as older than any age.
+        """
+        if self.regenerate_data:
+            return True
+        if not self.regenerate_outdated and self.regenerate_older_than is None:
+            return False
+        metadata = data_directory.read_metadata(name)
+        if self.regenerate_outdated and fingerprint_changed(
+            metadata.get('fingerprint'), self.fingerprint
+        ):
+            return True
+        if self.regenerate_older_than is not None:
+            try:
+                created = datetime.fromisoformat(metadata['created'])
+            except (KeyError, TypeError, ValueError):
+                return True
+            return (datetime.now() - created).total_seconds() > self.regenerate_older_than
+        return False
+
+    def test_env(self) -> ty.Dict[str, str]:
+        """
+        Return the environment variables specific to the test using the code.
+        """
+        environ = {
+            _EnvKeys.LOG_FILE.value: str(self.log_file),
+            _EnvKeys.TEST_NAME.value: self.test_name,
+        }
+        if self.test_id is not None:
+            environ[_EnvKeys.TEST_ID.value] = self.test_id
+        return environ
+
+
+@functools.lru_cache(maxsize=None)
+def _read_snapshot(path: str) -> ty.Dict[str, ty.Any]:
+    """Read a snapshot file. Snapshot files are named by their content, hence read only once per process."""
+    with open(path, 'rb') as handle:
+        return ty.cast(ty.Dict[str, ty.Any], json.load(handle))
+
+
+def _parse_env(environ: ty.Mapping[str, str], names: ty.Iterable[str]) -> ty.Dict[str, ty.Any]:
+    """Return the values of the given fields of :class:`MockVariables` which are set in the environment."""
+    values = {}
+    for name in names:
+        key, converter = _ENV_FIELDS[name]
+        value = environ.get(key.value)
+        if value is not None and (value or converter.keep_empty):
+            values[name] = converter.parse(value)
+    return values
 
 
 class _EnvKeys(Enum):
@@ -99,3 +258,93 @@ class _EnvKeys(Enum):
     REGENERATE_DATA = "AIIDA_MOCK_REGENERATE_DATA"
     FAIL_ON_MISSING = "AIIDA_MOCK_FAIL_ON_MISSING"
     HASHER = "AIIDA_MOCK_HASHER"
+    SERVER_SOCKET = "AIIDA_MOCK_SERVER_SOCKET"
+    RESTORE_STRATEGY = "AIIDA_MOCK_RESTORE_STRATEGY"
+    STORAGE = "AIIDA_MOCK_STORAGE"
+    OBJECT_STORE = "AIIDA_MOCK_OBJECT_STORE"
+    DATA_LAYOUT = "AIIDA_MOCK_DATA_LAYOUT"
+    RETRIEVE_ONLY = "AIIDA_MOCK_RETRIEVE_ONLY"
+    MAX_CONCURRENT_RUNS = "AIIDA_MOCK_MAX_CONCURRENT_RUNS"
+    LABEL_MAX_CONCURRENT_RUNS = "AIIDA_MOCK_LABEL_MAX_CONCURRENT_RUNS"
+    CPU_AFFINITY = "AIIDA_MOCK_CPU_AFFINITY"
+    BACKEND = "AIIDA_MOCK_BACKEND"
+    SESSION = "AIIDA_MOCK_SESSION"
+    STATS_FILE = "AIIDA_MOCK_STATS_FILE"
+    TRACE_DIR = "AIIDA_MOCK_TRACE_DIR"
+    TRACE_MEMORY = "AIIDA_MOCK_TRACE_MEMORY"
+    FINGERPRINT = "AIIDA_MOCK_FINGERPRINT"
+    REGENERATE_OUTDATED = "AIIDA_MOCK_REGENERATE_OUTDATED"
+    REGENERATE_OLDER_THAN = "AIIDA_MOCK_REGENERATE_OLDER_THAN"
+    VERSION = "AIIDA_MOCK_VERSION"
+    VERIFY_SAMPLE = "AIIDA_MOCK_VERIFY_SAMPLE"
+    VERIFY_BUDGET = "AIIDA_MOCK_VERIFY_BUDGET"
+    VERIFY_FILE = "AIIDA_MOCK_VERIFY_FILE"
+    TEST_ID = "AIIDA_MOCK_TEST_ID"
+    SNAPSHOT = "AIIDA_MOCK_SNAPSHOT"
+    NORMALIZE = "AIIDA_MOCK_NORMALIZE"
+    SUBMIT_HASHING = "AIIDA_MOCK_SUBMIT_HASHING"
+
+
+class _Converter(ty.NamedTuple):
+    """Conversion of a field of :class:`MockVariables` from the value of its environment variable."""
+
+    parse: ty.Callable[[str], ty.Any]
+    #: Whether an empty string is a value, instead of standing for an unset variable
+    keep_empty: bool = False
+
+
+_STR = _Converter(str, keep_empty=True)
+_PATH = _Converter(Path)
+_BOOL = _Converter(lambda value: value == 'True')
+_INT = _Converter(int)
+_FLOAT = _Converter(float)
+_LIST = _Converter(lambda value: value.split(':'), keep_empty=True)
+_JSON = _Converter(json.loads)
+
+#: Environment variables of the fields of :class:`MockVariables`
+_ENV_FIELDS: ty.Dict[str, ty.Tuple[_EnvKeys, _Converter]] = {
+    name: (key, converter)
+    for name, key, converter in (
+        ('log_file', _EnvKeys.LOG_FILE, _PATH),
+        ('label', _EnvKeys.LABEL, _STR),
+        ('test_name', _EnvKeys.TEST_NAME, _STR),
+        ('data_dir', _EnvKeys.DATA_DIR, _PATH),
+        ('executable_path', _EnvKeys.EXECUTABLE_PATH, _STR),
+        ('ignore_files', _EnvKeys.IGNORE_FILES, _LIST),
+        ('ignore_paths', _EnvKeys.IGNORE_PATHS, _LIST),
+        ('regenerate_data', _EnvKeys.REGENERATE_DATA, _BOOL),
+        ('fail_on_missing', _EnvKeys.FAIL_ON_MISSING, _BOOL),
+        ('_hasher', _EnvKeys.HASHER, _STR),
+        ('server_socket', _EnvKeys.SERVER_SOCKET, _PATH),
+        ('restore_strategy', _EnvKeys.RESTORE_STRATEGY, _STR),
+        ('storage', _EnvKeys.STORAGE, _STR),
+        ('object_store', _EnvKeys.OBJECT_STORE, _PATH),
+        ('data_layout', _EnvKeys.DATA_LAYOUT, _STR),
+        ('retrieve_only', _EnvKeys.RETRIEVE_ONLY, _BOOL),
+        ('max_concurrent_runs', _EnvKeys.MAX_CONCURRENT_RUNS, _INT),
+        ('label_max_concurrent_runs', _EnvKeys.LABEL_MAX_CONCURRENT_RUNS, _INT),
+        ('cpu_affinity', _EnvKeys.CPU_AFFINITY, _BOOL),
+        ('backend', _EnvKeys.BACKEND, _JSON),
+        ('session', _EnvKeys.SESSION, _STR),
+        ('stats_file', _EnvKeys.STATS_FILE, _PATH),
+        ('trace_dir', _EnvKeys.TRACE_DIR, _PATH),
+        ('trace_memory', _EnvKeys.TRACE_MEMORY, _BOOL),
+        ('fingerprint', _EnvKeys.FINGERPRINT, _JSON),
+        ('regenerate_outdated', _EnvKeys.REGENERATE_OUTDATED, _BOOL),
+        ('regenerate_older_than', _EnvKeys.REGENERATE_OLDER_THAN, _FLOAT),
+        ('version', _EnvKeys.VERSION, _STR),
+        ('verify_sample', _EnvKeys.VERIFY_SAMPLE, _FLOAT),
+        ('verify_budget', _EnvKeys.VERIFY_BUDGET, _FLOAT),
+        ('verify_file', _EnvKeys.VERIFY_FILE, _PATH),
+        ('test_id', _EnvKeys.TEST_ID, _STR),
+        ('normalize', _EnvKeys.NORMALIZE, _JSON),
+        ('submit_hashing', _EnvKeys.SUBMIT_HASHING, _STR),
+    )
+}
+#: Values of the fields without default, if their environment variable is not set. Codes shared between tests
+#: may run without the variables of a test, see :meth:`MockVariables.test_env`.
+_ENV_DEFAULTS: ty.Dict[str, ty.Any] = {
+    'log_file': Path(os.devnull),
+    'test_name': '',
+    '_hasher': InputHasher,
+}
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Fingerprints of the actual executables of mock codes.
+
+The fingerprint of the executable that created a results directory is stored in its metadata
+(see :func:`._storage.write_metadata`). It consists of
+
+* ``path``: the path of the executable, as given in the configuration file
+* ``digest``: the SHA-256 digest of the executable file
+* ``version``: the output of the version command of the executable, if one is configured
+
+Comparing the stored fingerprint to the one of the current executable selects the results to
+regenerate after upgrading a code.
+
+Fingerprints are cached in :data:`FINGERPRINT_CACHE_DIR` by the path, modification time and size of
+the executable, such that each executable is hashed (and its version probed) only once, instead of
+in every test session.
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+import re
+import subprocess
+import tempfile
+import typing as ty
+
+from ._backends import DEFAULT_CACHE_DIR
+
+__all__ = ("executable_fingerprint", "fingerprint_changed", "probe_version")
+
+#: Fields of the fingerprint that identify the executable, as opposed to its location
+_IDENTITY_FIELDS = ('digest', 'version')
+
+_VERSION_PATTERN = re.compile(r'\d+(?:\.\d+)+')
+
+#: Directory of the fingerprints cached across processes
+FINGERPRINT_CACHE_DIR = DEFAULT_CACHE_DIR / 'fingerprints'
+
+_FINGERPRINTS: ty.Dict[ty.Tuple[str, int, int, ty.Tuple[str, ...]], ty.Dict[str, str]] = {}
+
+
+def executable_fingerprint(path: str, version_command: ty.Sequence[str] = ()) -> ty.Dict[str, str]:
+    """Return the fingerprint of the executable at the given path.
+
+    Fingerprints are cached as long as the executable is not modified, see :data:`FINGERPRINT_CACHE_DIR`.
+
+    :param path: Path of the executable.
+    :param version_command: Arguments passed to the executable to print its version, e.g. ``['--version']``.
+        If empty, the version is not part of the fingerprint.
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size, tuple(version_command))
+    if key not in _FINGERPRINTS:
+        cache_file = FINGERPRINT_CACHE_DIR / f'{hashlib.sha256(json.dumps(key).encode()).hexdigest()}.json'
+        fingerprint = _read_cached(cache_file)
+        if fingerprint is None:
+            fingerprint = _compute_fingerprint(path, version_command)
+            _write_cached(cache_file, fingerprint)
+        _FINGERPRINTS[key] = fingerprint
+    return dict(_FINGERPRINTS[key], path=path)
+
+
+def _compute_fingerprint(path: str, version_command: ty.Sequence[str]) -> ty.Dict[str, str]:
+    """Hash the executable at the given path, and run its version command."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for block in iter(lambda: handle.read(1 << 20), b''):
+            digest.update(block)
+    fingerprint = {'path': path, 'digest': f'sha256:{digest.hexdigest()}'}
+    if version_command:
+        # run in an empty directory, in case the executable writes files
+        with tempfile.TemporaryDirectory() as cwd:
+            result = subprocess.run([os.path.abspath(path), *version_command],
+                                    cwd=cwd,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT,
+                                    stdin=subprocess.DEVNULL,
+                                    check=False,
+                                    timeout=60)
+        fingerprint['version'] = result.stdout.decode(errors='replace').strip()
+    return fingerprint
+
+
+def _read_cached(cache_file: Path) -> ty.Optional[ty.Dict[str, str]]:
+    """Read a cached fingerprint, or return None if it is missing or invalid."""
+    try:
+        with open(cache_file, encoding='utf8') as handle:
+            fingerprint = ty.cast(ty.Dict[str, str], json.load(handle))
+    except (OSError, ValueError):
+        return None
+    return fingerprint if 'digest' in fingerprint else None
+
+
+def _write_cached(cache_file: Path, fingerprint: ty.Mapping[str, str]) -> None:
+    """Cache a fingerprint, unless the cache directory is not writable."""
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = cache_file.with_name(f'.{cache_file.name}.{os.getpid()}')
+        tmp_file.write_text(json.dumps(fingerprint), encoding='utf8')
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        pass
+
+
+def fingerprint_changed(
+    stored: ty.Optional[ty.Mapping[str, str]], current: ty.Optional[ty.Mapping[str, str]]
+) -> bool:
+    """Return whether results created by the ``stored`` executable are outdated with the ``current`` one.
+
+    Only the digest and the version are compared, so moving an executable does not outdate its results.
+    Results without a stored fingerprint are not considered outdated, since their executable is unknown.
+    """
+    if not stored or not current:
+        return False
+    return any(
+        current.get(field) is not None and stored.get(field) != current[field]
+        for field in _IDENTITY_FIELDS
+    )
+
+
+def probe_version(fingerprint: ty.Mapping[str, str]) -> str:
+    """Derive a version of the executable from its fingerprint.
+
+    This is the first version number (e.g. ``7.2`` or ``6.8.1``) in the output of the version command, or
+    else the start of the digest of the executable.
+    """
+    match = _VERSION_PATTERN.search(fingerprint.get('version', ''))
+    if match:
+        return match.group(0)
+    return fingerprint['digest'].split(':', 1)[-1][:12]
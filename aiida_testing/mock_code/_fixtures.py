@@ -3,32 +3,51 @@
 Defines a pytest fixture for creating mock AiiDA codes.
 """
 
+import argparse
 import uuid
+import json
 import shutil
 import pathlib
 import typing as ty
 import warnings
 import collections
 import os
-from pkg_resources import parse_version
+import re
+import shlex
+import subprocess
+import tempfile
 
-import click
 import pytest
 
-from aiida.orm import Code
-from aiida import __version__ as aiida_version
-
 from ._env_keys import MockVariables
-from ._hasher import InputHasher
+from ._fingerprint import executable_fingerprint, probe_version
+from ._hasher import SUBMIT_HASHING_MODES, InputHasher
+from ._normalize import compile_rules
+from ._server import MockCodeServer
+from ._session import MockCodeSession
+from ._storage import DATA_LAYOUTS, STORAGE_LAYOUTS
+from ._trace import span
 from .._config import Config, CONFIG_FILE_NAME, ConfigActions
 
+if ty.TYPE_CHECKING:
+    # only used in annotations, since aiida.orm is slow to import
+    from aiida.orm import Code  # pylint: disable=unused-import
+
 __all__ = (
     "pytest_addoption",
+    "pytest_configure",
     "testing_config_action",
     "mock_regenerate_test_data",
+    "mock_regenerate_selection",
+    "mock_code_versions",
     "mock_fail_on_missing",
     "mock_disable_mpi",
+    "mock_replay_in_process",
+    "mock_max_concurrent_runs",
+    "mock_cpu_affinity",
     "testing_config",
+    "mock_code_server",
+    "mock_code_pool",
     "mock_code_factory",
 )
 
@@ -37,7 +56,7 @@ def pytest_addoption(parser):
     """Add pytest command line options."""
     parser.addoption(
         "--testing-config-action",
-        type=click.Choice([c.value for c in ConfigActions]),
+        choices=[c.value for c in ConfigActions],
         default=ConfigActions.READ.value,
         help=f"Read {CONFIG_FILE_NAME} config file if present ('read'), require config file ('require') or " \
              "generate new config file ('generate').",
@@ -48,6 +67,36 @@ def pytest_addoption(parser):
         default=False,
         help="Regenerate test data."
     )
+    parser.addoption(
+        "--mock-regenerate-label",
+        action="append",
+        default=[],
+        metavar="LABEL",
+        help="Regenerate test data of the mock codes with this label. Can be given multiple times.",
+    )
+    parser.addoption(
+        "--mock-regenerate-outdated",
+        action="store_true",
+        default=False,
+        help="Regenerate test data created by a different version of the executable, according to "
+        "the executable fingerprint stored with the test data.",
+    )
+    parser.addoption(
+        "--mock-regenerate-older-than",
+        type=_parse_duration,
+        default=None,
+        metavar="AGE",
+        help="Regenerate test data created longer ago than AGE, e.g. '12h' or '30d'.",
+    )
+    parser.addoption(
+        "--mock-code-version",
+        action="append",
+        default=[],
+        type=_parse_code_version,
+        metavar="LABEL=VERSION",
+        help="Use the test data of this version of the mock codes with this label, overriding the "
+        "version in the configuration file. Can be given multiple times.",
+    )
     parser.addoption(
         "--mock-fail-on-missing",
         action="store_true",
@@ -60,6 +109,387 @@ def pytest_addoption(parser):
         default=False,
         help="Run all calculations with `metadata.options.usempi=False`.",
     )
+    parser.addoption(
+        "--mock-replay-in-process",
+        action="store_true",
+        default=False,
+        help="Restore cached results of mock codes inside the pytest process, without launching the "
+        "submit script. Only cache misses run the mock code executable.",
+    )
+    parser.addoption(
+        "--mock-no-code-pool",
+        action="store_true",
+        default=False,
+        help=
+        "Store a new mock code for each call of `mock_code_factory`, instead of reusing the codes "
+        "with the same settings across the tests of the session.",
+    )
+    parser.addoption(
+        "--mock-server",
+        action="store_true",
+        default=False,
+        help="Replay cached results of mock codes from a persistent server, instead of a new process "
+        "per calculation.",
+    )
+    parser.addoption(
+        "--mock-max-concurrent-runs",
+        type=int,
+        default=None,
+        help=
+        "Maximum number of actual executables of mock codes running at the same time, across all "
+        "processes (e.g. pytest-xdist workers).",
+    )
+    parser.addoption(
+        "--mock-cpu-affinity",
+        action="store_true",
+        default=False,
+        help="Pin concurrent runs of actual executables to disjoint sets of CPU cores. "
+        "Requires `--mock-max-concurrent-runs`.",
+    )
+    parser.addoption(
+        "--mock-stats-report",
+        default=None,
+        metavar="PATH",
+        help="Write the statistics of the mock codes in the test session to a JSON file.",
+    )
+    parser.addoption(
+        "--mock-verify-sample",
+        type=_parse_fraction,
+        default=None,
+        metavar="FRACTION",
+        help=
+        "Verify this fraction of the cache hits by also running the actual executable and comparing "
+        "its outputs to the replayed ones. Results not verified recently are preferred.",
+    )
+    parser.addoption(
+        "--mock-verify-budget",
+        type=_parse_duration,
+        default=None,
+        metavar="DURATION",
+        help=
+        "Total wall time of the verifications of cache hits in the test session, e.g. '600s' or '1h'.",
+    )
+    parser.addoption(
+        "--mock-cost-profile",
+        default=None,
+        metavar="PATH",
+        help="Update the cost profile of the tests using mock codes in this JSON file, and use it to "
+        "balance the shards of `--mock-shard`.",
+    )
+    parser.addoption(
+        "--mock-shard",
+        type=_parse_shard,
+        default=None,
+        metavar="INDEX/COUNT",
+        help=
+        "Only run the tests of this shard (e.g. '1/4'), partitioning the tests into shards of balanced "
+        "expected wall time according to `--mock-cost-profile`.",
+    )
+    parser.addoption(
+        "--mock-impact-map",
+        default=None,
+        metavar="PATH",
+        help=
+        "Update the map of the results and hashers used by each test in this JSON file, and use it to "
+        "select the tests affected by `--mock-changed`.",
+    )
+    parser.addoption(
+        "--mock-changed",
+        action="append",
+        default=[],
+        metavar="PATH_OR_RESULTS",
+        help=
+        "Only run the tests that may be affected by this changed file or results directory name, "
+        "according to `--mock-impact-map`. Can be given multiple times.",
+    )
+    parser.addoption(
+        "--mock-changed-from",
+        default=None,
+        metavar="FILE",
+        help=
+        "Read changed files or results directory names for `--mock-changed` from FILE, one per line "
+        "(e.g. the output of `git diff --name-only`).",
+    )
+    parser.addoption(
+        "--mock-trace",
+        default=None,
+        metavar="FILE",
+        help=
+        "Write a timeline of the mock codes in the test session to FILE, in the Chrome trace event format.",
+    )
+    parser.addoption(
+        "--mock-trace-memory",
+        action="store_true",
+        default=False,
+        help=
+        "Record the peak memory allocated during each span of the trace. Requires `--mock-trace`.",
+    )
+
+
+def _parse_duration(value: str) -> float:
+    """Parse a duration with an optional unit (s, m, h, d, w) into seconds."""
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+    value = value.strip().lower()
+    factor = units.get(value[-1:], None)
+    number = value[:-1] if factor is not None else value
+    try:
+        return float(number) * (factor or 1)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"invalid duration '{value}', e.g. '600s' or '30d'"
+        ) from None
+
+
+def _parse_fraction(value: str) -> float:
+    """Parse a fraction between 0 and 1."""
+    try:
+        fraction = float(value)
+    except ValueError:
+        fraction = -1.
+    if not 0 <= fraction <= 1:
+        raise argparse.ArgumentTypeError(f"invalid fraction '{value}', must be between 0 and 1")
+    return fraction
+
+
+def _parse_shard(value: str) -> ty.Tuple[int, int]:
+    """Parse an ``INDEX/COUNT`` pair, with the index starting at 1."""
+    index, _, count = value.partition('/')
+    try:
+        shard = int(index), int(count)
+    except ValueError:
+        shard = (0, 0)
+    if not 1 <= shard[0] <= shard[1]:
+        raise argparse.ArgumentTypeError(f"invalid shard '{value}', e.g. '1/4'")
+    return shard
+
+
+def _parse_code_version(value: str) -> ty.Tuple[str, str]:
+    """Parse a ``LABEL=VERSION`` pair."""
+    label, sep, version = value.partition('=')
+    if not sep or not label or not version:
+        raise argparse.ArgumentTypeError(f"invalid code version '{value}', e.g. 'pw=7.2'")
+    return label, version
+
+
+def _version_namespace(
+    label: str, version: ty.Optional[str], fingerprint: ty.Optional[ty.Dict[str, str]]
+) -> ty.Optional[str]:
+    """Return the version namespace of the test data of a mock code, see :func:`._storage.entry_name`.
+
+    :param label: Label of the mock code
+    :param version: Version given on the command line or in the configuration file, 'auto' to probe the executable
+    :param fingerprint: Fingerprint of the executable, if available
+    """
+    if version is None:
+        return None
+    version = str(version)
+    if version == 'auto':
+        if fingerprint is None:
+            raise ValueError(
+                f"Can not probe the version of the executable for code label '{label}', since it is not available. "
+                f"Select the version with `--mock-code-version {label}=VERSION`."
+            )
+        version = probe_version(fingerprint)
+    # the version is part of the name of results directories
+    return re.sub(r'[^\w.+-]', '_', version)
+
+
+class _RegenerateSelection(ty.NamedTuple):
+    """Selection of the existing test data that is regenerated, in addition to `--mock-regenerate-test-data`."""
+    labels: ty.FrozenSet[str]
+    outdated: bool
+    older_than: ty.Optional[float]
+
+
+class _LabelSettings(ty.NamedTuple):
+    """Settings of a code label, resolved from the configuration file."""
+    config: ty.Dict[str, ty.Any]
+    executable_path: str
+    fingerprint: ty.Optional[ty.Dict[str, str]]
+    version: ty.Optional[str]
+    backend: ty.Optional[ty.Dict[str, ty.Any]]
+
+
+class _CodePool:
+    """
+    Mock codes and settings shared by the tests of a session.
+
+    Stored codes are reused by tests requesting a code with the same settings, since only the variables
+    of the test (see :meth:`MockVariables.test_env`) differ, which the calculations inherit from the
+    environment of the pytest process instead of the prepend text of the code.
+
+    Calculations run by a daemon do not inherit this environment, hence their mock code invocations are not
+    attributed to the test. Without reusing codes, the variables of the test are part of the snapshot instead.
+    """
+
+    def __init__(self, reuse_codes: bool = True):
+        self.reuse_codes = reuse_codes
+        self._snapshot_dir: ty.Optional[pathlib.Path] = None
+        self._mock_executable_path: ty.Optional[str] = None
+        self._labels: ty.Dict[ty.Tuple[ty.Any, ...], _LabelSettings] = {}
+        self._codes: ty.Dict[ty.Tuple[str, str, str], str] = {}
+
+    @property
+    def mock_executable_path(self) -> str:
+        """Return the path of the `aiida-mock-code` executable."""
+        if self._mock_executable_path is None:
+            self._mock_executable_path = shutil.which('aiida-mock-code')
+            if not self._mock_executable_path:
+                raise ValueError(
+                    "'aiida-mock-code' executable not found in the PATH. " +
+                    "Have you run `pip install aiida-testing` in this python environment?"
+                )
+        return self._mock_executable_path
+
+    @property
+    def snapshot_dir(self) -> pathlib.Path:
+        """Return the directory of the snapshot files of the mock codes, see :meth:`MockVariables.write_snapshot`."""
+        if self._snapshot_dir is None:
+            self._snapshot_dir = pathlib.Path(tempfile.mkdtemp(prefix='aiida-mock-snapshots-'))
+        return self._snapshot_dir
+
+    def close(self) -> None:
+        """Remove the snapshot files."""
+        if self._snapshot_dir is not None:
+            shutil.rmtree(self._snapshot_dir, ignore_errors=True)
+            self._snapshot_dir = None
+
+    def resolve_label(  # pylint: disable=too-many-arguments
+        self, label: str, executable_name: str, config: Config, config_action: str,
+        version: ty.Optional[str]
+    ) -> _LabelSettings:
+        """Return the settings of a code label, resolving them only once per session."""
+        # the settings of the label in the configuration file identify it, unlike the configuration object
+        label_config = json.dumps(_label_config(config, label), sort_keys=True, default=str)
+        key = (label, executable_name, str(config.file_path), label_config, config_action, version)
+        if key not in self._labels:
+            self._labels[key] = _resolve_label(
+                label, executable_name, config, config_action, version
+            )
+        return self._labels[key]
+
+    def get_code(
+        self, computer, entry_point: str, variables: MockVariables, create: ty.Callable[[str],
+                                                                                        'Code']
+    ) -> 'Code':
+        """
+        Return a stored code for the computer, entry point and variables, creating it if needed.
+
+        The prepend text of the code only points to the snapshot file of the variables.
+
+        :param create: Function creating and storing a new code, given its prepend text
+        """
+        snapshot = variables.write_snapshot(self.snapshot_dir, per_test=not self.reuse_codes)
+        prepend_text = MockVariables.snapshot_to_env(snapshot)
+        if not self.reuse_codes:
+            return create(prepend_text)
+        key = (computer.uuid, entry_point, prepend_text)
+        code_uuid = self._codes.get(key)
+        if code_uuid is not None:
+            from aiida.common.exceptions import NotExistent  # pylint: disable=import-outside-toplevel
+            from aiida.orm import load_code  # pylint: disable=import-outside-toplevel
+
+            try:
+                return load_code(code_uuid)
+            except NotExistent:
+                # the code was removed, e.g. by cleaning the database between tests
+                pass
+        code = create(prepend_text)
+        self._codes[key] = code.uuid
+        return code
+
+
+def _label_config(config: Config, label: str) -> ty.Dict[str, ty.Any]:
+    """Return the settings of a code label in the configuration file."""
+    # the settings of a label are either the path of the executable, or a mapping
+    label_config = config.get('mock_code', {}).get(label, {})
+    if isinstance(label_config, str):
+        label_config = {'executable': label_config}
+    return ty.cast(ty.Dict[str, ty.Any], label_config)
+
+
+def _label_executable_path(
+    label: str, executable_name: str, label_config: ty.Dict[str, ty.Any], config: Config,
+    config_action: str
+) -> str:
+    """Return the path of the executable of a code label, or an empty string if it is not available."""
+    has_executable = 'executable' in label_config
+    if config_action == ConfigActions.REQUIRE.value and not has_executable:
+        raise ValueError(
+            f"Configuration file {CONFIG_FILE_NAME} does not specify path to executable for code label '{label}'."
+        )
+
+    code_executable_path = label_config.get('executable', '')
+    if has_executable and not pathlib.Path(label_config['executable']).is_absolute():
+        # Relative paths are interpreted with respect to the
+        # aiida-testing-config.yml file
+        relative_path = config.file_path.parent / label_config['executable']
+        code_executable_path = os.fspath(relative_path)
+        if not relative_path.exists():
+            raise ValueError(
+                f"Relative path {code_executable_path} in {CONFIG_FILE_NAME} "
+                f"does not exist for code label '{label}'."
+            )
+    elif not has_executable and executable_name:
+        _exec_path = shutil.which(executable_name)
+        if _exec_path is None:
+            raise ValueError(
+                f"Executable {executable_name} not found on PATH for code label '{label}'."
+            )
+        code_executable_path = _exec_path
+    return str(code_executable_path)
+
+
+def _label_fingerprint(label: str, code_executable_path: str,
+                       label_config: ty.Dict[str, ty.Any]) -> ty.Optional[ty.Dict[str, str]]:
+    """Return the fingerprint of the executable of a code label, or None if it is not available."""
+    # the executable is usually not available where all results are replayed, e.g. on CI
+    if not code_executable_path or not os.path.isfile(code_executable_path):
+        return None
+    version_command = label_config.get('version_command', ())
+    if isinstance(version_command, str):
+        version_command = shlex.split(version_command)
+    try:
+        return executable_fingerprint(code_executable_path, version_command)
+    except (OSError, subprocess.SubprocessError) as exc:
+        warnings.warn(
+            f"Can not determine the fingerprint of executable {code_executable_path} "
+            f"for code label '{label}': {exc}"
+        )
+        return None
+
+
+def _resolve_label(
+    label: str, executable_name: str, config: Config, config_action: str, version: ty.Optional[str]
+) -> _LabelSettings:
+    """Resolve the settings of a code label from the configuration file."""
+    label_config = _label_config(config, label)
+    code_executable_path = _label_executable_path(
+        label, executable_name, label_config, config, config_action
+    )
+    fingerprint = _label_fingerprint(label, code_executable_path, label_config)
+    version = _version_namespace(label, version or label_config.get('version'), fingerprint)
+
+    if 'normalize' in label_config:
+        try:
+            compile_rules(label_config['normalize'])
+        except ValueError as exc:
+            raise ValueError(
+                f"Invalid normalization rules in {CONFIG_FILE_NAME} for code label '{label}': {exc}"
+            ) from exc
+
+    backend = dict(label_config['backend']) if 'backend' in label_config else None
+    for key in ('path', 'cache_dir'):
+        if backend is not None and key in backend:
+            # relative paths are interpreted with respect to the config file
+            backend[key] = os.fspath(config.file_path.parent / backend[key])
+
+    return _LabelSettings(label_config, code_executable_path, fingerprint, version, backend)
+
+
+def pytest_configure(config):
+    """Register the plugins recording the usage and statistics of mock codes in the test session."""
+    MockCodeSession(config).register(config.pluginmanager)
 
 
 @pytest.fixture(scope='session')
@@ -74,6 +504,22 @@ def mock_regenerate_test_data(request):
     return request.config.getoption("--mock-regenerate-test-data")
 
 
+@pytest.fixture(scope='session')
+def mock_regenerate_selection(request):
+    """Read the selection of test data to regenerate from command line options."""
+    return _RegenerateSelection(
+        labels=frozenset(request.config.getoption("--mock-regenerate-label")),
+        outdated=request.config.getoption("--mock-regenerate-outdated"),
+        older_than=request.config.getoption("--mock-regenerate-older-than"),
+    )
+
+
+@pytest.fixture(scope='session')
+def mock_code_versions(request):
+    """Read the versions of the test data of mock codes per label from command line option."""
+    return dict(request.config.getoption("--mock-code-version"))
+
+
 @pytest.fixture(scope='session')
 def mock_fail_on_missing(request):
     """Read whether to fail if cached data is not found, rather than regenerating it."""
@@ -89,6 +535,32 @@ def mock_disable_mpi(request):
     return request.config.getoption("--mock-disable-mpi")
 
 
+@pytest.fixture(scope='session')
+def mock_replay_in_process(request):
+    """Read whether to resolve cache hits inside the pytest process from command line option."""
+    return request.config.getoption("--mock-replay-in-process")
+
+
+@pytest.fixture(scope='session')
+def mock_code_pool(request):
+    """Create the pool of mock codes shared by the tests of the session."""
+    pool = _CodePool(reuse_codes=not request.config.getoption("--mock-no-code-pool"))
+    yield pool
+    pool.close()
+
+
+@pytest.fixture(scope='session')
+def mock_max_concurrent_runs(request):
+    """Read the maximum number of concurrent runs of actual executables from command line option."""
+    return request.config.getoption("--mock-max-concurrent-runs")
+
+
+@pytest.fixture(scope='session')
+def mock_cpu_affinity(request):
+    """Read whether to pin runs of actual executables to disjoint CPU cores from command line option."""
+    return request.config.getoption("--mock-cpu-affinity")
+
+
 @pytest.fixture(scope='session')
 def testing_config(testing_config_action):  # pylint: disable=redefined-outer-name
     """Get content of .aiida-testing-config.yml
@@ -107,6 +579,49 @@ def testing_config(testing_config_action):  # pylint: disable=redefined-outer-na
         config.to_file()
 
 
+@pytest.fixture(scope='session')
+def mock_code_server(request):
+    """Start a mock code server for the session, if requested via `--mock-server`.
+
+    Yields the path of the Unix socket of the server, or None if no server is used.
+    """
+    if not request.config.getoption("--mock-server"):
+        yield None
+        return
+
+    # Unix socket paths are limited to ~100 characters, hence not using `tmp_path_factory`
+    socket_dir = tempfile.mkdtemp(prefix='aiida-mock-')
+    server = MockCodeServer(pathlib.Path(socket_dir) / 'server.sock')
+    server.start()
+    try:
+        yield server.socket_path
+    finally:
+        server.stop()
+        shutil.rmtree(socket_dir, ignore_errors=True)
+
+
+def _install_engine_spans(monkeypatch):
+    """Record the upload, submission and retrieval of calculations by the engine as spans of the trace."""
+    from aiida.engine.daemon import execmanager  # pylint: disable=import-outside-toplevel
+
+    def _traced(name, func):
+
+        def _wrapper(*args, **kwargs):
+            with span(name, 'engine'):
+                return func(*args, **kwargs)
+
+        return _wrapper
+
+    for name in ('upload_calculation', 'submit_calculation', 'retrieve_calculation'):
+        monkeypatch.setattr(execmanager, name, _traced(name, getattr(execmanager, name)))
+
+
+def _version_tuple(version: str) -> ty.Tuple[int, ...]:
+    """Return the numeric release part of a version string, e.g. ``(2, 1, 0)`` for ``'2.1.0rc1'``."""
+    match = re.match(r'\d+(?:\.\d+)*', version)
+    return tuple(int(part) for part in match.group().split('.')) if match else ()
+
+
 def _forget_mpi_decorator(func):
     """Modify :py:meth:`aiida.orm.Code.get_prepend_cmdline_params` to discard MPI parameters."""
 
@@ -119,9 +634,10 @@ def _forget_mpi_decorator(func):
 @pytest.fixture(scope='function')
 def mock_code_factory(
     aiida_localhost, testing_config, testing_config_action, mock_regenerate_test_data,
-    mock_fail_on_missing, mock_disable_mpi, monkeypatch, request: pytest.FixtureRequest,
-    tmp_path: pathlib.Path
-):  # pylint: disable=too-many-arguments,redefined-outer-name,unused-argument,too-many-statements
+    mock_regenerate_selection, mock_code_versions, mock_fail_on_missing, mock_disable_mpi,
+    mock_replay_in_process, mock_max_concurrent_runs, mock_cpu_affinity, mock_code_server,
+    mock_code_pool, monkeypatch, request: pytest.FixtureRequest, tmp_path: pathlib.Path
+):  # pylint: disable=too-many-arguments,redefined-outer-name,unused-argument,too-many-statements,too-many-locals
     """
     Fixture to create a mock AiiDA Code.
 
@@ -129,8 +645,17 @@ def mock_code_factory(
         Read config file if present ('read'), require config file ('require') or generate new config file ('generate').
 
     """
+    # aiida.orm and aiida.engine are slow to import, hence only imported when the fixture is used
+    from aiida import __version__ as aiida_version  # pylint: disable=import-outside-toplevel
+    from aiida.orm import Code  # pylint: disable=import-outside-toplevel
+    from ._replay import InProcessReplay  # pylint: disable=import-outside-toplevel
+
     log_file = tmp_path.joinpath("_aiida_mock_code.log")
     log_file.touch()
+    replay = InProcessReplay()
+    session = request.config.pluginmanager.get_plugin(MockCodeSession.name)
+    if session is not None and session.files.trace_dir is not None:
+        _install_engine_spans(monkeypatch)
 
     def _get_mock_code(
         label: str,
@@ -140,11 +665,22 @@ def mock_code_factory(
         ignore_paths: ty.Iterable[str] = ('_aiidasubmit.sh', ),
         executable_name: str = '',
         hasher: ty.Type[InputHasher] = InputHasher,
+        restore_strategy: str = 'auto',
+        storage: str = 'files',
+        object_store: ty.Union[None, str, pathlib.Path] = None,
+        data_layout: str = 'flat',
+        retrieve_only: bool = True,
+        submit_hashing: str = 'script',
         _config: Config = testing_config,
         _config_action: str = testing_config_action,
         _regenerate_test_data: bool = mock_regenerate_test_data,
+        _regenerate_selection: _RegenerateSelection = mock_regenerate_selection,
+        _code_versions: ty.Dict[str, str] = mock_code_versions,
         _fail_on_missing: bool = mock_fail_on_missing,
         _disable_mpi: bool = mock_disable_mpi,
+        _replay_in_process: bool = mock_replay_in_process,
+        _max_concurrent_runs: ty.Optional[int] = mock_max_concurrent_runs,
+        _cpu_affinity: bool = mock_cpu_affinity,
     ):  # pylint: disable=too-many-arguments,too-many-branches,too-many-locals
         """
         Creates a mock AiiDA code. If the same inputs have been run previously,
@@ -169,6 +705,34 @@ def mock_code_factory(
             after the code has been executed.
         executable_name :
             Name of code executable to search for in PATH, if configuration file does not specify location already.
+        hasher :
+            Subclass of :class:`InputHasher` used to compute the hash of the inputs.
+        restore_strategy :
+            How cached outputs are restored: 'auto' tries 'reflink', 'copy_file_range' and 'copy' in this
+            order. Any of these names starts the chain at that strategy. 'hardlink' links read-only files of
+            the data directory, and must only be used if the code never modifies its outputs.
+        storage :
+            Storage layout of new results directories: 'files' stores plain copies of the outputs, 'objects'
+            stores each file once in a content-addressed object store and only a manifest in the results
+            directory. 'chunks' additionally splits files into content-defined chunks, to deduplicate large
+            files that differ only in small regions.
+        object_store :
+            Path of the object store for the 'objects' and 'chunks' storage layouts, relative to the data directory
+            or absolute. Defaults to ``.objects`` inside the data directory. The store can be shared between data
+            directories.
+        data_layout :
+            Layout of new results directories in the data directory: 'flat' stores them as ``mock-{label}-{hash}``
+            directly in the data directory, 'sharded' as ``{label}/{hash[:2]}/{hash}``. Existing results are found
+            in either layout.
+        retrieve_only :
+            If True, only the files matching the ``retrieve_list`` and ``retrieve_temporary_list`` of the calculation
+            (and the scheduler output files) are stored in and restored from the data directory. Set to False if
+            other files in the remote working directory are needed, e.g. to restart from the remote folder.
+        submit_hashing :
+            How the submit script enters the hash of the inputs: 'script' hashes its text (without the mock code
+            variables), 'canonical' only hashes its semantic parts from the job template written by AiiDA (command
+            line, redirections, environment variables, prepend and append text), which do not change with the
+            script template of aiida-core.
         _config :
             Dict with contents of configuration file
         _config_action :
@@ -176,6 +740,18 @@ def mock_code_factory(
             If 'generate', add new key (label) to config dictionary.
         _regenerate_test_data :
             If True, regenerate test data instead of reusing.
+        _regenerate_selection :
+            Selection of the test data to regenerate by label, by a changed fingerprint of the executable,
+            or by age.
+        _code_versions :
+            Versions of the test data per label, overriding the ``version`` in the configuration file.
+        _replay_in_process :
+            If True, restore cached results inside the pytest process instead of launching the submit script.
+        _max_concurrent_runs :
+            Maximum number of actual executables running at the same time, across processes. The configuration
+            file can set an additional limit per label.
+        _cpu_affinity :
+            If True, pin concurrent runs of actual executables to disjoint sets of CPU cores.
 
         .. deprecated:: 0.1.0
             Keyword `ingore_files` is deprecated and will be removed in `v1.0`. Use `ignore_paths` instead.
@@ -199,10 +775,16 @@ def mock_code_factory(
         assert issubclass(
             hasher, InputHasher
         ), f"hasher must be a subclass of {InputHasher.__name__}"
-
-        # we want to set a custom prepend_text, which is why the code
-        # can not be reused.
-        code_label = f'mock-{label}-{uuid.uuid4()}'
+        if storage not in STORAGE_LAYOUTS:
+            raise ValueError(f"Unknown storage layout '{storage}', choose from {STORAGE_LAYOUTS}.")
+        if submit_hashing not in SUBMIT_HASHING_MODES:
+            raise ValueError(
+                f"Unknown submit script hashing '{submit_hashing}', choose from {SUBMIT_HASHING_MODES}."
+            )
+        if data_layout not in DATA_LAYOUTS:
+            raise ValueError(
+                f"Unknown data directory layout '{data_layout}', choose from {DATA_LAYOUTS}."
+            )
 
         data_dir_pl = pathlib.Path(data_dir_abspath)
         if not data_dir_pl.exists():
@@ -210,46 +792,20 @@ def mock_code_factory(
         if not data_dir_pl.is_absolute():
             raise ValueError("Please provide absolute path to data directory.")
 
-        mock_executable_path = shutil.which('aiida-mock-code')
-        if not mock_executable_path:
-            raise ValueError(
-                "'aiida-mock-code' executable not found in the PATH. " +
-                "Have you run `pip install aiida-testing` in this python environment?"
-            )
-
-        # try determine path to actual code executable
-        mock_code_config = _config.get('mock_code', {})
-        if _config_action == ConfigActions.REQUIRE.value and label not in mock_code_config:
-            raise ValueError(
-                f"Configuration file {CONFIG_FILE_NAME} does not specify path to executable for code label '{label}'."
-            )
+        if session is not None:
+            session.usage.data_dirs.add(data_dir_pl)
 
-        code_executable_path = mock_code_config.get(label, '')
-        if label in mock_code_config and not pathlib.Path(mock_code_config[label]).is_absolute():
-            # Relative paths are interpreted with respect to the
-            # aiida-testing-config.yml file
-            relative_path = _config.file_path.parent / mock_code_config[label]
-            code_executable_path = os.fspath(relative_path)
-            if not relative_path.exists():
-                raise ValueError(
-                    f"Relative path {code_executable_path} in {CONFIG_FILE_NAME} "
-                    f"does not exist for code label '{label}'."
-                )
-        elif label not in mock_code_config and executable_name:
-            _exec_path = shutil.which(executable_name)
-            if _exec_path is None:
-                raise ValueError(
-                    f"Executable {executable_name} not found on PATH for code label '{label}'."
-                )
-            code_executable_path = _exec_path
+        settings = mock_code_pool.resolve_label(
+            label, executable_name, _config, _config_action, _code_versions.get(label)
+        )
+        code_executable_path = settings.executable_path
 
         if _config_action == ConfigActions.GENERATE.value:
-            mock_code_config[label] = code_executable_path
-        code = Code(
-            input_plugin_name=entry_point,
-            remote_computer_exec=[aiida_localhost, mock_executable_path]
-        )
-        code.label = code_label
+            mock_code_config = _config.get('mock_code', {})
+            if isinstance(mock_code_config.get(label), dict):
+                mock_code_config[label]['executable'] = code_executable_path
+            else:
+                mock_code_config[label] = code_executable_path
         variables = MockVariables(
             log_file=log_file.absolute(),
             label=label,
@@ -258,18 +814,57 @@ def mock_code_factory(
             executable_path=code_executable_path,
             ignore_files=ignore_files,
             ignore_paths=ignore_paths,
-            regenerate_data=_regenerate_test_data,
+            regenerate_data=_regenerate_test_data or label in _regenerate_selection.labels,
             fail_on_missing=_fail_on_missing,
             _hasher=hasher,
+            server_socket=mock_code_server,
+            restore_strategy=restore_strategy,
+            storage=storage,
+            object_store=pathlib.Path(object_store) if object_store is not None else None,
+            data_layout=data_layout,
+            retrieve_only=retrieve_only,
+            max_concurrent_runs=_max_concurrent_runs,
+            label_max_concurrent_runs=settings.config.get('max_concurrent_runs'),
+            cpu_affinity=_cpu_affinity,
+            backend=settings.backend,
+            session=session.files.session_id if session is not None else None,
+            stats_file=session.files.stats_file if session is not None else None,
+            trace_dir=session.files.trace_dir if session is not None else None,
+            trace_memory=session.trace_memory if session is not None else False,
+            fingerprint=settings.fingerprint,
+            regenerate_outdated=_regenerate_selection.outdated,
+            regenerate_older_than=_regenerate_selection.older_than,
+            version=settings.version,
+            verify_sample=session.verify_sample if session is not None else None,
+            verify_budget=session.verify_budget if session is not None else None,
+            verify_file=session.files.verify_file if session is not None else None,
+            test_id=request.node.nodeid,
+            normalize=settings.config.get('normalize'),
+            submit_hashing=submit_hashing,
         )
-        code.set_prepend_text(variables.to_env())
+        # the variables of the test are inherited by the calculations from the environment of pytest
+        for key, value in variables.test_env().items():
+            monkeypatch.setenv(key, value)
+
+        def _create_code(prepend_text):
+            code = Code(
+                input_plugin_name=entry_point,
+                remote_computer_exec=[aiida_localhost, mock_code_pool.mock_executable_path]
+            )
+            code.label = f'mock-{label}-{uuid.uuid4()}'
+            code.set_prepend_text(prepend_text)
+            return code.store()
+
+        code = mock_code_pool.get_code(aiida_localhost, entry_point, variables, _create_code)
 
-        code.store()
+        if _replay_in_process:
+            replay.register(code.uuid, variables)
+            replay.install(monkeypatch)
 
         # Monkeypatch MPI behavior of code class, if requested either directly via `--mock-disable-mpi` or
         # indirectly via `--mock-fail-on-missing` (no need to use MPI in this case)
         if _disable_mpi or _fail_on_missing:
-            is_mpi_disable_supported = parse_version(aiida_version) >= parse_version('2.1.0')
+            is_mpi_disable_supported = _version_tuple(aiida_version) >= (2, 1, 0)
 
             if not is_mpi_disable_supported:
                 if _disable_mpi:
@@ -2,43 +2,64 @@
 import hashlib
 from importlib.util import spec_from_file_location, module_from_spec
 import inspect
+import json
 from pathlib import Path
 import typing as ty
 
+from ._trace import span
+
 if ty.TYPE_CHECKING:
     from ._env_keys import MockVariables  # pylint: disable=unused-import
 
+#: How the submit script is hashed: 'script' hashes its text, 'canonical' only its semantic parts
+SUBMIT_HASHING_MODES = ('script', 'canonical')
+
 
 class InputHasher:
     """
     Helper class to hash the input contents for the mock code.
     """
     SUBMIT_FILE = '_aiidasubmit.sh'
+    JOB_TEMPLATE_FILE = '.aiida/job_tmpl.json'
 
     def __init__(self, variables: 'MockVariables', logger: ty.Callable[[str], None]) -> None:
         """Initialize the hasher."""
         self.log = logger
         self.variables = variables
+        #: Paths of the files that contributed to the last hash, relative to the hashed directory
+        self.hashed_paths: ty.List[str] = []
 
     def __call__(self, cwd: Path) -> str:
         """Generate the MD5 hash for the directory."""
-        md5sum = hashlib.md5()
-        # Here the order needs to be consistent, thus globbing
-        # with 'sorted'.
-        used_paths = []
-        file_content_bytes: ty.Optional[bytes]
-        for path in sorted(cwd.glob('**/*')):
-            if not path.is_file() or path.match('.aiida/**'):
-                continue
-            with open(path, 'rb') as file_obj:
-                file_content_bytes = file_obj.read()
-            if path.name == self.SUBMIT_FILE:
-                file_content_bytes = self._strip_submit_content(file_content_bytes)
-            file_content_bytes = self.modify_content(path, file_content_bytes)
-            if file_content_bytes is not None:
-                md5sum.update(path.name.encode())
-                md5sum.update(file_content_bytes)
-                used_paths.append(str(path))
+        with span('hash', 'hash', hasher=type(self).__name__) as args:
+            md5sum = hashlib.md5()
+            # Here the order needs to be consistent, thus globbing
+            # with 'sorted'.
+            used_paths = []
+            self.hashed_paths = []
+            file_content_bytes: ty.Optional[bytes]
+            custom_modify = type(self).modify_content is not InputHasher.modify_content
+            rules = self.variables.get_normalization()
+            for path in sorted(cwd.glob('**/*')):
+                if not path.is_file() or path.match('.aiida/**'):
+                    continue
+                with span('hash file', 'hash', path=path.name):
+                    with open(path, 'rb') as file_obj:
+                        file_content_bytes = file_obj.read()
+                    relpath = path.relative_to(cwd).as_posix()
+                    if path.name == self.SUBMIT_FILE:
+                        file_content_bytes = self._submit_content(cwd, file_content_bytes)
+                    if rules is not None:
+                        file_content_bytes = rules.apply(relpath, file_content_bytes)
+                    if custom_modify and file_content_bytes is not None:
+                        with span('modify_content', 'hash', path=path.name):
+                            file_content_bytes = self.modify_content(path, file_content_bytes)
+                    if file_content_bytes is not None:
+                        md5sum.update(path.name.encode())
+                        md5sum.update(file_content_bytes)
+                        used_paths.append(str(path))
+                        self.hashed_paths.append(relpath)
+            args['files'] = len(used_paths)
 
         self.log(f"Hashed paths: {used_paths}")
 
@@ -51,6 +72,58 @@ class InputHasher:
         """
         return content
 
+    def normalize_output(self, path: Path, content: bytes) -> ty.Optional[bytes]:  # pylint: disable=no-self-use,unused-argument
+        """A sub-class hook to normalize the contents of an output file, before comparing replayed outputs
+        to the outputs of the actual executable (see ``--mock-verify-sample``).
+
+        If None is returned, the file is ignored in the comparison.
+        """
+        return content
+
+    def _submit_content(self, cwd: Path, content: bytes) -> bytes:
+        """
+        Return the content of the submit script that is hashed, depending on the submit hashing mode.
+        """
+        if self.variables.submit_hashing == 'canonical':
+            try:
+                with open(cwd / self.JOB_TEMPLATE_FILE, encoding='utf8') as handle:
+                    return self._canonical_submit_content(json.load(handle))
+            except (OSError, ValueError, TypeError, KeyError) as exc:
+                self.log(f"Hashing the full submit script, the job template can not be read: {exc}")
+        return self._strip_submit_content(content)
+
+    @staticmethod
+    def _canonical_submit_content(job_template: ty.Mapping[str, ty.Any]) -> bytes:
+        """
+        Helper function to extract the semantic parts of the submit script from the job template
+        written by AiiDA, which do not depend on the template of the script.
+
+        These are the command line parameters (without the path of the executable) and the redirections
+        of each code, the run mode of the codes, the environment variables and the prepend and append text.
+        The MPI launcher and the scheduler settings are left out.
+        """
+        codes = [{
+            'cmdline_params': list(code_info.get('cmdline_params') or [])[1:],
+            'stdin_name': code_info.get('stdin_name'),
+            'stdout_name': code_info.get('stdout_name'),
+            'stderr_name': code_info.get('stderr_name'),
+            'join_files': bool(code_info.get('join_files')),
+        } for code_info in job_template['codes_info']]
+        parts = {
+            'codes': codes,
+            'codes_run_mode': job_template.get('codes_run_mode'),
+            'environment': job_template.get('job_environment') or {},
+            'prepend_text': InputHasher._strip_text(job_template.get('prepend_text')),
+            'append_text': InputHasher._strip_text(job_template.get('append_text')),
+        }
+        return json.dumps(parts, sort_keys=True).encode()
+
+    @staticmethod
+    def _strip_text(text: ty.Optional[str]) -> str:
+        """Remove the mock code environment variables and blank lines from the prepend or append text."""
+        lines = (line.strip() for line in (text or '').splitlines())
+        return '\n'.join(line for line in lines if line and 'export AIIDA_MOCK' not in line)
+
     @staticmethod
     def _strip_submit_content(content: bytes) -> bytes:
         """
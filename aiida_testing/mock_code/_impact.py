@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Impact analysis of changes on the tests using mock codes.
+
+The impact map records for each test (by node id)
+
+* ``file``: the test module
+* ``hashers``: the files defining the custom hashers used by the test
+* ``entries``: the results used by the test, as ``data_dir`` and ``key``, with the ``inputs`` that
+  contributed to the hash (relative to the working directory of the calculation)
+
+All paths are relative to the root directory of the test session. Given a set of changed files or
+results, :func:`affected_tests` selects the tests whose replayed behavior could have changed.
+"""
+import json
+import os
+from pathlib import Path
+import typing as ty
+
+from ._pack import PACK_FILE
+from ._storage import DATA_LAYOUTS, ENTRY_PREFIX, entry_path
+
+__all__ = ("build_impact_map", "read_impact_map", "write_impact_map", "affected_tests")
+
+
+def build_impact_map(records: ty.Iterable[ty.Mapping[str, ty.Any]],
+                     root: Path) -> ty.Dict[str, ty.Dict[str, ty.Any]]:
+    """Build the impact map of the tests of a session from the statistics records, see :mod:`._stats`.
+
+    :param records: Statistics records of the mock code invocations
+    :param root: Root directory of the test session, to which paths are made relative
+    """
+    impact_map: ty.Dict[str, ty.Dict[str, ty.Any]] = {}
+    for record in records:
+        test_id = record.get('test_id')
+        if test_id is None:
+            continue
+        test = impact_map.setdefault(
+            test_id, {
+                'file': test_id.split('::', 1)[0],
+                'hashers': [],
+                'entries': []
+            }
+        )
+        if record.get('hasher'):
+            hasher_file = _relative(record['hasher'].rsplit('::', 1)[0], root)
+            if hasher_file not in test['hashers']:
+                test['hashers'].append(hasher_file)
+        entry = {
+            'data_dir': _relative(record['data_dir'], root),
+            'key': record['key'],
+            'inputs': record.get('inputs') or []
+        }
+        if entry not in test['entries']:
+            test['entries'].append(entry)
+    return impact_map
+
+
+def _relative(path: str, root: Path) -> str:
+    """Return the path relative to the root directory, in POSIX form."""
+    return Path(os.path.relpath(path, root)).as_posix()
+
+
+def read_impact_map(path: Path) -> ty.Dict[str, ty.Dict[str, ty.Any]]:
+    """Read the impact map, or return an empty map if the file does not exist."""
+    try:
+        with open(path, encoding='utf8') as handle:
+            return ty.cast(ty.Dict[str, ty.Dict[str, ty.Any]], json.load(handle)['tests'])
+    except FileNotFoundError:
+        return {}
+
+
+def write_impact_map(path: Path, impact_map: ty.Mapping[str, ty.Dict[str, ty.Any]]) -> None:
+    """Update the impact map with the tests of a session, keeping the other tests."""
+    tests = read_impact_map(path)
+    tests.update(impact_map)
+    with open(path, 'w', encoding='utf8') as handle:
+        json.dump({'tests': dict(sorted(tests.items()))}, handle, indent=2)
+
+
+class _ImpactIndex(ty.NamedTuple):
+    """Node ids of the tests of an impact map, indexed by what affects them."""
+
+    #: Test modules and files defining custom hashers
+    by_file: ty.Dict[Path, ty.Set[str]]
+    #: Names of the results
+    by_key: ty.Dict[str, ty.Set[str]]
+    #: Data directories of the results
+    by_data_dir: ty.Dict[Path, ty.Set[str]]
+    #: Results directories, in all layouts
+    by_entry_dir: ty.Dict[Path, ty.Set[str]]
+
+    @classmethod
+    def build(
+        cls, impact_map: ty.Mapping[str, ty.Mapping[str, ty.Any]], root: Path
+    ) -> '_ImpactIndex':
+        """Index the tests of the impact map."""
+        index = cls({}, {}, {}, {})
+        for test_id, test in impact_map.items():
+            for path in (test['file'], *test['hashers']):
+                index.by_file.setdefault(_resolve(path, root), set()).add(test_id)
+            for entry in test['entries']:
+                data_dir = _resolve(entry['data_dir'], root)
+                index.by_key.setdefault(entry['key'], set()).add(test_id)
+                index.by_data_dir.setdefault(data_dir, set()).add(test_id)
+                for layout in DATA_LAYOUTS:
+                    try:
+                        entry_dir = entry_path(data_dir, entry['key'], layout)
+                    except ValueError:
+                        continue
+                    index.by_entry_dir.setdefault(entry_dir, set()).add(test_id)
+        return index
+
+    def affected_by(self, change: str, root: Path) -> ty.Optional[ty.Set[str]]:
+        """Return the node ids of the tests affected by a change, or None if the change is unknown."""
+        if change.startswith(ENTRY_PREFIX) and '/' not in change and not (root / change).exists():
+            return self.by_key.get(change, set())
+        path = _resolve(change, root)
+        if path in self.by_file:
+            return self.by_file[path]
+        data_dir = _find_data_dir(path, self.by_data_dir)
+        if data_dir is None:
+            return None
+        if path == data_dir / PACK_FILE:
+            return self.by_data_dir[data_dir]
+        affected: ty.Set[str] = set()
+        for entry_dir, test_ids in self.by_entry_dir.items():
+            if _is_within(path, entry_dir):
+                affected |= test_ids
+        return affected
+
+
+def affected_tests(
+    impact_map: ty.Mapping[str, ty.Mapping[str, ty.Any]], changes: ty.Iterable[str], root: Path
+) -> ty.Tuple[ty.Set[str], ty.List[str]]:
+    """Select the tests of the impact map that are affected by the changes.
+
+    A changed file affects the tests of a test module, the tests using a custom hasher defined in the file,
+    or the tests using results stored in the file (including the pack file of a data directory).
+    Other files in data directories, e.g. results not used by any test, affect no test. A changed
+    result (given by its name) affects the tests using it.
+
+    :param impact_map: Impact map of the tests
+    :param changes: Changed files (relative to the root directory, or absolute) or names of changed results
+    :param root: Root directory of the test session
+    :return: The node ids of the affected tests, and the changes that can not be attributed to tests
+        of the impact map. If there are any of the latter, any test may be affected.
+    """
+    index = _ImpactIndex.build(impact_map, root)
+    affected: ty.Set[str] = set()
+    unknown = []
+    for change in changes:
+        test_ids = index.affected_by(change, root)
+        if test_ids is None:
+            unknown.append(change)
+        else:
+            affected |= test_ids
+    return affected, unknown
+
+
+def _find_data_dir(path: Path, data_dirs: ty.Iterable[Path]) -> ty.Optional[Path]:
+    """Return the data directory containing the path, if any."""
+    for data_dir in data_dirs:
+        if _is_within(path, data_dir):
+            return data_dir
+    return None
+
+
+def _resolve(path: ty.Union[str, Path], root: Path) -> Path:
+    """Return the normalized absolute path, interpreting relative paths with respect to the root directory."""
+    return Path(os.path.normpath(root / path))
+
+
+def _is_within(path: Path, directory: Path) -> bool:
+    """Return whether the path is inside the directory."""
+    return directory in path.parents
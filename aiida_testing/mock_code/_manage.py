@@ -0,0 +1,481 @@
+# -*- coding: utf-8 -*-
+"""
+Implements the ``aiida-mock-data`` command for managing mock code data directories.
+"""
+import argparse
+import collections
+from datetime import datetime
+from pathlib import Path
+import shutil
+import time
+import typing as ty
+
+from ._data_dir import LOCK_DIR, DataDirectory
+from ._pack import PACK_FILE, write_pack
+from ._storage import DATA_LAYOUTS, DEFAULT_OBJECT_STORE, META_PREFIX, ObjectStore, iter_entries, \
+    read_manifest, split_entry_name
+from ._usage import UsageLog
+
+
+def _format_size(size: float) -> str:
+    """Format a size in bytes for humans."""
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024 or unit == 'GiB':
+            break
+        size /= 1024
+    return f"{size:.1f} {unit}"
+
+
+def dedup_report(data_dir: Path, object_store: ObjectStore) -> ty.Dict[str, ty.Dict[str, int]]:
+    """Compute the logical and the stored size of the results directories, per label.
+
+    The logical size is the total size of the restored outputs, while the stored size counts
+    plain files and each object or chunk referenced by the label only once.
+    """
+    report: ty.Dict[str, ty.Dict[str, int]] = collections.defaultdict(collections.Counter)
+    digests: ty.Dict[str, ty.Set[str]] = collections.defaultdict(set)
+    for name, entry in iter_entries(data_dir):
+        label, _ = split_entry_name(name)
+        stats = report[label]
+        stats['entries'] += 1
+        for path in entry.rglob('*'):
+            if path.is_file() and not path.name.startswith(META_PREFIX):
+                stats['logical'] += path.stat().st_size
+                stats['stored'] += path.stat().st_size
+
+        manifest = read_manifest(entry) or {}
+        referenced = list(manifest.get('files', {}).values())
+        for chunk_digests in manifest.get('chunks', {}).values():
+            referenced.extend(chunk_digests)
+        for digest in referenced:
+            size = object_store.object_path(digest).stat().st_size
+            stats['logical'] += size
+            if digest not in digests[label]:
+                digests[label].add(digest)
+                stats['stored'] += size
+    return dict(report)
+
+
+def _cmd_dedup_report(args: argparse.Namespace) -> None:
+    """Print the deduplication ratio per label."""
+    report = dedup_report(args.data_dir, ObjectStore.for_data_dir(args.data_dir, args.object_store))
+    print(f"{'label':<30} {'entries':>8} {'logical':>12} {'stored':>12} {'ratio':>7}")
+    for label, stats in sorted(report.items()):
+        ratio = stats['logical'] / stats['stored'] if stats['stored'] else 1.
+        print(
+            f"{label:<30} {stats['entries']:>8} {_format_size(stats['logical']):>12} "
+            f"{_format_size(stats['stored']):>12} {ratio:>7.2f}"
+        )
+
+
+def pack_data_dir(data_directory: DataDirectory, remove_directories: bool = False) -> int:
+    """Write all results of a data directory into its pack file.
+
+    Results already in the pack file are kept, unless shadowed by a results directory.
+
+    :param remove_directories: If True, the packed results directories are removed.
+    :return: The number of packed results.
+    """
+    names = data_directory.names()
+    write_pack(
+        data_directory.path / PACK_FILE,
+        {name: data_directory.file_openers(name)
+         for name in names},
+    )
+    # the replaced pack file is mapped again on the next access
+    data_directory.close()
+    if remove_directories:
+        for name in names:
+            data_directory.remove(name)
+    return len(names)
+
+
+def unpack_data_dir(data_directory: DataDirectory, remove_pack: bool = False) -> int:
+    """Extract the results in the pack file of a data directory into results directories.
+
+    Existing results directories are not overwritten.
+
+    :param remove_pack: If True, the pack file is removed afterwards.
+    :return: The number of extracted results.
+    """
+    pack = data_directory.pack
+    if pack is None:
+        return 0
+    count = 0
+    for name in pack.names():
+        if data_directory.find_dir(name) is None:
+            tmp_dir = data_directory.path / f'.{name}.tmp'
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            pack.extract(name, tmp_dir)
+            data_directory.entry_dir(name).parent.mkdir(parents=True, exist_ok=True)
+            tmp_dir.rename(data_directory.entry_dir(name))
+            count += 1
+    if remove_pack:
+        data_directory.close()
+        pack.path.unlink()
+    return count
+
+
+def migrate_data_dir(data_directory: DataDirectory) -> int:
+    """Move all results directories of a data directory to the layout of the data directory.
+
+    Results directories are renamed, without recomputing the hashes of their inputs.
+
+    :return: The number of moved results directories.
+    """
+    return sum(data_directory.migrate(name) for name, _ in list(iter_entries(data_directory.path)))
+
+
+class Garbage(ty.NamedTuple):
+    """Results directory or object selected for removal by :func:`collect_garbage`."""
+
+    #: Name of the results directory, or digest of the object
+    name: str
+    #: Size of the files in the results directory, or of the object, in bytes
+    size: int
+    #: Time of the last use recorded in the usage log, or else the modification time
+    last_use: float
+    #: Why the results are removed, 'unused' or 'size', 'object' for unreferenced objects, or 'lock' for
+    #: lock files of results that are not present
+    reason: str
+
+
+def collect_garbage(
+    data_directory: DataDirectory,
+    keep_sessions: ty.Optional[int] = None,
+    max_size: ty.Optional[int] = None,
+    dry_run: bool = False,
+    shared_data_dirs: ty.Sequence[DataDirectory] = (),
+) -> ty.List[Garbage]:
+    """Remove results directories that were not used recently, according to the usage log.
+
+    Afterwards, the objects and chunks of the object store that are no longer referenced by the
+    manifest of any remaining results directory are removed. Results in the pack file do not
+    reference the object store, and are not removed. Finally, the lock files of results that are not
+    present are removed, unless a process holds the lock.
+
+    :param keep_sessions: If given, results not used by the last ``keep_sessions`` full test sessions (or any
+        session started since) are removed.
+    :param max_size: If given, the most recently used results are kept up to this total size in bytes, and
+        the remaining results are removed.
+    :param dry_run: If True, nothing is removed.
+    :param shared_data_dirs: Other data directories sharing the object store, whose references are kept.
+    :return: The removed results, most recently used first, followed by the removed objects and lock files.
+    :raises ValueError: If ``keep_sessions`` is not positive, or no full test session was recorded.
+    """
+    if keep_sessions is not None and keep_sessions < 1:
+        raise ValueError(f"The number of sessions to keep must be positive, got {keep_sessions}.")
+    started = time.time()
+    usage = UsageLog(data_directory.path)
+    used, expired_sessions = _used_names(usage, keep_sessions)
+    garbage = _select_garbage(_entries_by_last_use(data_directory.path, usage), used, max_size)
+    orphans = _unreferenced_objects(data_directory, garbage, shared_data_dirs, started)
+    if not dry_run:
+        for item in garbage:
+            with data_directory.lock(item.name):
+                data_directory.remove(item.name)
+        for session_id in expired_sessions:
+            usage.remove(session_id)
+        for item in orphans:
+            data_directory.object_store.object_path(item.name).unlink()
+    stale_locks = [
+        item for item in _stale_locks(data_directory, garbage)
+        if dry_run or data_directory.remove_lock(item.name)
+    ]
+    return garbage + orphans + stale_locks
+
+
+def _used_names(
+    usage: UsageLog, keep_sessions: ty.Optional[int]
+) -> ty.Tuple[ty.Optional[ty.Set[str]], ty.List[str]]:
+    """Return the names of the results used by the kept sessions, and the ids of the expired sessions.
+
+    :return: The names are None if ``keep_sessions`` is None, i.e. all results are used.
+    """
+    if keep_sessions is None:
+        return None, []
+    sessions = usage.sessions()
+    full_sessions = [session for session in sessions if session.full]
+    if not full_sessions:
+        raise ValueError(
+            f"No full test session recorded in '{usage.path}', run the test suite first."
+        )
+    first_kept = full_sessions[len(full_sessions) - keep_sessions:][0].id
+    used: ty.Set[str] = set()
+    expired_sessions = []
+    for session in sessions:
+        if session.id >= first_kept:
+            used.update(session.names)
+        else:
+            expired_sessions.append(session.id)
+    return used, expired_sessions
+
+
+def _select_garbage(
+    entries: ty.Iterable[ty.Tuple[float, str, int]],
+    used: ty.Optional[ty.Set[str]],
+    max_size: ty.Optional[int],
+) -> ty.List[Garbage]:
+    """Select the unused results, and the least recently used results beyond the size budget."""
+    garbage = []
+    total_size = 0
+    for timestamp, name, size in entries:
+        if used is not None and name not in used:
+            garbage.append(Garbage(name, size, timestamp, 'unused'))
+            continue
+        total_size += size
+        if max_size is not None and total_size > max_size:
+            garbage.append(Garbage(name, size, timestamp, 'size'))
+    return garbage
+
+
+def _unreferenced_objects(
+    data_directory: DataDirectory,
+    garbage: ty.Iterable[Garbage],
+    shared_data_dirs: ty.Iterable[DataDirectory],
+    started: float,
+) -> ty.List[Garbage]:
+    """Select the objects not referenced by the remaining results, nor by the shared data directories.
+
+    Objects written since ``started`` are kept, since they may belong to results being stored concurrently.
+    """
+    referenced = _referenced_digests(data_directory.path, {item.name for item in garbage})
+    for shared_data_dir in shared_data_dirs:
+        referenced.update(_referenced_digests(shared_data_dir.path))
+    return [
+        item for item in _iter_objects(data_directory.object_store)
+        if item.name not in referenced and item.last_use < started
+    ]
+
+
+def _stale_locks(data_directory: DataDirectory, garbage: ty.Iterable[Garbage]) -> ty.List[Garbage]:
+    """Select the lock files of results that are not present, or are removed as garbage."""
+    present = set(data_directory.names()).difference(item.name for item in garbage)
+    lock_dir = data_directory.path / LOCK_DIR
+    stale_locks = []
+    for name in data_directory.lock_names():
+        if name not in present:
+            stat = (lock_dir / f'{name}.lock').stat()
+            stale_locks.append(Garbage(name, stat.st_size, stat.st_mtime, 'lock'))
+    return stale_locks
+
+
+def _entries_by_last_use(data_dir: Path, usage: UsageLog) -> ty.List[ty.Tuple[float, str, int]]:
+    """Return the time of the last use, name and size of the results directories, most recently used first."""
+    last_use: ty.Dict[str, float] = {}
+    for session in usage.sessions():
+        if session.finished is not None:
+            for name in session.names:
+                last_use[name] = max(last_use.get(name, 0.), session.finished)
+    entries = []
+    for name, entry in iter_entries(data_dir):
+        size = sum(path.stat().st_size for path in entry.rglob('*') if path.is_file())
+        entries.append((last_use.get(name, entry.stat().st_mtime), name, size))
+    entries.sort(reverse=True)
+    return entries
+
+
+def _referenced_digests(data_dir: Path, exclude: ty.Collection[str] = ()) -> ty.Set[str]:
+    """Return the digests of the objects and chunks referenced by the manifests of the results directories."""
+    digests: ty.Set[str] = set()
+    for name, entry in iter_entries(data_dir):
+        if name in exclude:
+            continue
+        manifest = read_manifest(entry) or {}
+        digests.update(manifest.get('files', {}).values())
+        for chunk_digests in manifest.get('chunks', {}).values():
+            digests.update(chunk_digests)
+    return digests
+
+
+def _iter_objects(object_store: ObjectStore) -> ty.Iterator[Garbage]:
+    """Iterate over the objects of the store, with their modification time as time of the last use."""
+    if not object_store.path.is_dir():
+        return
+    for prefix_dir in sorted(object_store.path.iterdir()):
+        if not prefix_dir.is_dir() or len(prefix_dir.name) != 2:
+            continue
+        for path in sorted(prefix_dir.iterdir()):
+            if path.name.startswith('.tmp-'):
+                continue
+            stat = path.stat()
+            yield Garbage(prefix_dir.name + path.name, stat.st_size, stat.st_mtime, 'object')
+
+
+def _parse_size(value: str) -> int:
+    """Parse a size in bytes, with an optional suffix K, M, G or T (powers of 1024)."""
+    units = {'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
+    value = value.strip().upper().rstrip('IB') or '0'
+    try:
+        if value[-1] in units:
+            return int(float(value[:-1]) * units[value[-1]])
+        return int(value)
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError(f"invalid size: '{value}'") from exc
+
+
+def _cmd_gc(args: argparse.Namespace) -> None:
+    """Remove results that were not used recently."""
+    try:
+        garbage = collect_garbage(
+            DataDirectory(args.data_dir, args.object_store),
+            keep_sessions=args.keep_sessions,
+            max_size=args.max_size,
+            dry_run=args.dry_run,
+            shared_data_dirs=[
+                DataDirectory(path, args.object_store) for path in args.shared_data_dir
+            ],
+        )
+    except ValueError as exc:
+        raise SystemExit(f"Error: {exc}") from exc
+    for item in garbage:
+        print(
+            f"{item.name:<60} {_format_size(item.size):>12} "
+            f"{datetime.fromtimestamp(item.last_use):%Y-%m-%d %H:%M} {item.reason:>8}"
+        )
+    reclaimed = _format_size(sum(item.size for item in garbage))
+    verb = "Would reclaim" if args.dry_run else "Reclaimed"
+    num_objects = sum(item.reason == 'object' for item in garbage)
+    num_locks = sum(item.reason == 'lock' for item in garbage)
+    objects = f" and {num_objects} objects" if num_objects else ""
+    locks = f" (and {num_locks} stale lock files)" if num_locks else ""
+    print(
+        f"{verb} {reclaimed} from {len(garbage) - num_objects - num_locks} results{objects}{locks}"
+    )
+
+
+def _cmd_pack(args: argparse.Namespace) -> None:
+    """Pack the results directories."""
+    with DataDirectory(args.data_dir, args.object_store) as data_directory:
+        count = pack_data_dir(data_directory, args.remove)
+    print(f"Packed {count} results into {args.data_dir / PACK_FILE}")
+
+
+def _cmd_unpack(args: argparse.Namespace) -> None:
+    """Unpack the pack file."""
+    with DataDirectory(args.data_dir, args.object_store) as data_directory:
+        count = unpack_data_dir(data_directory, args.remove)
+    print(f"Extracted {count} results from {args.data_dir / PACK_FILE}")
+
+
+def _cmd_migrate(args: argparse.Namespace) -> None:
+    """Migrate the results directories to another layout."""
+    count = migrate_data_dir(DataDirectory(args.data_dir, args.object_store, layout=args.to))
+    print(f"Moved {count} results directories to the '{args.to}' layout")
+
+
+def _cmd_serve(args: argparse.Namespace) -> None:
+    """Serve the data directory over HTTP."""
+    from ._cache_server import CacheServer  # pylint: disable=import-outside-toplevel
+    args.data_dir.mkdir(parents=True, exist_ok=True)
+    with DataDirectory(args.data_dir, args.object_store) as data_directory:
+        server = CacheServer((args.host, args.port), data_directory)
+        server.verbose = True
+        print(f"Serving {args.data_dir} at {server.url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+def main(argv: ty.Optional[ty.Sequence[str]] = None) -> None:
+    """Run the ``aiida-mock-data`` command."""
+    parser = argparse.ArgumentParser(
+        prog='aiida-mock-data', description="Manage data directories of aiida-testing mock codes."
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('data_dir', type=Path, help="Data directory of the mock code.")
+    common.add_argument(
+        '--object-store',
+        type=Path,
+        default=None,
+        help=f"Object store, relative to the data directory (default: {DEFAULT_OBJECT_STORE}).",
+    )
+
+    parser_dedup = subparsers.add_parser(
+        'dedup-report',
+        parents=[common],
+        help="Report the deduplication ratio of the stored outputs per label."
+    )
+    parser_dedup.set_defaults(func=_cmd_dedup_report)
+
+    parser_pack = subparsers.add_parser(
+        'pack', parents=[common], help=f"Write all results into a single {PACK_FILE} file."
+    )
+    parser_pack.add_argument(
+        '--remove', action='store_true', help="Remove the results directories after packing."
+    )
+    parser_pack.set_defaults(func=_cmd_pack)
+
+    parser_unpack = subparsers.add_parser(
+        'unpack', parents=[common], help=f"Extract the {PACK_FILE} file into results directories."
+    )
+    parser_unpack.add_argument(
+        '--remove', action='store_true', help="Remove the pack file after extracting."
+    )
+    parser_unpack.set_defaults(func=_cmd_unpack)
+
+    parser_migrate = subparsers.add_parser(
+        'migrate', parents=[common], help="Move the results directories to another layout."
+    )
+    parser_migrate.add_argument(
+        '--to',
+        choices=DATA_LAYOUTS,
+        default='sharded',
+        help="Layout of the results directories after the migration (default: sharded).",
+    )
+    parser_migrate.set_defaults(func=_cmd_migrate)
+
+    parser_gc = subparsers.add_parser(
+        'gc',
+        parents=[common],
+        help="Remove results not used by recent test sessions, or beyond a size budget."
+    )
+    parser_gc.add_argument(
+        '--keep-sessions',
+        type=int,
+        default=None,
+        metavar='N',
+        help="Remove results not used in the last N full test sessions.",
+    )
+    parser_gc.add_argument(
+        '--max-size',
+        type=_parse_size,
+        default=None,
+        metavar='SIZE',
+        help="Keep the most recently used results up to this total size (e.g. 500M, 2G).",
+    )
+    parser_gc.add_argument(
+        '--dry-run', action='store_true', help="Only list the results that would be removed."
+    )
+    parser_gc.add_argument(
+        '--shared-data-dir',
+        type=Path,
+        action='append',
+        default=[],
+        metavar='DIR',
+        help="Other data directory sharing the object store, whose objects are kept (repeatable).",
+    )
+    parser_gc.set_defaults(func=_cmd_gc)
+
+    parser_serve = subparsers.add_parser(
+        'serve',
+        parents=[common],
+        help="Serve the data directory as a remote storage backend over HTTP."
+    )
+    parser_serve.add_argument(
+        '--host', default='127.0.0.1', help="Host to listen on (default: 127.0.0.1)."
+    )
+    parser_serve.add_argument(
+        '--port', type=int, default=8765, help="Port to listen on (default: 8765)."
+    )
+    parser_serve.set_defaults(func=_cmd_serve)
+
+    args = parser.parse_args(argv)
+    if args.command == 'gc' and args.keep_sessions is None and args.max_size is None:
+        parser_gc.error("at least one of --keep-sessions and --max-size is required")
+    args.func(args)
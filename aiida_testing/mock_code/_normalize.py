@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Declarative normalization of input files before hashing.
+
+The rules of a code label are given in the ``normalize`` section of its settings in the configuration file:
+
+* ``exclude``: glob patterns of files that are not hashed. Patterns without a ``/`` also match the file name.
+* ``remove_lines``: regular expressions; lines containing a match are removed.
+* ``mask``: byte ranges ``start`` to ``end`` (exclusive, negative values count from the end) of the files
+  matching ``path``, which are replaced by zero bytes.
+* ``round``: numbers with a decimal point or exponent are rounded to ``digits`` significant digits, in the
+  files matching ``path`` (all files by default).
+
+The rules are compiled once per process, each kind into a single combined pattern.
+"""
+import fnmatch
+import functools
+import json
+import re
+import typing as ty
+
+__all__ = ("NormalizationRules", "compile_rules")
+
+_NUMBER = re.compile(rb'[-+]?(?:\d+\.\d*|\.\d+|\d+(?=[eEdD]))(?:[eEdD][-+]?\d+)?')
+
+
+def _combine_globs(patterns: ty.Iterable[str]) -> ty.Optional[ty.Pattern[str]]:
+    """Combine glob patterns into a single regular expression, or return None if there are no patterns."""
+    patterns = list(patterns)
+    if not patterns:
+        return None
+    return re.compile('|'.join(f'(?:{fnmatch.translate(pattern)})' for pattern in patterns))
+
+
+def _path_matcher(patterns: ty.Iterable[str]) -> ty.Callable[[str], bool]:
+    """
+    Return a predicate matching relative paths (in POSIX form) against glob patterns, and file names against
+    patterns without a ``/``.
+    """
+    patterns = list(patterns)
+    path_pattern = _combine_globs(patterns)
+    name_pattern = _combine_globs(pattern for pattern in patterns if '/' not in pattern)
+
+    def _match(relpath: str) -> bool:
+        if path_pattern is not None and path_pattern.match(relpath):
+            return True
+        return name_pattern is not None and name_pattern.match(
+            relpath.rsplit('/', 1)[-1]
+        ) is not None
+
+    return _match
+
+
+def _required(rule: str, settings: ty.Any, keys: ty.Sequence[str]) -> ty.Mapping[str, ty.Any]:
+    """Return the settings of a rule, checking that they are a mapping with the given keys."""
+    if not isinstance(settings, ty.Mapping):
+        raise ValueError(f"The '{rule}' rule must be a mapping, got {settings!r}")
+    missing = [key for key in keys if key not in settings]
+    if missing:
+        raise ValueError(f"The '{rule}' rule is missing the keys {missing}")
+    return settings
+
+
+def _to_int(rule: str, key: str, value: ty.Any) -> int:
+    """Return the integer value of a setting of a rule."""
+    try:
+        return int(value)
+    except (TypeError, ValueError) as exc:
+        raise ValueError(
+            f"The '{key}' of the '{rule}' rule must be an integer, got {value!r}"
+        ) from exc
+
+
+class NormalizationRules:  # pylint: disable=too-few-public-methods
+    """Compiled normalization rules of a code label, see the module documentation."""
+
+    def __init__(self, rules: ty.Mapping[str, ty.Any]) -> None:
+        """
+        Compile the rules.
+
+        :raises ValueError: If a rule is invalid, e.g. a regular expression does not compile.
+        """
+        unknown = set(rules) - {'exclude', 'remove_lines', 'mask', 'round'}
+        if unknown:
+            raise ValueError(f"Unknown normalization rules: {sorted(unknown)}")
+        self._exclude = _path_matcher(rules.get('exclude', ()))
+        remove_lines = rules.get('remove_lines', ())
+        try:
+            self._remove_lines = re.compile(
+                b'|'.join(b'(?:' + pattern.encode() + b')' for pattern in remove_lines)
+            ) if remove_lines else None
+        except re.error as exc:
+            raise ValueError(f"Invalid pattern in 'remove_lines': {exc}") from exc
+        self._masks = []
+        for mask in rules.get('mask', ()):
+            mask = _required('mask', mask, ('path', 'start', 'end'))
+            self._masks.append((
+                _path_matcher([mask['path']]),
+                _to_int('mask', 'start', mask['start']),
+                _to_int('mask', 'end', mask['end']),
+            ))
+        rounding = rules.get('round')
+        self._round_digits: ty.Optional[int] = None
+        self._round_paths: ty.Optional[ty.Callable[[str], bool]] = None
+        if rounding is not None:
+            rounding = _required('round', rounding, ('digits', ))
+            self._round_digits = _to_int('round', 'digits', rounding['digits'])
+            if self._round_digits < 1:
+                raise ValueError("The 'digits' of the 'round' rule must be positive")
+            if 'path' in rounding:
+                self._round_paths = _path_matcher([rounding['path']])
+
+    def apply(self, relpath: str, content: bytes) -> ty.Optional[bytes]:
+        """
+        Normalize the content of a file.
+
+        :param relpath: Path of the file relative to the working directory, in POSIX form
+        :return: The normalized content, or None if the file is excluded from the hash
+        """
+        if self._exclude(relpath):
+            return None
+        if self._remove_lines is not None:
+            search = self._remove_lines.search
+            content = b'\n'.join(line for line in content.split(b'\n') if not search(line))
+        for matches, start, end in self._masks:
+            if matches(relpath):
+                start, end, _ = slice(start, end).indices(len(content))
+                if start < end:
+                    content = content[:start] + bytes(end - start) + content[end:]
+        if self._round_digits is not None and (
+            self._round_paths is None or self._round_paths(relpath)
+        ):
+            content = _NUMBER.sub(self._round_number, content)
+        return content
+
+    def _round_number(self, match: ty.Match[bytes]) -> bytes:
+        """Round a matched number to the configured significant digits."""
+        text = match.group()
+        try:
+            value = float(text.replace(b'd', b'e').replace(b'D', b'e'))
+        except ValueError:
+            return text
+        return f'{value:.{self._round_digits}g}'.encode()
+
+
+@functools.lru_cache(maxsize=None)
+def _compile(rules_json: str) -> NormalizationRules:
+    """Compile the rules given as canonical JSON."""
+    return NormalizationRules(json.loads(rules_json))
+
+
+def compile_rules(rules: ty.Mapping[str, ty.Any]) -> NormalizationRules:
+    """Return the compiled normalization rules, compiling the same rules only once per process."""
+    return _compile(json.dumps(rules, sort_keys=True))
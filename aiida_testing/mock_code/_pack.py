@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+Single-file pack format for the results directories of a data directory.
+
+A pack stores all files of all results directories in one file, which is
+faster to clone and check out than thousands of small files. The layout is::
+
+    header | compressed file contents | string table | entry index | file index
+
+Entries and files are described by fixed-size records, sorted by entry name,
+so that an entry can be found by binary search on the memory-mapped file
+without reading the whole index.
+"""
+import mmap
+import os
+from pathlib import Path
+import struct
+import typing as ty
+import zlib
+
+__all__ = ("PACK_FILE", "PackFile", "write_pack")
+
+#: Name of the pack file inside the data directory
+PACK_FILE = 'aiida-mock-data.pack'
+
+_MAGIC = b'AMPK'
+_VERSION = 1
+# magic, version, offset of entry index, number of entries, offset of file index
+_HEADER = struct.Struct('<4sHxxQQQ')
+# name offset, name length, index of first file, number of files
+_ENTRY = struct.Struct('<QIQI')
+# path offset, path length, data offset, compressed size, size
+_FILE = struct.Struct('<QIQQQ')
+
+_BLOCK_SIZE = 1024**2
+
+
+class PackFile:
+    """
+    Read-only access to a pack file, using a memory map.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        with open(self.path, 'rb') as handle:
+            self._mmap = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self._entries_offset, self._num_entries, self._files_offset = \
+            _HEADER.unpack_from(self._mmap, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"'{self.path}' is not a valid pack file.")
+
+    def close(self) -> None:
+        """Close the memory map."""
+        self._mmap.close()
+
+    def __enter__(self) -> 'PackFile':
+        return self
+
+    def __exit__(self, *exc_info: ty.Any) -> None:
+        self.close()
+
+    def _entry(self, idx: int) -> ty.Tuple[str, int, int]:
+        """Return name, index of the first file and number of files of the entry at ``idx``."""
+        name_offset, name_length, first_file, num_files = _ENTRY.unpack_from(
+            self._mmap, self._entries_offset + idx * _ENTRY.size
+        )
+        name = self._mmap[name_offset:name_offset + name_length].decode()
+        return name, first_file, num_files
+
+    def names(self) -> ty.Iterator[str]:
+        """Iterate over the names of the entries in the pack."""
+        for idx in range(self._num_entries):
+            yield self._entry(idx)[0]
+
+    def find(self, name: str) -> ty.Optional[ty.Tuple[int, int]]:
+        """Binary search for an entry.
+
+        :return: Index of the first file and number of files of the entry, or None if not found.
+        """
+        low, high = 0, self._num_entries
+        while low < high:
+            mid = (low + high) // 2
+            mid_name, first_file, num_files = self._entry(mid)
+            if mid_name == name:
+                return first_file, num_files
+            if mid_name < name:
+                low = mid + 1
+            else:
+                high = mid
+        return None
+
+    def files(self, name: str) -> ty.Iterator[ty.Tuple[str, int, int, int]]:
+        """Iterate over relative path, data offset, compressed size and size of the files of an entry."""
+        location = self.find(name)
+        if location is None:
+            raise KeyError(name)
+        first_file, num_files = location
+        for idx in range(first_file, first_file + num_files):
+            path_offset, path_length, data_offset, compressed_size, size = _FILE.unpack_from(
+                self._mmap, self._files_offset + idx * _FILE.size
+            )
+            path = self._mmap[path_offset:path_offset + path_length].decode()
+            yield path, data_offset, compressed_size, size
+
+    def read(self, name: str, path: str) -> bytes:
+        """Return the decompressed content of a file of an entry."""
+        for file_path, data_offset, compressed_size, _ in self.files(name):
+            if file_path == path:
+                return zlib.decompress(self._mmap[data_offset:data_offset + compressed_size])
+        raise KeyError(f"{name}/{path}")
+
+    def extract(
+        self,
+        name: str,
+        dest_dir: Path,
+        exclude_prefix: ty.Optional[str] = None,
+        include: ty.Optional[ty.Callable[[str], bool]] = None,
+    ) -> ty.Tuple[int, int]:
+        """Stream the files of an entry into the destination directory.
+
+        :param exclude_prefix: Top-level files starting with this prefix are not extracted.
+        :param include: If given, only files whose relative path satisfies this predicate are extracted.
+        :return: The number of extracted files and their total size in bytes.
+        """
+        count = total_size = 0
+        for path, data_offset, compressed_size, size in self.files(name):
+            if exclude_prefix and path.split('/', 1)[0].startswith(exclude_prefix):
+                continue
+            if include is not None and not include(path):
+                continue
+            dest = dest_dir / path
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            with open(dest, 'wb') as handle:
+                self._decompress_into(handle, data_offset, compressed_size)
+            count += 1
+            total_size += size
+        return count, total_size
+
+    def _decompress_into(self, handle: ty.BinaryIO, data_offset: int, compressed_size: int) -> None:
+        """Stream the decompressed content of a file into an open file, block by block."""
+        decompressor = zlib.decompressobj()
+        for start in range(data_offset, data_offset + compressed_size, _BLOCK_SIZE):
+            end = min(start + _BLOCK_SIZE, data_offset + compressed_size)
+            handle.write(decompressor.decompress(self._mmap[start:end]))
+        handle.write(decompressor.flush())
+
+
+def write_pack(
+    pack_path: Path, entries: ty.Mapping[str, ty.Mapping[str, ty.Callable[[], ty.BinaryIO]]]
+) -> None:
+    """Write a pack file.
+
+    :param pack_path: Path of the pack file to write. An existing file is replaced atomically.
+    :param entries: Mapping of entry names to a mapping of relative file paths to functions
+        opening the file content for reading.
+    """
+    tmp_path = pack_path.with_name(f'.{pack_path.name}.tmp')
+    entry_records: ty.List[ty.Tuple[str, int, int]] = []
+    file_records: ty.List[ty.Tuple[str, int, int, int]] = []
+    with open(tmp_path, 'wb') as handle:
+        handle.write(b'\0' * _HEADER.size)
+        for name in sorted(entries):
+            first_file = len(file_records)
+            for path in sorted(entries[name]):
+                data_offset = handle.tell()
+                size = _compress_into(handle, entries[name][path])
+                file_records.append((path, data_offset, handle.tell() - data_offset, size))
+            entry_records.append((name, first_file, len(file_records) - first_file))
+        entries_offset, files_offset = _write_index(handle, entry_records, file_records)
+        handle.seek(0)
+        handle.write(
+            _HEADER.pack(_MAGIC, _VERSION, entries_offset, len(entry_records), files_offset)
+        )
+    os.replace(tmp_path, pack_path)
+
+
+def _compress_into(handle: ty.BinaryIO, opener: ty.Callable[[], ty.BinaryIO]) -> int:
+    """Append the compressed content of a file to the pack, and return its uncompressed size."""
+    compressor = zlib.compressobj()
+    size = 0
+    with opener() as src:
+        for block in iter(lambda: src.read(_BLOCK_SIZE), b''):
+            size += len(block)
+            handle.write(compressor.compress(block))
+    handle.write(compressor.flush())
+    return size
+
+
+def _write_index(
+    handle: ty.BinaryIO,
+    entry_records: ty.Sequence[ty.Tuple[str, int, int]],
+    file_records: ty.Sequence[ty.Tuple[str, int, int, int]],
+) -> ty.Tuple[int, int]:
+    """Append the string table and the entry and file indices to the pack.
+
+    :return: The offsets of the entry index and of the file index.
+    """
+    strings = bytearray()
+    strings_offset = handle.tell()
+
+    def _add_string(value: str) -> ty.Tuple[int, int]:
+        encoded = value.encode()
+        offset = strings_offset + len(strings)
+        strings.extend(encoded)
+        return offset, len(encoded)
+
+    packed_entries = [
+        _ENTRY.pack(*_add_string(name), first_file, num_files)
+        for name, first_file, num_files in entry_records
+    ]
+    packed_files = [
+        _FILE.pack(*_add_string(path), data_offset, compressed_size, size)
+        for path, data_offset, compressed_size, size in file_records
+    ]
+    handle.write(strings)
+    entries_offset = handle.tell()
+    handle.write(b''.join(packed_entries))
+    files_offset = handle.tell()
+    handle.write(b''.join(packed_files))
+    return entries_offset, files_offset
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Resolves cache hits of mock codes inside the pytest process.
+
+When a calculation using a registered mock code is submitted, the inputs in
+its working directory are hashed in-process. On a cache hit, the outputs are
+restored directly and the job is reported as finished to the engine, without
+launching the submit script. Cache misses are submitted as usual, i.e. the
+``aiida-mock-code`` executable runs the actual code.
+"""
+import asyncio
+import contextlib
+import json
+from pathlib import Path
+import time
+import typing as ty
+
+from aiida.engine.daemon import execmanager
+from aiida.engine.processes.calcjobs.manager import JobManager
+
+from ._cli import HashedInputs, get_logger, restore_files
+from ._env_keys import MockVariables
+from ._storage import entry_name
+from ._trace import span
+from ._verify import request_verification, select_for_verification
+
+#: Prefix of the job id set on calculations that were replayed in-process
+REPLAY_JOB_ID_PREFIX = 'aiida-mock-replay-'
+
+
+class InProcessReplay:
+    """
+    Engine hook replaying cached results of mock codes without launching the submit script.
+    """
+
+    def __init__(self) -> None:
+        self._variables: ty.Dict[str, MockVariables] = {}
+        self._installed = False
+
+    def register(self, code_uuid: str, variables: MockVariables) -> None:
+        """Replay calculations of the code with the given UUID, using its mock code variables."""
+        self._variables[code_uuid] = variables
+
+    def install(self, monkeypatch: ty.Any) -> None:
+        """Patch the submission and job update of the engine for the duration of the test."""
+        if self._installed:
+            return
+        self._installed = True
+
+        submit_calculation = execmanager.submit_calculation
+        request_job_info_update = JobManager.request_job_info_update
+
+        def _submit_calculation(calculation, transport):
+            job_id = self.replay(calculation)
+            if job_id is None:
+                return submit_calculation(calculation, transport)
+            return job_id
+
+        @contextlib.contextmanager
+        def _request_job_info_update(manager, authinfo, job_id):
+            if str(job_id).startswith(REPLAY_JOB_ID_PREFIX):
+                # the job is already done, so there is nothing to poll for
+                future = asyncio.get_event_loop().create_future()
+                future.set_result(None)
+                yield future
+            else:
+                with request_job_info_update(manager, authinfo, job_id) as request:
+                    yield request
+
+        monkeypatch.setattr(execmanager, 'submit_calculation', _submit_calculation)
+        monkeypatch.setattr(JobManager, 'request_job_info_update', _request_job_info_update)
+
+    def replay(self, calculation: ty.Any) -> ty.Optional[str]:
+        """Restore the cached outputs of the calculation, if present.
+
+        :return: The job id to set on the calculation on a cache hit, None otherwise.
+        """
+        if calculation.get_job_id() is not None:
+            return None
+        code = getattr(calculation.inputs, 'code', None)
+        variables = self._variables.get(code.uuid) if code is not None else None
+        if variables is None or variables.regenerate_data:
+            return None
+
+        workdir = Path(calculation.get_remote_workdir())
+        if not _create_redirect_files(workdir) or not _restore_outputs(variables, workdir):
+            return None
+        job_id = f'{REPLAY_JOB_ID_PREFIX}{calculation.pk}'
+        calculation.set_job_id(job_id)
+        return job_id
+
+
+def _restore_outputs(variables: MockVariables, workdir: Path) -> bool:
+    """Restore the cached outputs of the inputs in the working directory, if present.
+
+    :return: True on a cache hit, False if the executable runs instead.
+    """
+    with span(
+        'replay (in-process)', 'replay', test=variables.test_name, label=variables.label
+    ) as args:
+        log = get_logger(variables, exit_on_error=False)
+        start = time.perf_counter()
+        try:
+            hasher = variables.get_hasher()(variables, log)
+            hash_digest = hasher(workdir)
+        except Exception:  # pylint: disable=broad-except
+            # let the executable run and report the error
+            return False
+        hash_time = time.perf_counter() - start
+        with variables.get_data_directory() as data_directory:
+            name = entry_name(variables.label, hash_digest, variables.version)
+            with span('lookup', 'lookup', key=name) as lookup_args:
+                args['hit'] = lookup_args['hit'] = data_directory.contains(name) \
+                    and not variables.should_regenerate(data_directory, name)
+            if not args['hit']:
+                return False
+            if select_for_verification(variables, data_directory, name):
+                # the executable restores the outputs and runs the actual code
+                request_verification(workdir)
+                return False
+
+            log(f"Cache hit (in-process): {data_directory.find_dir(name) or name}")
+            restore_files(
+                data_directory,
+                HashedInputs(name, hash_time, hasher.hashed_paths, source='in-process'),
+                workdir,
+                variables,
+                log,
+            )
+    return True
+
+
+def _create_redirect_files(workdir: Path) -> bool:
+    """
+    Create the (empty) files that the shell creates through redirections before the mock code runs.
+
+    These files are part of the hashed working directory of the ``aiida-mock-code`` executable,
+    so they are needed to compute the same hash in-process.
+
+    :return: False if the job template is not supported for in-process replay.
+    """
+    try:
+        with open(workdir / '.aiida' / 'job_tmpl.json', encoding='utf8') as handle:
+            job_tmpl = json.load(handle)
+    except (OSError, ValueError):
+        return False
+
+    codes_info = job_tmpl.get('codes_info') or []
+    if len(codes_info) != 1:
+        # with several codes, the outputs of previous codes are part of the hash
+        return False
+
+    file_names = [job_tmpl.get('sched_output_path')]
+    if not job_tmpl.get('sched_join_files'):
+        file_names.append(job_tmpl.get('sched_error_path'))
+    file_names.append(codes_info[0].get('stdout_name'))
+    if not codes_info[0].get('join_files'):
+        file_names.append(codes_info[0].get('stderr_name'))
+
+    for file_name in file_names:
+        if file_name:
+            (workdir / file_name).touch()
+    return True
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+Strategies for restoring cached outputs of the mock code into the working directory.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import collections
+import errno
+import os
+from pathlib import Path
+import shutil
+import stat
+import sys
+import threading
+import typing as ty
+
+__all__ = ("RESTORE_STRATEGIES", "FileRestorer")
+
+#: Restore strategies, in the order in which they are tried
+RESTORE_STRATEGIES = ('reflink', 'hardlink', 'copy_file_range', 'copy')
+
+#: Strategies that are only used if they are requested explicitly
+_OPT_IN_STRATEGIES = ('hardlink', )
+
+#: Entries with more files than this are restored with a thread pool
+PARALLEL_THRESHOLD = 8
+
+# ioctl request number of FICLONE on Linux, see `man ioctl_ficlone`
+_FICLONE = 0x40049409
+
+# errors signalling that a strategy is not supported for the given files
+_UNSUPPORTED_ERRNOS = {
+    errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.ENOSYS, errno.EPERM,
+    errno.EMLINK
+}
+
+
+class _StrategyNotApplicable(Exception):
+    """Raised if a strategy can not be used for a specific file."""
+
+
+def _reflink(src: Path, dest: Path) -> None:
+    """Clone the file on copy-on-write filesystems (btrfs, XFS, ...)."""
+    if not sys.platform.startswith('linux'):
+        raise OSError(errno.ENOSYS, 'reflink is only supported on Linux')
+    import fcntl  # pylint: disable=import-outside-toplevel
+    with open(src, 'rb') as src_obj, open(dest, 'wb') as dest_obj:
+        fcntl.ioctl(dest_obj.fileno(), _FICLONE, src_obj.fileno())
+
+
+def _hardlink(src: Path, dest: Path) -> None:
+    """Link the file, if it is read-only and can thus not be modified through the working directory."""
+    if os.stat(src).st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH):
+        raise _StrategyNotApplicable()
+    if dest.exists() or dest.is_symlink():
+        dest.unlink()
+    os.link(src, dest)
+
+
+def _copy_file_range(src: Path, dest: Path) -> None:
+    """Copy the file in the kernel, without passing the content through user space."""
+    use_copy_file_range = hasattr(os, 'copy_file_range')
+    if not use_copy_file_range and not hasattr(os, 'sendfile'):
+        raise OSError(errno.ENOSYS, 'copy_file_range and sendfile are not available')
+    with open(src, 'rb') as src_obj, open(dest, 'wb') as dest_obj:
+        src_fd, dest_fd = src_obj.fileno(), dest_obj.fileno()
+        remaining = os.fstat(src_fd).st_size
+        while remaining > 0:
+            if use_copy_file_range:
+                copied = os.copy_file_range(src_fd, dest_fd, remaining)
+            else:
+                copied = os.sendfile(dest_fd, src_fd, None, remaining)
+            if copied == 0:
+                break
+            remaining -= copied
+        if remaining > 0:
+            raise OSError(errno.EINVAL, 'kernel copy ended early')
+
+
+def _copy(src: Path, dest: Path) -> None:
+    """Copy the file byte by byte."""
+    shutil.copyfile(src, dest)
+
+
+_STRATEGY_FUNCTIONS: ty.Dict[str, ty.Callable[[Path, Path], None]] = {
+    'reflink': _reflink,
+    'hardlink': _hardlink,
+    'copy_file_range': _copy_file_range,
+    'copy': _copy,
+}
+
+
+class FileRestorer:
+    """
+    Restore files from the data directory, using the cheapest available strategy.
+
+    Strategies that fail because they are not supported (e.g. reflinks on a filesystem
+    without copy-on-write) are disabled for the remaining files.
+
+    Hard links are only used if requested explicitly: writing to a hard-linked output modifies the
+    stored file, and the read-only mode of stored files does not protect them from root.
+
+    :param strategy: Either 'auto' to try the strategies in the order of :data:`RESTORE_STRATEGIES`,
+        except 'hardlink', or the name of the first strategy to try. The plain 'copy' is always used
+        as a fallback.
+    :param max_workers: Number of threads used for entries with many files.
+    """
+
+    def __init__(self, strategy: str = 'auto', max_workers: ty.Optional[int] = None) -> None:
+        if strategy == 'auto':
+            strategy = RESTORE_STRATEGIES[0]
+        if strategy not in RESTORE_STRATEGIES:
+            raise ValueError(
+                f"Unknown restore strategy {strategy!r}, choose from 'auto', {RESTORE_STRATEGIES}"
+            )
+        self._strategies = (strategy, ) + tuple(
+            name for name in RESTORE_STRATEGIES[RESTORE_STRATEGIES.index(strategy) + 1:]
+            if name not in _OPT_IN_STRATEGIES
+        )
+        self._disabled: ty.Set[str] = set()
+        self._lock = threading.Lock()
+        self.max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+        self.counts: ty.Counter[str] = collections.Counter()
+        #: Total size of the restored files, in bytes
+        self.restored_bytes = 0
+
+    def restore_file(self, src: Path, dest: Path) -> str:
+        """Restore a single file and return the name of the strategy used."""
+        for name in self._strategies:
+            if name in self._disabled:
+                continue
+            try:
+                _STRATEGY_FUNCTIONS[name](src, dest)
+            except _StrategyNotApplicable:
+                continue
+            except OSError as exc:
+                if name == 'copy' or exc.errno not in _UNSUPPORTED_ERRNOS:
+                    raise
+                with self._lock:
+                    self._disabled.add(name)
+                continue
+            size = src.stat().st_size
+            with self._lock:
+                self.counts[name] += 1
+                self.restored_bytes += size
+            return name
+        raise RuntimeError(f"No restore strategy succeeded for '{src}'.")
+
+    def restore_tree(
+        self,
+        res_dir: Path,
+        dest_dir: Path,
+        exclude_prefix: ty.Optional[str] = None,
+        include: ty.Optional[ty.Callable[[str], bool]] = None,
+    ) -> None:
+        """Restore all files of a results directory into the destination directory.
+
+        Directories present in the results directory replace existing directories in the destination,
+        unless only selected files are restored.
+
+        :param exclude_prefix: Top-level files and directories starting with this prefix are not restored.
+        :param include: If given, only files whose relative POSIX path satisfies this predicate are restored.
+        """
+        top_level_paths = [
+            path for path in res_dir.iterdir()
+            if not (exclude_prefix and path.name.startswith(exclude_prefix))
+        ]
+        file_pairs = []
+        for path in top_level_paths:
+            if path.is_dir():
+                if include is None:
+                    shutil.rmtree(dest_dir / path.name, ignore_errors=True)
+                for dirpath, _, filenames in os.walk(path):
+                    relative_dir = Path(dirpath).relative_to(res_dir)
+                    if include is not None:
+                        filenames = [
+                            filename for filename in filenames
+                            if include((relative_dir / filename).as_posix())
+                        ]
+                    if filenames or include is None:
+                        os.makedirs(dest_dir / relative_dir, exist_ok=True)
+                    for filename in filenames:
+                        file_pairs.append(
+                            (Path(dirpath) / filename, dest_dir / relative_dir / filename)
+                        )
+            elif include is None or include(path.name):
+                file_pairs.append((path, dest_dir / path.name))
+        self.restore_many(file_pairs)
+
+    def restore_many(self, file_pairs: ty.Sequence[ty.Tuple[Path, Path]]) -> None:
+        """Restore a list of (source, destination) file pairs, in parallel for many files."""
+        if len(file_pairs) > PARALLEL_THRESHOLD and self.max_workers > 1:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                # consume the iterator to propagate exceptions
+                list(executor.map(lambda pair: self.restore_file(*pair), file_pairs))
+        else:
+            for src, dest in file_pairs:
+                self.restore_file(src, dest)
+
+    def summary(self) -> str:
+        """Return a summary of the strategies used so far."""
+        return ', '.join(f"{name}: {count}" for name, count in sorted(self.counts.items()))
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Selection of the files of a calculation that are retrieved by AiiDA.
+
+AiiDA writes the ``CalcInfo`` and the job template of a calculation to the
+``.aiida`` folder of its working directory. The retrieve patterns are read
+from there, such that the mock code only stores and restores the files the
+parser can actually see.
+"""
+import fnmatch
+import json
+from pathlib import Path, PurePosixPath
+import typing as ty
+
+__all__ = ("load_retrieve_patterns", "RetrieveFilter")
+
+
+def load_retrieve_patterns(workdir: Path) -> ty.Optional[ty.List[str]]:
+    """Return the patterns of the files retrieved from the working directory of a calculation.
+
+    The patterns combine the ``retrieve_list`` and ``retrieve_temporary_list`` of the ``CalcInfo``
+    with the scheduler output files. For entries of the form ``(remote, local, depth)``, the remote
+    path is used. Absolute paths are ignored, since they are outside of the working directory.
+
+    :return: The list of patterns, or None if the ``CalcInfo`` is not available.
+    """
+    try:
+        with open(workdir / '.aiida' / 'calcinfo.json', encoding='utf8') as handle:
+            calc_info = json.load(handle)
+    except (OSError, ValueError):
+        return None
+    try:
+        with open(workdir / '.aiida' / 'job_tmpl.json', encoding='utf8') as handle:
+            job_tmpl = json.load(handle)
+    except (OSError, ValueError):
+        job_tmpl = {}
+
+    patterns = []
+    items = list(calc_info.get('retrieve_list') or [])
+    items += calc_info.get('retrieve_temporary_list') or []
+    items += [job_tmpl.get('sched_output_path'), job_tmpl.get('sched_error_path')]
+    for item in items:
+        if isinstance(item, (list, tuple)):
+            item = item[0]
+        if item and not item.startswith('/'):
+            patterns.append(item)
+    return patterns
+
+
+class RetrieveFilter:  # pylint: disable=too-few-public-methods
+    """
+    Predicate on relative file paths, matching the files retrieved by AiiDA.
+
+    A file matches if it matches one of the patterns, or lies within a directory matching one of them,
+    since AiiDA retrieves directories recursively.
+    """
+
+    def __init__(self, patterns: ty.Iterable[str]) -> None:
+        self._patterns = [PurePosixPath(pattern).parts for pattern in patterns]
+
+    def __call__(self, relative_path: ty.Union[str, PurePosixPath]) -> bool:
+        parts = PurePosixPath(relative_path).parts
+        for pattern in self._patterns:
+            if len(pattern) <= len(parts) and all(
+                fnmatch.fnmatchcase(part, pattern_part)
+                for part, pattern_part in zip(parts, pattern)
+            ):
+                return True
+        return False
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Implements a persistent server that replays cached results of the mock code.
+
+The server listens on a Unix domain socket and keeps loaded hasher classes
+in memory, so that the ``aiida-mock-code`` executable only needs to send its
+working directory and variables instead of hashing and restoring itself.
+"""
+import json
+import os
+from pathlib import Path
+import socketserver
+import threading
+import time
+import typing as ty
+
+from ._cli import HashedInputs, get_logger, restore_files
+from ._data_dir import DataDirectory
+from ._env_keys import MockVariables
+from ._hasher import InputHasher
+from ._storage import entry_name
+from ._trace import span
+from ._verify import request_verification, select_for_verification
+
+__all__ = ("MockCodeServer", )
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """Handle a single replay request of the mock code client."""
+
+    server: 'MockCodeServer'
+
+    def handle(self) -> None:
+        """Read the JSON request, replay the cached result and send back the status."""
+        try:
+            request = json.loads(self.rfile.readline())
+            env = MockVariables.from_env(request['env'])
+            hit = self.server.replay(Path(request['cwd']), env)
+            response = {'status': 'hit' if hit else 'miss'}
+        except Exception as exc:  # pylint: disable=broad-except
+            # the client falls back to running in-process, which reports the error
+            response = {'status': 'error', 'message': str(exc)}
+        self.wfile.write(json.dumps(response).encode() + b'\n')
+
+
+class MockCodeServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Server replaying cached mock code results for requests coming from the ``aiida-mock-code`` client.
+
+    Only cache hits are handled by the server; on a miss the client runs the
+    actual executable itself.
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path: ty.Union[str, Path]) -> None:
+        self.socket_path = Path(socket_path)
+        super().__init__(os.fspath(self.socket_path), _RequestHandler)
+        self._hashers: ty.Dict[ty.Optional[str], ty.Type[InputHasher]] = {}
+        self._lock = threading.Lock()
+        self._data_directories: ty.Dict[ty.Tuple[Path, ty.Optional[Path], str, str],
+                                        DataDirectory] = {}
+
+    def start(self) -> None:
+        """Serve requests in a background thread."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def stop(self) -> None:
+        """Stop serving requests and remove the socket file."""
+        self.shutdown()
+        self.server_close()
+        with self._lock:
+            for data_directory in self._data_directories.values():
+                data_directory.close()
+            self._data_directories.clear()
+        if self.socket_path.exists():
+            self.socket_path.unlink()
+
+    def get_hasher(self, env: MockVariables) -> ty.Type[InputHasher]:
+        """Return the hasher class of the mock code, loading each custom hasher only once."""
+        key = env.hasher_reference
+        with self._lock:
+            if key not in self._hashers:
+                self._hashers[key] = env.get_hasher()
+            return self._hashers[key]
+
+    def get_data_directory(self, env: MockVariables) -> DataDirectory:
+        """Return the data directory of the mock code, keeping pack files mapped between requests."""
+        key = (
+            env.data_dir, env.object_store, env.data_layout,
+            json.dumps(env.backend, sort_keys=True)
+        )
+        with self._lock:
+            if key not in self._data_directories:
+                self._data_directories[key] = env.get_data_directory()
+            return self._data_directories[key]
+
+    def replay(self, cwd: Path, env: MockVariables) -> bool:
+        """Restore the cached result for the inputs in ``cwd``, if present.
+
+        :return: True on a cache hit, False if the client needs to run the mock code itself.
+        """
+        if env.regenerate_data:
+            return False
+        with span('replay (server)', 'replay', test=env.test_name, label=env.label) as args:
+            log = get_logger(env, exit_on_error=False)
+            start = time.perf_counter()
+            hasher = self.get_hasher(env)(env, log)
+            hash_digest = hasher(cwd)
+            hash_time = time.perf_counter() - start
+            data_directory = self.get_data_directory(env)
+            name = entry_name(env.label, hash_digest, env.version)
+            with span('lookup', 'lookup', key=name) as lookup_args:
+                args['hit'] = lookup_args['hit'] = data_directory.contains(name) \
+                    and not env.should_regenerate(data_directory, name)
+            if not args['hit']:
+                return False
+            if select_for_verification(env, data_directory, name):
+                # the executable restores the outputs and runs the actual code
+                request_verification(cwd)
+                return False
+            log(f"Cache hit (server): {data_directory.find_dir(name) or name}")
+            restore_files(
+                data_directory,
+                HashedInputs(name, hash_time, hasher.hashed_paths, source='server'),
+                cwd,
+                env,
+                log,
+            )
+            return True
@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+"""
+Defines the pytest plugins recording the mock code invocations of a test session, and selecting the
+tests of the session from the recorded cost profile and impact map.
+"""
+
+import collections
+import json
+import os
+import pathlib
+import shutil
+import tempfile
+import typing as ty
+
+import pytest
+
+from ._impact import affected_tests, build_impact_map, read_impact_map, write_impact_map
+from ._shard import build_profile, expected_cost, partition, read_profile, write_profile
+from ._stats import format_summary, read_records, summarize
+from ._throttle import remove_session_slots
+from ._trace import configure as configure_trace, merge_traces, set_test_name, span
+from ._usage import UsageLog, new_session_id
+from ._verify import format_verification
+
+__all__ = ("MockCodeSession", )
+
+
+def _temporary_file(prefix: str) -> pathlib.Path:
+    """Create an empty temporary file shared by the processes of the session."""
+    handle, path = tempfile.mkstemp(prefix=prefix, suffix='.jsonl')
+    os.close(handle)
+    return pathlib.Path(path)
+
+
+def _remove_file(path: ty.Optional[pathlib.Path]) -> None:
+    """Remove a temporary file of the session, if it exists."""
+    if path is None:
+        return
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+class _SessionFiles:
+    """
+    The session id and the temporary files shared by all processes of the session. The controller of
+    pytest-xdist creates them and passes them to its workers.
+    """
+
+    def __init__(self, config):
+        workerinput = getattr(config, 'workerinput', None)
+        self.worker_id: ty.Optional[str] = None
+        self.trace_dir: ty.Optional[pathlib.Path] = None
+        self.verify_file: ty.Optional[pathlib.Path] = None
+        if workerinput is not None:
+            self.worker_id = workerinput['workerid']
+            self.session_id = workerinput['aiida_mock_session']
+            self.stats_file = pathlib.Path(workerinput['aiida_mock_stats_file'])
+            if workerinput.get('aiida_mock_trace_dir'):
+                self.trace_dir = pathlib.Path(workerinput['aiida_mock_trace_dir'])
+            if workerinput.get('aiida_mock_verify_file'):
+                self.verify_file = pathlib.Path(workerinput['aiida_mock_verify_file'])
+            return
+        self.session_id = new_session_id()
+        self.stats_file = _temporary_file('aiida-mock-stats-')
+        if config.getoption('--mock-trace'):
+            self.trace_dir = pathlib.Path(tempfile.mkdtemp(prefix='aiida-mock-trace-'))
+        if config.getoption('--mock-verify-sample') is not None:
+            self.verify_file = _temporary_file('aiida-mock-verify-')
+
+    @property
+    def is_worker(self) -> bool:
+        """Return whether this process is a pytest-xdist worker."""
+        return self.worker_id is not None
+
+    @pytest.hookimpl(optionalhook=True)
+    def pytest_configure_node(self, node):
+        """Pass the session to a pytest-xdist worker."""
+        node.workerinput['aiida_mock_session'] = self.session_id
+        node.workerinput['aiida_mock_stats_file'] = str(self.stats_file)
+        if self.trace_dir is not None:
+            node.workerinput['aiida_mock_trace_dir'] = str(self.trace_dir)
+        if self.verify_file is not None:
+            node.workerinput['aiida_mock_verify_file'] = str(self.verify_file)
+
+    def pytest_unconfigure(self, config):  # pylint: disable=unused-argument
+        """Remove the statistics file, the verification file, the trace directory and the run slots."""
+        if self.is_worker:
+            return
+        remove_session_slots(self.session_id)
+        _remove_file(self.stats_file)
+        _remove_file(self.verify_file)
+        if self.trace_dir is not None:
+            shutil.rmtree(self.trace_dir, ignore_errors=True)
+
+
+class _UsageRecorder:
+    """
+    Records the data directories used by the test session, and marks the end of the session in their
+    usage logs (see :mod:`._usage`).
+
+    The session counts as full if it was started on directories only (or without arguments),
+    no tests were deselected (e.g. with ``-k``, ``-m`` or ``--lf``) and it was not stopped early.
+    """
+
+    def __init__(self, config, session_id: str):
+        self.session_id = session_id
+        self.full = all('::' not in arg and os.path.isdir(arg) for arg in config.args)
+        self.data_dirs: ty.Set[pathlib.Path] = set()
+
+    def pytest_deselected(self, items):  # pylint: disable=unused-argument
+        """Mark the session as partial."""
+        self.full = False
+
+    def pytest_sessionfinish(self, session, exitstatus):
+        """Record the end of the session in the usage logs."""
+        full = self.full and exitstatus in (pytest.ExitCode.OK, pytest.ExitCode.TESTS_FAILED) \
+            and not session.shouldstop and not session.shouldfail
+        for data_dir in self.data_dirs:
+            try:
+                UsageLog(data_dir).finish(self.session_id, full)
+            except OSError:
+                pass
+
+
+class _TraceRecorder:
+    """
+    With ``--mock-trace``, all processes write span events to a temporary trace directory (see
+    :mod:`._trace`), which are merged into the trace file at the end of the session.
+    """
+
+    def __init__(self, files: _SessionFiles, memory: bool):
+        self.files = files
+        if files.trace_dir is not None:
+            process_name = f"pytest {files.worker_id}" if files.is_worker else 'pytest'
+            configure_trace(files.trace_dir, process_name, memory=memory)
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_protocol(self, item, nextitem):  # pylint: disable=unused-argument
+        """Add the test to the events of the trace, and record the test itself as a span."""
+        if self.files.trace_dir is None:
+            yield
+            return
+        set_test_name(item.nodeid)
+        with span('test', 'test', test=item.nodeid):
+            yield
+        set_test_name(None)
+
+    def pytest_sessionfinish(self, session, exitstatus):  # pylint: disable=unused-argument
+        """Merge the trace files of all processes into the trace file."""
+        if self.files.trace_dir is not None and not self.files.is_worker:
+            merge_traces(self.files.trace_dir, session.config.getoption('--mock-trace'))
+
+    def pytest_unconfigure(self, config):  # pylint: disable=unused-argument
+        """Stop tracing this process."""
+        if self.files.trace_dir is not None:
+            configure_trace(None, 'pytest')
+
+
+class _CostProfile:
+    """
+    With ``--mock-cost-profile``, the wall time of each test and the mock code invocations of the test are
+    added to the cost profile (see :mod:`._shard`).
+    """
+
+    def __init__(self, files: _SessionFiles):
+        self.files = files
+        self.durations: ty.DefaultDict[str, float] = collections.defaultdict(float)
+
+    def pytest_runtest_logreport(self, report):
+        """Add the duration of a test phase to the wall time of the test."""
+        self.durations[report.nodeid] += report.duration
+
+    def pytest_sessionfinish(self, session, exitstatus):  # pylint: disable=unused-argument
+        """Add the tests of the session to the cost profile."""
+        profile_path = session.config.getoption('--mock-cost-profile')
+        if profile_path and not self.files.is_worker:
+            records = read_records(self.files.stats_file)
+            write_profile(pathlib.Path(profile_path), build_profile(records, self.durations))
+
+
+class _ImpactSelection:
+    """
+    With ``--mock-impact-map``, the results and hashers used by each test are added to the impact map (see
+    :mod:`._impact`). ``--mock-changed`` selects the tests affected by changes.
+    """
+
+    def __init__(self, files: _SessionFiles):
+        self.files = files
+        self.summary: ty.Optional[str] = None
+
+    @pytest.hookimpl(trylast=True)
+    def pytest_collection_modifyitems(self, config, items):
+        """Deselect the tests of the impact map that are not affected by the changes."""
+        changes = list(config.getoption('--mock-changed'))
+        changed_from = config.getoption('--mock-changed-from')
+        if changed_from:
+            with open(changed_from, encoding='utf8') as handle:
+                changes.extend(line.strip() for line in handle if line.strip())
+        impact_path = config.getoption('--mock-impact-map')
+        if not (changes or changed_from) or not impact_path:
+            return
+        impact_map = read_impact_map(pathlib.Path(impact_path))
+        affected, unknown = affected_tests(impact_map, changes, config.rootpath)
+        if unknown:
+            self.summary = f"Mock code impact: running all tests, since the changes " \
+                f"{', '.join(unknown[:5])}{' ...' if len(unknown) > 5 else ''} may affect any test"
+            return
+        deselected = [
+            item for item in items if item.nodeid in impact_map and item.nodeid not in affected
+        ]
+        if deselected:
+            config.hook.pytest_deselected(items=deselected)
+            items[:] = [
+                item for item in items if item.nodeid not in impact_map or item.nodeid in affected
+            ]
+        self.summary = f"Mock code impact: deselected {len(deselected)} tests not affected by " \
+            f"{len(changes)} changes"
+
+    def pytest_sessionfinish(self, session, exitstatus):  # pylint: disable=unused-argument
+        """Add the tests of the session to the impact map."""
+        impact_path = session.config.getoption('--mock-impact-map')
+        if impact_path and not self.files.is_worker:
+            records = read_records(self.files.stats_file)
+            write_impact_map(
+                pathlib.Path(impact_path), build_impact_map(records, session.config.rootpath)
+            )
+
+
+class _ShardSelection:  # pylint: disable=too-few-public-methods
+    """
+    ``--mock-shard`` selects the tests of one shard, balanced by the expected cost of the tests in the cost
+    profile (see :mod:`._shard`).
+    """
+
+    def __init__(self):
+        self.summary: ty.Optional[str] = None
+
+    @pytest.hookimpl(trylast=True)
+    def pytest_collection_modifyitems(self, config, items):
+        """Deselect the tests that are not in the shard."""
+        shard = config.getoption('--mock-shard')
+        if shard is None:
+            return
+        index, count = shard
+        profile_path = config.getoption('--mock-cost-profile')
+        profile = read_profile(pathlib.Path(profile_path)) if profile_path else {}
+        regenerate = config.getoption('--mock-regenerate-test-data')
+        costs = {
+            item.nodeid:
+            expected_cost(profile[item.nodeid], regenerate) if item.nodeid in profile else None
+            for item in items
+        }
+        selected = set(partition(costs, count)[index - 1])
+        deselected = [item for item in items if item.nodeid not in selected]
+        if deselected:
+            config.hook.pytest_deselected(items=deselected)
+            items[:] = [item for item in items if item.nodeid in selected]
+        known = [costs[test_id] for test_id in selected if costs[test_id] is not None]
+        self.summary = f"Mock code shard {index}/{count}: {len(selected)} tests, expected " \
+            f"{sum(known):.2f}s for the {len(known)} tests in the cost profile"
+
+
+class _TerminalSummary:  # pylint: disable=too-few-public-methods
+    """
+    Shows the selection of tests, the verifications of cache hits (see :mod:`._verify`) and the statistics
+    of all mock code invocations (see :mod:`._stats`) at the end of the session.
+    """
+
+    def __init__(self, files: _SessionFiles, selections: ty.Sequence[ty.Any]):
+        self.files = files
+        self.selections = selections
+
+    def pytest_terminal_summary(self, terminalreporter, config):
+        """Show the statistics of the mock codes, and write them to the JSON report if requested."""
+        if self.files.is_worker:
+            return
+        for selection in self.selections:
+            if selection.summary is not None:
+                terminalreporter.write_line(selection.summary)
+        if self.files.trace_dir is not None:
+            terminalreporter.write_line(
+                f"Mock code trace written to {config.getoption('--mock-trace')}"
+            )
+        verify_file = self.files.verify_file
+        verifications = read_records(verify_file) if verify_file is not None else []
+        if verifications:
+            terminalreporter.write_sep('=', 'aiida-testing mock code verification')
+            for line in format_verification(verifications):
+                terminalreporter.write_line(line)
+        records = read_records(self.files.stats_file)
+        if not records:
+            return
+        summary = summarize(records)
+        terminalreporter.write_sep('=', 'aiida-testing mock code statistics')
+        for line in format_summary(summary):
+            terminalreporter.write_line(line)
+        report_path = config.getoption('--mock-stats-report')
+        if report_path:
+            with open(report_path, 'w', encoding='utf8') as handle:
+                json.dump({'session': self.files.session_id, **summary}, handle, indent=2)
+            terminalreporter.write_line(f"Mock code statistics written to {report_path}")
+
+
+class MockCodeSession:  # pylint: disable=too-few-public-methods
+    """
+    The mock code settings of the test session, passed to the mock codes by :func:`mock_code_factory`.
+
+    Registers one plugin per concern: the files shared with pytest-xdist workers, the usage logs of the
+    data directories, the trace, the cost profile and sharding, the impact map, and the terminal summary.
+    """
+
+    name = 'aiida_mock_code_session'
+
+    def __init__(self, config):
+        self.files = _SessionFiles(config)
+        self.usage = _UsageRecorder(config, self.files.session_id)
+        self.trace_memory = config.getoption('--mock-trace-memory')
+        self.verify_sample = config.getoption('--mock-verify-sample')
+        self.verify_budget = config.getoption('--mock-verify-budget')
+
+    def register(self, pluginmanager) -> None:
+        """Register the session and the plugins of its concerns with pytest."""
+        impact, shard = _ImpactSelection(self.files), _ShardSelection()
+        pluginmanager.register(self, self.name)
+        # hooks of plugins registered later are called first: select the affected tests before the shard
+        for plugin_name, plugin in (
+            ('files', self.files),
+            ('usage', self.usage),
+            ('trace', _TraceRecorder(self.files, self.trace_memory)),
+            ('cost_profile', _CostProfile(self.files)),
+            ('shard', shard),
+            ('impact', impact),
+            ('summary', _TerminalSummary(self.files, (impact, shard))),
+        ):
+            pluginmanager.register(plugin, f'{self.name}_{plugin_name}')
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Cost profile of tests using mock codes, and partitioning of tests into shards of balanced cost.
+
+The cost profile maps the node id of each test to
+
+* ``duration``: wall time of the test (setup, call and teardown) in the session that recorded it
+* ``invocations``, ``hits`` and ``misses``: number of mock code invocations of the test
+* ``mock_time``: time spent by the mock codes on hashing, restoring and storing outputs
+* ``runs``: for each invocation, the ``key`` and ``data_dir`` of the results, and the ``run_time`` of the
+  actual code (as measured on a miss, or as stored with the results on a hit)
+
+The expected cost of a test in a new session is its duration without the actual runs, plus the
+run time of each invocation whose results are not in the data directory (anymore).
+"""
+import dataclasses
+from dataclasses import dataclass
+import json
+from pathlib import Path
+import typing as ty
+
+from ._data_dir import DataDirectory
+
+__all__ = (
+    "RunCost", "CostEntry", "build_profile", "read_profile", "write_profile", "expected_cost",
+    "partition"
+)
+
+#: Expected cost of tests that are not in the cost profile, if no test has a known cost
+DEFAULT_COST = 1.
+
+
+class RunCost(ty.NamedTuple):
+    """Mock code invocation of a test in the cost profile."""
+
+    #: Name of the results
+    key: str
+    #: Data directory of the results, if known
+    data_dir: ty.Optional[str]
+    #: Whether the results were restored from the data directory
+    hit: bool
+    #: Run time of the actual code, if known
+    run_time: ty.Optional[float]
+
+    @classmethod
+    def from_dict(cls, data: ty.Mapping[str, ty.Any]) -> 'RunCost':
+        """Parse an invocation read from the cost profile file."""
+        data_dir, run_time = data.get('data_dir'), data.get('run_time')
+        return cls(
+            key=str(data['key']),
+            data_dir=None if data_dir is None else str(data_dir),
+            hit=bool(data['hit']),
+            run_time=None if run_time is None else float(run_time),
+        )
+
+
+@dataclass
+class CostEntry:
+    """Cost profile of a test, see the module documentation."""
+
+    duration: float
+    invocations: int = 0
+    hits: int = 0
+    misses: int = 0
+    mock_time: float = 0.
+    runs: ty.List[RunCost] = dataclasses.field(default_factory=list)
+
+    @classmethod
+    def from_dict(cls, data: ty.Mapping[str, ty.Any]) -> 'CostEntry':
+        """Parse the cost profile of a test read from the cost profile file."""
+        return cls(
+            duration=float(data['duration']),
+            invocations=int(data.get('invocations', 0)),
+            hits=int(data.get('hits', 0)),
+            misses=int(data.get('misses', 0)),
+            mock_time=float(data.get('mock_time', 0.)),
+            runs=[RunCost.from_dict(run) for run in data.get('runs', ())],
+        )
+
+    def to_dict(self) -> ty.Dict[str, ty.Any]:
+        """Return the cost profile of the test as written to the cost profile file."""
+        data = dataclasses.asdict(self)
+        data['runs'] = [run._asdict() for run in self.runs]
+        return data
+
+
+def build_profile(records: ty.Iterable[ty.Mapping[str, ty.Any]],
+                  durations: ty.Mapping[str, float]) -> ty.Dict[str, CostEntry]:
+    """Build the cost profile of the tests of a session.
+
+    :param records: Statistics records of the mock code invocations, see :mod:`._stats`
+    :param durations: Wall time of each test of the session, by node id
+    """
+    profile = {test_id: CostEntry(duration) for test_id, duration in durations.items()}
+    for record in records:
+        entry = profile.get(str(record.get('test_id')))
+        if entry is None:
+            continue
+        run = RunCost.from_dict(record)
+        entry.invocations += 1
+        if run.hit:
+            entry.hits += 1
+        else:
+            entry.misses += 1
+        entry.mock_time += sum(
+            float(record.get(field) or 0.) for field in ('hash_time', 'restore_time', 'copy_time')
+        )
+        entry.runs.append(run)
+    return profile
+
+
+def read_profile(path: Path) -> ty.Dict[str, CostEntry]:
+    """Read the cost profile, or return an empty profile if the file does not exist."""
+    try:
+        with open(path, encoding='utf8') as handle:
+            tests = json.load(handle)['tests']
+    except FileNotFoundError:
+        return {}
+    return {str(test_id): CostEntry.from_dict(entry) for test_id, entry in tests.items()}
+
+
+def write_profile(path: Path, profile: ty.Mapping[str, CostEntry]) -> None:
+    """Update the cost profile with the tests of a session, keeping the other tests."""
+    tests = read_profile(path)
+    tests.update(profile)
+    with open(path, 'w', encoding='utf8') as handle:
+        json.dump({'tests': {test_id: tests[test_id].to_dict()
+                             for test_id in sorted(tests)}},
+                  handle,
+                  indent=2)
+
+
+def expected_cost(entry: CostEntry, regenerate: bool = False) -> float:
+    """Return the expected wall time of a test from its cost profile.
+
+    :param entry: Cost profile of the test
+    :param regenerate: If True, all results are expected to be regenerated
+    """
+    cost = entry.duration
+    for run in entry.runs:
+        run_time = run.run_time or 0.
+        if not run.hit:
+            cost -= run_time
+        if regenerate or not _is_cached(run.data_dir, run.key):
+            cost += run_time
+    return max(cost, 0.)
+
+
+def _is_cached(data_dir: ty.Optional[str], key: str) -> bool:
+    """Return whether the results of the given name exist in the data directory."""
+    if data_dir is None or not Path(data_dir).is_dir():
+        return False
+    with DataDirectory(Path(data_dir)) as data_directory:
+        return data_directory.contains(key)
+
+
+def partition(costs: ty.Mapping[str, ty.Optional[float]], count: int) -> ty.List[ty.List[str]]:
+    """Partition tests into shards of balanced total cost.
+
+    Tests are assigned in order of decreasing cost to the shard with the lowest total cost so far, which
+    is deterministic for the same tests and costs. Tests without a known cost are assigned the median
+    cost of the known ones.
+
+    :param costs: Expected cost of each test by node id, or None if unknown
+    :param count: Number of shards
+    :return: The node ids of the tests of each shard, in the order of ``costs``.
+    """
+    known = sorted(cost for cost in costs.values() if cost is not None)
+    default = known[len(known) // 2] if known else DEFAULT_COST
+    resolved = {test_id: default if cost is None else cost for test_id, cost in costs.items()}
+    order = {test_id: idx for idx, test_id in enumerate(costs)}
+    totals = [0.] * count
+    shards: ty.List[ty.List[str]] = [[] for _ in range(count)]
+    for test_id in sorted(resolved, key=lambda test_id: (-resolved[test_id], order[test_id])):
+        shard = min(range(count), key=lambda idx: (totals[idx], idx))
+        totals[shard] += resolved[test_id]
+        shards[shard].append(test_id)
+    return [sorted(shard, key=order.__getitem__) for shard in shards]
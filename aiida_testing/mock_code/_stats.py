@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Statistics of the mock code invocations of a test session.
+
+Every invocation appends one JSON record to the statistics file of the session, with the fields
+
+* ``label``, ``key`` (name of the results) and ``test``: what was run
+* ``test_id`` (node id of the test, if known) and ``data_dir``: where it was run from
+* ``hasher`` (reference of a custom hasher, if any) and ``inputs``: the paths of the input files that
+  contributed to the hash, relative to the working directory
+* ``hit``: whether cached results were restored
+* ``source``: where the invocation was handled, ``'executable'``, ``'server'`` or ``'in-process'``
+* ``hash_time``: time spent hashing the inputs, in seconds
+* ``restore_time`` (hits) or ``copy_time`` (misses): time spent restoring or storing the outputs, in seconds
+* ``bytes``: size of the restored or stored outputs
+* ``run_time``: wall time of the actual code; for hits, as recorded when the results were created (if known)
+
+:func:`summarize` aggregates the records into the summary shown at the end of the test session.
+"""
+import collections
+import json
+import os
+from pathlib import Path
+import typing as ty
+
+__all__ = ("append_record", "read_records", "summarize", "format_summary")
+
+#: Number of records listed as slowest hashes and restores
+TOP_RECORDS = 5
+
+#: Fields of the summary of each label
+_LABEL_FIELDS = (
+    'hits', 'misses', 'hash_time', 'restore_time', 'copy_time', 'bytes', 'run_time', 'time_saved',
+    'hits_without_run_time'
+)
+
+
+def append_record(stats_file: Path, record: ty.Mapping[str, ty.Any]) -> None:
+    """Append a record to the statistics file, atomically with respect to concurrent processes."""
+    descriptor = os.open(stats_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(descriptor, json.dumps(record).encode() + b'\n')
+    finally:
+        os.close(descriptor)
+
+
+def read_records(stats_file: Path) -> ty.List[ty.Dict[str, ty.Any]]:
+    """Read all records of the statistics file, skipping incomplete lines."""
+    records = []
+    try:
+        with open(stats_file, encoding='utf8') as handle:
+            for line in handle:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return records
+
+
+def summarize(records: ty.Iterable[ty.Mapping[str, ty.Any]]) -> ty.Dict[str, ty.Any]:
+    """Aggregate the records per label.
+
+    The compute time saved by replay is estimated as the run time of the actual code recorded for
+    the results of each cache hit. Hits of results created before run times were recorded are counted
+    separately.
+    """
+    records = list(records)
+    labels: ty.DefaultDict[str, ty.Dict[str, ty.Any]] = collections.defaultdict(_new_label_stats)
+    for record in records:
+        stats = labels[record['label']]
+        stats['hits' if record['hit'] else 'misses'] += 1
+        stats['hash_time'] += record.get('hash_time') or 0.
+        stats['restore_time'] += record.get('restore_time') or 0.
+        stats['copy_time'] += record.get('copy_time') or 0.
+        stats['bytes'] += record.get('bytes') or 0
+        if record['hit']:
+            if record.get('run_time') is None:
+                stats['hits_without_run_time'] += 1
+            else:
+                stats['time_saved'] += record['run_time']
+        else:
+            stats['run_time'] += record.get('run_time') or 0.
+
+    for stats in labels.values():
+        stats['hit_rate'] = stats['hits'] / (stats['hits'] + stats['misses'])
+
+    def _slowest(field: str) -> ty.List[ty.Dict[str, ty.Any]]:
+        selected = [record for record in records if record.get(field) is not None]
+        selected.sort(key=lambda record: record[field], reverse=True)
+        return [{key: record.get(key)
+                 for key in ('label', 'key', 'test', field)} for record in selected[:TOP_RECORDS]]
+
+    hits = sum(stats['hits'] for stats in labels.values())
+    return {
+        'invocations': len(records),
+        'hits': hits,
+        'hit_rate': hits / len(records) if records else 0.,
+        'time_saved': sum(stats['time_saved'] for stats in labels.values()),
+        'hits_without_run_time': sum(stats['hits_without_run_time'] for stats in labels.values()),
+        'labels': dict(sorted(labels.items())),
+        'slowest_hashes': _slowest('hash_time'),
+        'slowest_restores': _slowest('restore_time'),
+    }
+
+
+def _new_label_stats() -> ty.Dict[str, ty.Any]:
+    """Return the initial summary of a label."""
+    return dict.fromkeys(_LABEL_FIELDS, 0)
+
+
+def format_summary(summary: ty.Mapping[str, ty.Any]) -> ty.List[str]:
+    """Format the summary as lines of text for the terminal."""
+    lines = [
+        f"{'label':<24} {'calls':>6} {'hits':>6} {'hit rate':>9} {'hash':>9} {'restore':>9} "
+        f"{'run':>9} {'saved':>9}"
+    ]
+    for label, stats in summary['labels'].items():
+        lines.append(
+            f"{label:<24} {stats['hits'] + stats['misses']:>6} {stats['hits']:>6} "
+            f"{stats['hit_rate']:>9.1%} {stats['hash_time']:>8.2f}s {stats['restore_time']:>8.2f}s "
+            f"{stats['run_time']:>8.2f}s {stats['time_saved']:>8.2f}s"
+        )
+    saved = f"Estimated compute time saved by replay: {summary['time_saved']:.2f}s"
+    if summary['hits_without_run_time']:
+        saved += f" ({summary['hits_without_run_time']} hits without recorded run time)"
+    lines.append(saved)
+    for title, field in (('hashes', 'hash_time'), ('restores', 'restore_time')):
+        if summary[f'slowest_{title}']:
+            lines.append(f"Slowest {title}:")
+            for record in summary[f'slowest_{title}']:
+                lines.append(f"  {record[field]:8.3f}s  {record['key']}  ({record['test']})")
+    return lines
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""
+Storage layouts for the results of the mock code in the data directory.
+
+With the default ``'files'`` layout, each results directory contains plain
+copies of the output files. With the ``'objects'`` layout, every file is
+written once into a content-addressed object store, and the results
+directory only contains a manifest mapping relative paths to digests.
+The ``'chunks'`` layout splits files into content-defined chunks, such that
+large files differing only in a few places share most of their chunks.
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+import stat
+import tempfile
+import typing as ty
+import zlib
+
+if ty.TYPE_CHECKING:
+    from ._restore import FileRestorer  # pylint: disable=unused-import
+
+__all__ = (
+    "STORAGE_LAYOUTS", "DATA_LAYOUTS", "META_PREFIX", "MANIFEST_FILE", "ObjectStore", "iter_chunks",
+    "restore_entry"
+)
+
+#: Available storage layouts of the results directories
+STORAGE_LAYOUTS = ('files', 'objects', 'chunks')
+
+#: Files at the top level of a results directory with this prefix are metadata and are never restored
+META_PREFIX = '.aiida-mock-'
+
+#: Name of the manifest file of results directories using the 'objects' or 'chunks' layout
+MANIFEST_FILE = f'{META_PREFIX}manifest.json'
+
+#: Name of the file with metadata of results directories, e.g. the run time of the actual code
+METADATA_FILE = f'{META_PREFIX}meta.json'
+
+#: Default location of the object store, relative to the data directory
+DEFAULT_OBJECT_STORE = '.objects'
+
+#: Prefix of the names of results directories
+ENTRY_PREFIX = 'mock-'
+
+#: Separator of the label and the version in the names of versioned results directories
+VERSION_SEPARATOR = '@'
+
+#: Layouts of the results directories in the data directory: ``mock-{label}-{hash}`` directly in the data
+#: directory ('flat'), or ``{label}/{hash[:2]}/{hash}`` ('sharded')
+DATA_LAYOUTS = ('flat', 'sharded')
+
+_CHUNK_SIZE = 1024**2
+
+#: Bounds of the size of content-defined chunks, in bytes
+MIN_CHUNK_SIZE = 2 * 1024
+MAX_CHUNK_SIZE = 64 * 1024
+
+# a chunk boundary is set after a line whose checksum has these bits unset
+_BOUNDARY_MASK = 0x3f
+
+# within long lines, a chunk boundary is set after a byte where the rolling hash of the preceding
+# ``_GEAR_WINDOW`` bytes has these (high) bits unset, i.e. on average every 8 KiB
+_GEAR_MASK = 0xfff80000
+_GEAR_WINDOW = 32
+# random values of the bytes, fixed such that the chunks are the same across processes
+_GEAR = tuple(
+    int.from_bytes(hashlib.sha256(bytes([byte])).digest()[:4], 'big') for byte in range(256)
+)
+
+
+def iter_chunks(handle: ty.BinaryIO) -> ty.Iterator[bytes]:
+    """Split the content of a file into content-defined chunks.
+
+    Chunk boundaries are placed after lines whose CRC32 checksum matches a bit mask, so that
+    a local change (e.g. a timing in a log file) only affects the chunk containing it, and the
+    chunks after it are found again. Lines longer than ``MAX_CHUNK_SIZE`` (e.g. in files without
+    line breaks) are cut where a rolling hash of their bytes matches a bit mask instead.
+    """
+    chunk = bytearray()
+    in_long_line = False
+    while True:
+        line = handle.readline(MAX_CHUNK_SIZE)
+        if not line:
+            break
+        is_complete = line.endswith(b'\n')
+        if in_long_line or not is_complete:
+            start = len(chunk)
+            chunk += line
+            yield from _cut_long_line(chunk, start)
+        else:
+            if len(chunk) + len(line) > MAX_CHUNK_SIZE:
+                yield bytes(chunk)
+                chunk.clear()
+            chunk += line
+            if len(chunk) >= MIN_CHUNK_SIZE and zlib.crc32(line) & _BOUNDARY_MASK == 0:
+                yield bytes(chunk)
+                chunk.clear()
+        in_long_line = not is_complete
+    if chunk:
+        yield bytes(chunk)
+
+
+def _cut_long_line(chunk: bytearray, start: int) -> ty.Iterator[bytes]:
+    """Yield and remove the chunks at the start of the buffer, searching for boundaries after ``start``."""
+    while True:
+        end = _find_boundary(chunk, max(start, MIN_CHUNK_SIZE - 1), MAX_CHUNK_SIZE)
+        if end is None:
+            if len(chunk) < MAX_CHUNK_SIZE:
+                return
+            end = MAX_CHUNK_SIZE
+        yield bytes(chunk[:end])
+        del chunk[:end]
+        start = 0
+
+
+def _find_boundary(data: bytearray, start: int, stop: int) -> ty.Optional[int]:
+    """Return the end of the first chunk ending at or after ``start`` and before ``stop``, or None."""
+    value = 0
+    begin = max(start - _GEAR_WINDOW, 0)
+    for idx, byte in enumerate(data[begin:stop], begin):
+        value = ((value << 1) + _GEAR[byte]) & 0xffffffff
+        if idx >= start and not value & _GEAR_MASK:
+            return idx + 1
+    return None
+
+
+def entry_name(label: str, hash_digest: str, version: ty.Optional[str] = None) -> str:
+    """Return the name of the results directory for the given label and hash.
+
+    With a version, the name is ``mock-{label}@{version}-{hash}``, such that results of different versions
+    of an executable coexist in the data directory.
+    """
+    if version is not None:
+        label = f"{label}{VERSION_SEPARATOR}{version}"
+    return f"{ENTRY_PREFIX}{label}-{hash_digest}"
+
+
+def split_entry_name(name: str) -> ty.Tuple[str, str]:
+    """Split the name ``mock-{label}-{hash}`` of a results directory into label and hash.
+
+    The label of versioned results includes the version, i.e. it is ``{label}@{version}``.
+    """
+    if not name.startswith(ENTRY_PREFIX) or '-' not in name[len(ENTRY_PREFIX):]:
+        raise ValueError(f"'{name}' is not the name of a mock code results directory.")
+    label, hash_digest = name[len(ENTRY_PREFIX):].rsplit('-', 1)
+    return label, hash_digest
+
+
+def entry_path(data_dir: Path, name: str, layout: str = 'flat') -> Path:
+    """Return the path of the results directory of the given name in the given layout."""
+    if layout == 'flat':
+        return data_dir / name
+    if layout == 'sharded':
+        label, hash_digest = split_entry_name(name)
+        return data_dir / label / hash_digest[:2] / hash_digest
+    raise ValueError(f"Unknown data directory layout '{layout}', choose from {DATA_LAYOUTS}.")
+
+
+def iter_entries(data_dir: Path) -> ty.Iterator[ty.Tuple[str, Path]]:
+    """Iterate over the names and paths of the results directories in a data directory, in all layouts."""
+    for path in sorted(data_dir.glob(f'{ENTRY_PREFIX}*')):
+        if path.is_dir():
+            yield path.name, path
+    for label_dir in sorted(data_dir.iterdir()) if data_dir.is_dir() else ():
+        if label_dir.name.startswith(('.', ENTRY_PREFIX)) or not label_dir.is_dir():
+            continue
+        for shard_dir in sorted(label_dir.iterdir()):
+            if len(shard_dir.name) != 2 or not shard_dir.is_dir():
+                continue
+            for path in sorted(shard_dir.iterdir()):
+                if path.name[:2] == shard_dir.name and path.is_dir():
+                    yield entry_name(label_dir.name, path.name), path
+
+
+def file_digest(path: Path) -> str:
+    """Return the SHA256 digest of the file content."""
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class ObjectStore:
+    """
+    Content-addressed store of files, keyed by their SHA256 digest.
+
+    The store can be shared between data directories. Objects are written
+    atomically and made read-only, such that they can be hard-linked on restore.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+
+    @classmethod
+    def for_data_dir(cls, data_dir: Path, object_store: ty.Optional[Path] = None) -> 'ObjectStore':
+        """Return the object store of a data directory.
+
+        :param data_dir: The data directory of the mock code.
+        :param object_store: Path to the object store. Relative paths are interpreted with respect to
+            the data directory. Defaults to ``.objects`` inside the data directory.
+        """
+        return cls(data_dir / (object_store or DEFAULT_OBJECT_STORE))
+
+    def object_path(self, digest: str) -> Path:
+        """Return the path of the object with the given digest."""
+        return self.path / digest[:2] / digest[2:]
+
+    def add_file(self, path: Path) -> str:
+        """Add a file to the store, if not present yet, and return its digest."""
+        digest = file_digest(path)
+        if not self.object_path(digest).exists():
+            with open(path, 'rb') as handle:
+                self._write(digest, iter(lambda: handle.read(_CHUNK_SIZE), b''))
+        return digest
+
+    def add_bytes(self, content: bytes) -> str:
+        """Add a byte string to the store, if not present yet, and return its digest."""
+        digest = hashlib.sha256(content).hexdigest()
+        if not self.object_path(digest).exists():
+            self._write(digest, [content])
+        return digest
+
+    def add_chunked_file(self, path: Path) -> ty.List[str]:
+        """Add the content-defined chunks of a file to the store and return their digests."""
+        with open(path, 'rb') as handle:
+            return [self.add_bytes(chunk) for chunk in iter_chunks(handle)]
+
+    def _write(self, digest: str, content: ty.Iterable[bytes]) -> None:
+        """Atomically write a read-only object to the store."""
+        target = self.object_path(digest)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        handle, tmp_path = tempfile.mkstemp(dir=target.parent, prefix='.tmp-')
+        try:
+            with os.fdopen(handle, 'wb') as dest:
+                for part in content:
+                    dest.write(part)
+            os.chmod(tmp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            os.replace(tmp_path, target)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+def read_manifest(res_dir: Path) -> ty.Optional[ty.Dict[str, ty.Any]]:
+    """Return the manifest of a results directory, or None if it stores plain files.
+
+    The manifest maps relative paths to object digests under ``'files'``, and to lists
+    of chunk digests under ``'chunks'``.
+    """
+    try:
+        with open(res_dir / MANIFEST_FILE, encoding='utf8') as handle:
+            return ty.cast(ty.Dict[str, ty.Any], json.load(handle))
+    except FileNotFoundError:
+        return None
+
+
+def write_manifest(
+    res_dir: Path,
+    files: ty.Mapping[str, str],
+    chunks: ty.Optional[ty.Mapping[str, ty.List[str]]] = None
+) -> None:
+    """Write the manifest of a results directory."""
+    manifest: ty.Dict[str, ty.Any] = {'files': dict(sorted(files.items()))}
+    if chunks:
+        manifest['chunks'] = dict(sorted(chunks.items()))
+    with open(res_dir / MANIFEST_FILE, 'w', encoding='utf8') as handle:
+        json.dump(manifest, handle, indent=1)
+
+
+def read_metadata(res_dir: Path) -> ty.Dict[str, ty.Any]:
+    """Return the metadata of a results directory, or an empty dict if it has none."""
+    try:
+        with open(res_dir / METADATA_FILE, encoding='utf8') as handle:
+            return ty.cast(ty.Dict[str, ty.Any], json.load(handle))
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def write_metadata(res_dir: Path, metadata: ty.Mapping[str, ty.Any]) -> None:
+    """Write the metadata of a results directory."""
+    with open(res_dir / METADATA_FILE, 'w', encoding='utf8') as handle:
+        json.dump(dict(metadata), handle, indent=1)
+
+
+def restore_entry(
+    res_dir: Path,
+    dest_dir: Path,
+    restorer: 'FileRestorer',
+    object_store: ObjectStore,
+    include: ty.Optional[ty.Callable[[str], bool]] = None,
+) -> None:
+    """Restore the outputs of a results directory in any storage layout.
+
+    :param res_dir: Results directory in the data directory
+    :param dest_dir: Working directory of the calculation
+    :param restorer: Restorer used to materialize the files
+    :param object_store: Object store referenced by the manifest, if any
+    :param include: If given, only files whose relative path satisfies this predicate are restored
+    """
+    restorer.restore_tree(res_dir, dest_dir, exclude_prefix=META_PREFIX, include=include)
+    manifest = read_manifest(res_dir)
+    if manifest is None:
+        return
+
+    file_pairs = []
+    for relative_path, digest in manifest.get('files', {}).items():
+        if include is not None and not include(relative_path):
+            continue
+        dest = dest_dir / relative_path
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        file_pairs.append((object_store.object_path(digest), dest))
+    restorer.restore_many(file_pairs)
+
+    for relative_path, digests in manifest.get('chunks', {}).items():
+        if include is not None and not include(relative_path):
+            continue
+        dest = dest_dir / relative_path
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        with open(dest, 'wb') as handle:
+            for digest in digests:
+                with open(object_store.object_path(digest), 'rb') as chunk:
+                    handle.write(chunk.read())
+            restorer.restored_bytes += handle.tell()
+        restorer.counts['chunks'] += 1
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Limits the number of concurrent runs of actual executables across processes.
+
+Each run holds one of ``max_runs`` slots, implemented as lock files in a
+directory shared by all processes of a test session (e.g. all ``pytest-xdist``
+workers), see :func:`session_slots_dir`. The slot index is also used to give each concurrent run its own
+partition of the available CPU cores.
+"""
+import contextlib
+import fcntl
+import os
+from pathlib import Path
+import random
+import shutil
+import tempfile
+import time
+import typing as ty
+
+__all__ = ("RunSlots", "cpu_partition", "session_slots_dir", "remove_session_slots")
+
+#: Directory of the slot lock files of all test sessions of the user
+DEFAULT_SLOTS_DIR = Path(tempfile.gettempdir()) / f'aiida-mock-run-slots-{os.getuid()}'
+
+
+def session_slots_dir(session: ty.Optional[str]) -> Path:
+    """Return the directory of the slot lock files of a test session, so that sessions do not share slots.
+
+    :param session: Identifier of the test session, or None for mock codes run outside of a session
+    """
+    return DEFAULT_SLOTS_DIR / (session or 'no-session')
+
+
+def remove_session_slots(session: str) -> None:
+    """Remove the slot lock files of a test session, at the end of the session."""
+    shutil.rmtree(session_slots_dir(session), ignore_errors=True)
+
+
+_POLL_INTERVAL = 0.05
+
+
+class RunSlots:  # pylint: disable=too-few-public-methods
+    """
+    Counting semaphore across processes, based on lock files.
+
+    :param name: Name of the group of runs sharing the slots, e.g. a code label.
+    :param max_runs: Number of slots, i.e. maximum number of concurrent runs.
+    :param directory: Directory containing the lock files of all groups.
+    """
+
+    def __init__(self, name: str, max_runs: int, directory: Path = DEFAULT_SLOTS_DIR) -> None:
+        if max_runs < 1:
+            raise ValueError(
+                f"The maximum number of concurrent runs must be positive, got {max_runs}."
+            )
+        self.path = Path(directory) / name
+        self.max_runs = max_runs
+
+    @contextlib.contextmanager
+    def acquire(self) -> ty.Iterator[int]:
+        """Wait for a free slot and hold it.
+
+        :return: Context manager yielding the index of the acquired slot.
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        handles = [
+            open(self.path / f'slot-{idx}.lock', 'w', encoding='utf8')  # pylint: disable=consider-using-with
+            for idx in range(self.max_runs)
+        ]
+        try:
+            slot = self._lock_free_slot(handles)
+            try:
+                yield slot
+            finally:
+                fcntl.flock(handles[slot], fcntl.LOCK_UN)
+        finally:
+            for handle in handles:
+                handle.close()
+
+    @staticmethod
+    def _lock_free_slot(handles: ty.Sequence[ty.TextIO]) -> int:
+        """Lock the first free slot, polling until one becomes free."""
+        while True:
+            for idx, handle in enumerate(handles):
+                try:
+                    fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return idx
+                except BlockingIOError:
+                    continue
+            # randomize to avoid waiting processes polling in lock-step
+            time.sleep(_POLL_INTERVAL * (1 + random.random()))
+
+
+def cpu_partition(slot: int, num_slots: int) -> ty.Set[int]:
+    """Return the CPU cores of a slot, when splitting the available cores evenly across all slots.
+
+    If there are fewer cores than slots, slots share cores.
+    """
+    cores = sorted(os.sched_getaffinity(0))
+    if num_slots >= len(cores):
+        return {cores[slot % len(cores)]}
+    start = slot * len(cores) // num_slots
+    end = (slot + 1) * len(cores) // num_slots
+    return set(cores[start:end])
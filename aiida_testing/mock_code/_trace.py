@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Timeline tracing of mock codes in the Chrome trace event format.
+
+Each traced process appends complete (``"ph": "X"``) events to its own file in the trace
+directory of the test session, one JSON object per line. At the end of the session,
+:func:`merge_traces` combines them into a single trace file, which can be opened in
+``chrome://tracing`` or https://ui.perfetto.dev.
+
+Tracing is disabled by default, in which case :func:`span` returns a shared no-op context manager.
+"""
+import contextlib
+import json
+import os
+from pathlib import Path
+import threading
+import time
+import typing as ty
+import uuid
+
+__all__ = ("Tracer", "configure", "span", "set_test_name", "merge_traces")
+
+#: Suffix of the trace files written by each process
+TRACE_SUFFIX = '.trace.jsonl'
+
+
+class _NoSpan:
+    """Context manager used when tracing is disabled, yielding arguments that are discarded."""
+
+    def __enter__(self) -> ty.Dict[str, ty.Any]:
+        return {}
+
+    def __exit__(self, *exc_info: ty.Any) -> None:
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+class Tracer:
+    """
+    Writes span events of this process to a file in the trace directory.
+
+    :param trace_dir: Directory of the trace files of the session.
+    :param process_name: Name of the process shown in the timeline.
+    :param memory: If True, the peak memory allocated by Python during each span is recorded, using
+        :mod:`tracemalloc`. This slows down the traced code considerably.
+    """
+
+    def __init__(self, trace_dir: Path, process_name: str, memory: bool = False) -> None:
+        self.pid = os.getpid()
+        self.test_name: ty.Optional[str] = None
+        self._path = Path(trace_dir) / f'{self.pid}-{uuid.uuid4().hex[:8]}{TRACE_SUFFIX}'
+        self._fd: ty.Optional[int] = os.open(
+            self._path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644
+        )
+        self._local = threading.local()
+        self._tracemalloc: ty.Any = None
+        if memory:
+            import tracemalloc  # pylint: disable=import-outside-toplevel
+            # peaks of nested spans require resetting the peak, available since Python 3.9
+            if hasattr(tracemalloc, 'reset_peak'):
+                self._tracemalloc = tracemalloc
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+        self._write({
+            'name': 'process_name',
+            'ph': 'M',
+            'pid': self.pid,
+            'tid': 0,
+            'args': {
+                'name': f'{process_name} ({self.pid})'
+            }
+        })
+
+    @contextlib.contextmanager
+    def span(self, name: str, category: str, **args: ty.Any) -> ty.Iterator[ty.Dict[str, ty.Any]]:
+        """Record the duration of the enclosed code as an event.
+
+        :param name: Name of the event.
+        :param category: Category of the event, e.g. ``'hash'`` or ``'restore'``.
+        :param args: Additional arguments shown with the event. The ``test`` argument defaults to the
+            test of the enclosing span, or else the current test of the process.
+        :return: Context manager yielding the arguments of the event, which can be extended.
+        """
+        stack = self._local.__dict__.setdefault('stack', [])
+        if self._tracemalloc is not None:
+            if stack:
+                stack[-1][0] = max(stack[-1][0], self._tracemalloc.get_traced_memory()[1])
+            self._tracemalloc.reset_peak()
+        # nested spans inherit the test of the enclosing span, e.g. requests handled by a server thread
+        args = {'test': stack[-1][1] if stack else self.test_name, **args}
+        stack.append([0, args['test']])
+        start = time.time_ns()
+        try:
+            yield args
+        finally:
+            duration = time.time_ns() - start
+            peak = stack.pop()
+            if self._tracemalloc is not None:
+                args['peak_memory'] = max(peak[0], self._tracemalloc.get_traced_memory()[1])
+                if stack:
+                    stack[-1][0] = max(stack[-1][0], args['peak_memory'])
+                self._tracemalloc.reset_peak()
+            self._write({
+                'name': name,
+                'cat': category,
+                'ph': 'X',
+                'ts': start / 1e3,
+                'dur': duration / 1e3,
+                'pid': self.pid,
+                'tid': threading.get_ident(),
+                'args': args,
+            })
+
+    def close(self) -> None:
+        """Close the trace file of the process."""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _write(self, event: ty.Mapping[str, ty.Any]) -> None:
+        """Append an event to the trace file of the process."""
+        if self._fd is None:
+            return
+        os.write(self._fd, json.dumps(event, default=str).encode() + b'\n')
+
+
+_TRACER: ty.Optional[Tracer] = None
+
+
+def configure(trace_dir: ty.Optional[Path],
+              process_name: str,
+              memory: bool = False) -> ty.Optional[Tracer]:
+    """Enable tracing of this process into the given trace directory, or disable it if None."""
+    global _TRACER  # pylint: disable=global-statement
+    if _TRACER is not None:
+        _TRACER.close()
+    _TRACER = Tracer(trace_dir, process_name, memory=memory) if trace_dir is not None else None
+    return _TRACER
+
+
+def span(name: str, category: str = 'mock_code', **args: ty.Any) -> ty.ContextManager[ty.Any]:
+    """Record the duration of the enclosed code, if tracing is enabled. See :meth:`Tracer.span`."""
+    if _TRACER is None:
+        return _NO_SPAN
+    return _TRACER.span(name, category, **args)
+
+
+def set_test_name(test_name: ty.Optional[str]) -> None:
+    """Set the name of the current test, which is added to all subsequent events of this process."""
+    if _TRACER is not None:
+        _TRACER.test_name = test_name
+
+
+def merge_traces(trace_dir: Path, output: Path) -> int:
+    """Merge the trace files of all processes into a single trace file in the JSON object format.
+
+    :return: The number of merged events.
+    """
+    events = []
+    for path in sorted(Path(trace_dir).glob(f'*{TRACE_SUFFIX}')):
+        with open(path, encoding='utf8') as handle:
+            for line in handle:
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    # incomplete line of a process that was killed
+                    continue
+    with open(output, 'w', encoding='utf8') as handle:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, handle)
+    return len(events)
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Records which results of a data directory are used by test sessions.
+
+Each test session appends the names of the results it uses to ``.usage/{session}.log``
+in the data directory, and marks its end in ``.usage/{session}.done``. Results not used
+by recent full sessions can then be removed with ``aiida-mock-data gc``.
+
+Verifications of results against the actual executable are recorded in ``.usage/verified.jsonl``.
+"""
+import json
+import os
+from pathlib import Path
+import time
+import typing as ty
+import uuid
+
+from ._data_dir import _create_private_dir
+
+__all__ = ("UsageLog", "Session", "new_session_id")
+
+#: Directory of the usage logs, relative to the data directory
+USAGE_DIR = '.usage'
+
+#: File recording the verifications of results, in the usage directory
+VERIFIED_FILE = 'verified.jsonl'
+
+
+def new_session_id() -> str:
+    """Return a new, chronologically sortable identifier of a test session."""
+    return f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+
+class Session(ty.NamedTuple):
+    """A test session recorded in the usage log."""
+
+    id: str
+    #: Time at which the session finished, or None if it did not finish (yet)
+    finished: ty.Optional[float]
+    #: Whether the session ran the full test suite
+    full: bool
+    #: Names of the results used by the session
+    names: ty.FrozenSet[str]
+
+
+class UsageLog:
+    """
+    Usage log of the results in a data directory.
+
+    Appending to the log files is atomic for single lines, so concurrent processes
+    of the same session (e.g. ``pytest-xdist`` workers) can record their usage safely.
+
+    :param data_dir: Path of the data directory.
+    """
+
+    def __init__(self, data_dir: Path) -> None:
+        self.path = Path(data_dir) / USAGE_DIR
+
+    def record(self, session: str, name: str) -> None:
+        """Record that the results of the given name were used by a session."""
+        self._append(f'{session}.log', name)
+
+    def finish(self, session: str, full: bool) -> None:
+        """Record that a process of the session finished.
+
+        :param full: Whether the session ran the full test suite. A session only counts as full
+            if all of its processes report so.
+        """
+        self._append(f'{session}.done', json.dumps({'finished': time.time(), 'full': full}))
+
+    def record_verification(self, name: str, match: bool) -> None:
+        """Record that the results of the given name were verified against the actual executable."""
+        self._append(VERIFIED_FILE, json.dumps({'name': name, 'time': time.time(), 'match': match}))
+
+    def last_verified(self) -> ty.Dict[str, float]:
+        """Return the time of the last verification of each verified result."""
+        last: ty.Dict[str, float] = {}
+        try:
+            with open(self.path / VERIFIED_FILE, encoding='utf8') as handle:
+                for line in handle:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    last[record['name']] = max(last.get(record['name'], 0.), record['time'])
+        except FileNotFoundError:
+            pass
+        return last
+
+    def sessions(self) -> ty.List[Session]:
+        """Return the recorded sessions, ordered by the time they started."""
+        if not self.path.is_dir():
+            return []
+        sessions = []
+        for session in sorted({path.stem
+                               for path in self.path.glob('*.log')}
+                              | {path.stem
+                                 for path in self.path.glob('*.done')}):
+            log_path = self.path / f'{session}.log'
+            names = frozenset(log_path.read_text(encoding='utf8').split()
+                              ) if log_path.exists() else frozenset()
+            done_path = self.path / f'{session}.done'
+            finished, full = None, False
+            if done_path.exists():
+                records = [
+                    json.loads(line) for line in done_path.read_text(encoding='utf8').splitlines()
+                ]
+                finished = max(record['finished'] for record in records)
+                full = all(record['full'] for record in records)
+            sessions.append(Session(session, finished, full, names))
+        return sessions
+
+    def remove(self, session: str) -> None:
+        """Remove the usage log of a session."""
+        for suffix in ('.log', '.done'):
+            try:
+                (self.path / f'{session}{suffix}').unlink()
+            except FileNotFoundError:
+                pass
+
+    def _append(self, file_name: str, line: str) -> None:
+        """Append a line to a file of the usage log."""
+        _create_private_dir(self.path)
+        descriptor = os.open(self.path / file_name, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(descriptor, f'{line}\n'.encode())
+        finally:
+            os.close(descriptor)
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Verification of replayed results against the actual executable.
+
+With a verification sample, a fraction of the cache hits additionally runs the actual executable on
+a copy of the inputs, in a scratch directory, and compares its outputs to the stored results. Results
+that were not verified recently are sampled with a higher probability, and no verification starts once
+the verifications of the test session used up the time budget.
+
+Every verification appends one JSON record to the verification file of the session, with the fields
+``label``, ``key``, ``test``, ``time`` (wall time of the verification, in seconds), ``match`` and
+``differences`` (relative paths of the files that differ).
+"""
+import os
+from pathlib import Path
+import random
+import time
+import typing as ty
+
+from ._stats import read_records
+from ._usage import UsageLog
+
+if ty.TYPE_CHECKING:
+    from ._data_dir import DataDirectory  # pylint: disable=unused-import
+    from ._env_keys import MockVariables  # pylint: disable=unused-import
+
+__all__ = (
+    "select_for_verification", "request_verification", "compare_outputs", "format_verification"
+)
+
+#: Results verified this long ago (in seconds) are sampled with the base probability
+VERIFY_INTERVAL = 7 * 86400
+
+#: Marker in the working directory of a calculation, requesting its verification from the executable
+VERIFY_MARKER = '.aiida/aiida-mock-verify'
+
+
+def select_for_verification(
+    env: 'MockVariables', data_directory: 'DataDirectory', name: str
+) -> bool:
+    """Decide whether the cache hit of the results of the given name is verified.
+
+    The sample fraction is weighted with the time since the last verification of the results, from 0 for
+    results verified just now to 2 for results never verified or verified more than twice the
+    ``VERIFY_INTERVAL`` ago.
+    """
+    if env.verify_sample is None or env.verify_file is None or not env.executable_path:
+        return False
+    if env.verify_budget is not None:
+        used = sum(record['time'] for record in read_records(env.verify_file))
+        if used >= env.verify_budget:
+            return False
+    last = UsageLog(data_directory.path).last_verified().get(name)
+    weight = 2. if last is None else min(2., (time.time() - last) / VERIFY_INTERVAL)
+    return random.random() < env.verify_sample * weight
+
+
+def request_verification(workdir: Path) -> None:
+    """Mark the calculation in the working directory for verification by the ``aiida-mock-code`` executable.
+
+    Used by processes that replay cache hits without running the executable, which decline to replay
+    the hits selected for verification.
+    """
+    (workdir / VERIFY_MARKER).touch()
+
+
+def compare_outputs(
+    expected_dir: Path, actual_dir: Path, normalize: ty.Callable[[Path, bytes], ty.Optional[bytes]]
+) -> ty.List[str]:
+    """Compare the stored outputs to the outputs of the actual executable.
+
+    :param expected_dir: Directory with the restored results
+    :param actual_dir: Directory with the outputs of the actual executable, filtered like stored results
+    :param normalize: Normalization of the content of each file before comparing, e.g. to remove
+        timings. If it returns None, the file is not compared.
+    :return: The relative POSIX paths of the files that differ, are missing or are unexpected.
+    """
+    expected, actual = _list_files(expected_dir), _list_files(actual_dir)
+    differences = []
+    for relpath in sorted(expected | actual):
+        contents = []
+        for root, files in ((expected_dir, expected), (actual_dir, actual)):
+            path = root / relpath
+            contents.append(normalize(path, path.read_bytes()) if relpath in files else None)
+        if relpath not in expected or relpath not in actual:
+            if contents[0] is not None or contents[1] is not None:
+                differences.append(relpath)
+        elif contents[0] != contents[1]:
+            differences.append(relpath)
+    return differences
+
+
+def _list_files(root: Path) -> ty.Set[str]:
+    """Return the relative POSIX paths of all files in the directory."""
+    return {
+        Path(dirpath, filename).relative_to(root).as_posix()
+        for dirpath, _, filenames in os.walk(root) for filename in filenames
+    }
+
+
+def format_verification(records: ty.Sequence[ty.Mapping[str, ty.Any]]) -> ty.List[str]:
+    """Format the verification records as lines of text for the terminal."""
+    mismatches = [record for record in records if not record['match']]
+    lines = [
+        f"Verified {len(records)} cache hits against the actual executable in "
+        f"{sum(record['time'] for record in records):.2f}s: {len(mismatches)} mismatches"
+    ]
+    for record in mismatches:
+        lines.append(f"  {record['key']}  ({record['test']}): {', '.join(record['differences'])}")
+    return lines
@@ -6,6 +6,7 @@ import pytest
 
 pytest_plugins = [
     'pytester',
+    'aiida.manage.tests.pytest_fixtures',
 ]  # pylint: disable=invalid-name
 
 
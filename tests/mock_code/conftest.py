@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Configuration file for pytest tests of the mock code.
+"""
+import os
+import shlex
+
+import pytest
+
+from aiida_testing.mock_code import InputHasher, _fingerprint
+from aiida_testing.mock_code._env_keys import MockVariables
+
+
+@pytest.fixture(autouse=True)
+def fingerprint_cache(tmp_path, monkeypatch):
+    """
+    Caches the fingerprints of executables in the temporary directory of the test, instead of the user's cache.
+    """
+    cache_dir = tmp_path / 'fingerprints'
+    monkeypatch.setattr(_fingerprint, 'FINGERPRINT_CACHE_DIR', cache_dir)
+    monkeypatch.setattr(_fingerprint, '_FINGERPRINTS', {})
+    return cache_dir
+
+
+@pytest.fixture
+def mock_code_env(tmp_path):
+    """
+    Creates the variables of a mock code, and the environment for running the ``aiida-mock-code``
+    executable with them.
+
+    As in the mock code fixtures, the variables are passed through a snapshot file shared between
+    tests, and the variables of the test are set in the environment.
+    """
+
+    def _mock_code_env(executable_path='', **kwargs):
+        values = {
+            'log_file': tmp_path / 'mock.log',
+            'label': 'code',
+            'test_name': 'test',
+            'data_dir': tmp_path / 'data',
+            'executable_path': str(executable_path),
+            'ignore_files': ('_aiidasubmit.sh', ),
+            'ignore_paths': ('_aiidasubmit.sh', ),
+            'regenerate_data': False,
+            'fail_on_missing': False,
+            '_hasher': InputHasher,
+            **kwargs
+        }
+        variables = MockVariables(**values)
+        variables.data_dir.mkdir(exist_ok=True)
+        snapshot_dir = tmp_path / 'snapshots'
+        snapshot_dir.mkdir(exist_ok=True)
+        snapshot = variables.write_snapshot(snapshot_dir, per_test=False)
+        env = {key: value for key, value in os.environ.items() if not key.startswith('AIIDA_MOCK_')}
+        key, value = shlex.split(MockVariables.snapshot_to_env(snapshot))[1].split('=', 1)
+        env[key] = value
+        env.update(variables.test_env())
+        return variables, env
+
+    return _mock_code_env
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Test the storage backends and the reference HTTP server.
+"""
+import functools
+import os
+import time
+
+import pytest
+
+from aiida_testing.mock_code._backends import CachedBackend, HttpBackend, LocalBackend, \
+    create_backend
+from aiida_testing.mock_code._cache_server import CacheServer
+from aiida_testing.mock_code._data_dir import DataDirectory
+from aiida_testing.mock_code._restore import FileRestorer
+from aiida_testing.mock_code._storage import entry_name
+
+
+@pytest.fixture
+def cache_server(tmp_path):
+    """Start the reference HTTP server on a free port."""
+    server = CacheServer(('127.0.0.1', 0), DataDirectory(tmp_path / 'server'))
+    server.start()
+    yield server
+    server.stop()
+
+
+def _files(contents):
+    """Return file openers for a mapping of relative paths to contents."""
+    return {path: functools.partial(_open_temporary, content) for path, content in contents.items()}
+
+
+def _open_temporary(content):
+    """Open bytes as a binary stream."""
+    import io  # pylint: disable=import-outside-toplevel
+    return io.BytesIO(content)
+
+
+def _read_tree(path):
+    """Return the relative paths and contents of all files in a directory."""
+    return {
+        file_path.relative_to(path).as_posix(): file_path.read_bytes()
+        for file_path in path.rglob('*') if file_path.is_file()
+    }
+
+
+CONTENTS = {'aiida.out': b'output\n', 'out/data.xml': b'<data/>'}
+
+
+@pytest.mark.parametrize('backend_type', ['local', 'http'])
+def test_backend_roundtrip(tmp_path, cache_server, backend_type):  # pylint: disable=redefined-outer-name
+    """Check lookup, publish and fetch of results."""
+    if backend_type == 'local':
+        backend = LocalBackend(tmp_path / 'shared')
+    else:
+        backend = HttpBackend(cache_server.url)
+    name = entry_name('code', f'{1:032x}')
+
+    assert not backend.lookup(name)
+    with pytest.raises(FileNotFoundError):
+        backend.fetch(name, tmp_path, FileRestorer())
+
+    backend.publish(name, _files(CONTENTS))
+    assert backend.lookup(name)
+    dest_dir = tmp_path / 'dest'
+    dest_dir.mkdir()
+    backend.fetch(name, dest_dir, FileRestorer(), include=lambda path: path != 'out/data.xml')
+    assert _read_tree(dest_dir) == {'aiida.out': b'output\n'}
+
+
+def test_http_backend_unreachable():
+    """Check that an unreachable server is treated as missing results, and contacted only once."""
+    backend = HttpBackend('http://127.0.0.1:9', lookup_timeout=1)
+    assert not backend.lookup(entry_name('code', 'abc'))
+    assert not backend.lookup(entry_name('code', 'def'))
+    errors = backend.pop_errors()
+    assert len(errors) == 1
+    assert 'unreachable' in errors[0]
+    assert not backend.pop_errors()
+
+
+def test_http_backend_lookup_once(tmp_path):
+    """Check that the result of a lookup is reused instead of sending another request."""
+    name = entry_name('code', 'abc')
+    LocalBackend(tmp_path / 'server').publish(name, _files(CONTENTS))
+    server = CacheServer(('127.0.0.1', 0), DataDirectory(tmp_path / 'server'))
+    server.start()
+    backend = HttpBackend(server.url)
+    try:
+        assert backend.lookup(name)
+    finally:
+        server.stop()
+    assert backend.lookup(name)
+    assert not backend.pop_errors()
+
+
+def test_cached_backend_lru(tmp_path, cache_server):  # pylint: disable=redefined-outer-name
+    """Check that the local tier evicts the least recently used results."""
+    remote = HttpBackend(cache_server.url)
+    names = [entry_name('code', f'{idx:032x}') for idx in range(3)]
+    for name in names:
+        remote.publish(name, _files({'aiida.out': os.urandom(1000)}))
+
+    backend = CachedBackend(remote, tmp_path / 'tier', max_size=2500)
+    # use the first results again, such that the second one is the least recently used
+    for idx, name in enumerate([names[0], names[1], names[0], names[2]]):
+        dest_dir = tmp_path / f'dest{idx}'
+        dest_dir.mkdir()
+        backend.fetch(name, dest_dir, FileRestorer())
+        time.sleep(0.01)
+
+    assert sorted(
+        path.name for path in (tmp_path / 'tier').iterdir() if not path.name.startswith('.')
+    ) == sorted([names[0], names[2]])
+    assert backend.lookup(names[1])
+
+
+def test_data_directory_remote(tmp_path, cache_server):  # pylint: disable=redefined-outer-name
+    """Check that new results are published to the remote backend and found by other clients."""
+    (tmp_path / 'data').mkdir()
+    config = {'type': 'http', 'url': cache_server.url, 'cache_dir': str(tmp_path / 'tier-1')}
+    data_directory = DataDirectory(tmp_path / 'data', remote=create_backend(config))
+    name = entry_name('code', f'{1:032x}')
+    assert not data_directory.contains(name)
+
+    with data_directory.lock(name), data_directory.staging_dir(name) as staging:
+        for path, content in CONTENTS.items():
+            (staging / path).parent.mkdir(parents=True, exist_ok=True)
+            (staging / path).write_bytes(content)
+    assert not data_directory.find_dir(name)
+    assert cache_server.data_directory.contains(name)
+
+    # a second client with an empty local tier fetches the results from the server once
+    config['cache_dir'] = str(tmp_path / 'tier-2')
+    data_directory = DataDirectory(tmp_path / 'data', remote=create_backend(config))
+    timings = []
+    for idx in range(2):
+        dest_dir = tmp_path / f'dest{idx}'
+        dest_dir.mkdir()
+        start = time.perf_counter()
+        assert data_directory.contains(name)
+        data_directory.restore(name, dest_dir, FileRestorer())
+        timings.append(time.perf_counter() - start)
+        assert _read_tree(dest_dir) == CONTENTS
+        if idx == 0:
+            # repeated hits are served by the local tier
+            cache_server.stop()
+    print(f"remote hit: {timings[0] * 1e3:.2f} ms, local tier hit: {timings[1] * 1e3:.2f} ms")
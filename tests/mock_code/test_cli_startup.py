@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Test that the ``aiida-mock-code`` executable starts up without importing heavy dependencies.
+"""
+import statistics
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = ('aiida', 'pytest', '_pytest', 'click', 'pkg_resources')
+
+
+def _import_in_subprocess(module: str) -> float:
+    """Import a module in a fresh interpreter and return the wall time in seconds."""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', f'import {module}'], check=True)
+    return time.perf_counter() - start
+
+
+def test_cli_lean_import():
+    """Check that importing the executable module does not import aiida, pytest or click."""
+    result = subprocess.run(
+        [
+            sys.executable, '-c',
+            'import sys; import aiida_testing.mock_code._cli; print("\\n".join(sys.modules))'
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    loaded = {name.split('.')[0] for name in result.stdout.splitlines()}
+    assert not loaded.intersection(HEAVY_MODULES)
+
+
+def test_cli_startup_time():
+    """
+    Report the startup time of the mock executable, compared to importing the ORM of AiiDA.
+    """
+    repeat = 5
+    cli_time = statistics.median(
+        _import_in_subprocess('aiida_testing.mock_code._cli') for _ in range(repeat)
+    )
+    orm_time = statistics.median(_import_in_subprocess('aiida.orm') for _ in range(repeat))
+    print(f"aiida-mock-code startup: {cli_time * 1e3:.1f} ms (aiida.orm: {orm_time * 1e3:.1f} ms)")
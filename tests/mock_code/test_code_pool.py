@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Test the sharing of mock codes between the tests of a session.
+"""
+import dataclasses
+import os
+import shlex
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from aiida_testing._config import Config
+from aiida_testing.mock_code import InputHasher
+from aiida_testing.mock_code._env_keys import MockVariables
+from aiida_testing.mock_code._fixtures import _CodePool
+
+
+def _variables(tmp_path, test_name):
+    return MockVariables(
+        log_file=tmp_path / test_name / 'mock.log',
+        label='code',
+        test_name=test_name,
+        data_dir=tmp_path / 'data',
+        executable_path='',
+        ignore_files=['_aiidasubmit.sh'],
+        ignore_paths=['_aiidasubmit.sh'],
+        regenerate_data=False,
+        fail_on_missing=False,
+        _hasher=InputHasher,
+        test_id=f'test_file.py::{test_name}',
+    )
+
+
+def _parse_env(prepend_text):
+    return dict(shlex.split(line)[1].split('=', 1) for line in prepend_text.splitlines())
+
+
+def test_shared_snapshot(tmp_path):
+    """Check that the snapshot of a shared code does not depend on the test, which is inherited instead."""
+    first, second = _variables(tmp_path, 'test_a'), _variables(tmp_path, 'test_b')
+    assert first.write_snapshot(tmp_path) != second.write_snapshot(tmp_path)
+    shared = first.write_snapshot(tmp_path, per_test=False)
+    assert second.write_snapshot(tmp_path, per_test=False) == shared
+
+    environ = {'AIIDA_MOCK_SNAPSHOT': str(shared)}
+    restored = MockVariables.from_env({**environ, **second.test_env()})
+    assert restored == dataclasses.replace(second, _hasher=restored._hasher)  # pylint: disable=protected-access
+
+    # without the variables of a test, the mock code logs nowhere
+    restored = MockVariables.from_env(environ)
+    assert (restored.log_file, restored.test_name, restored.test_id) == (Path(os.devnull), '', None)
+
+
+def test_resolve_label(tmp_path):
+    """Check that the settings of a label are resolved once per session."""
+    executable = tmp_path / 'code.sh'
+    executable.write_text('#!/bin/bash\n', encoding='utf8')
+    config = Config({'mock_code': {
+        'code': {
+            'executable': 'code.sh',
+            'version': '1.0'
+        }
+    }},
+                    file_path=tmp_path / '.aiida-testing-config.yml')
+    pool = _CodePool()
+    settings = pool.resolve_label('code', '', config, 'read', None)
+    assert (settings.executable_path, settings.version) == (str(executable), '1.0')
+    assert settings.fingerprint['digest'].startswith('sha256:')
+
+    assert pool.resolve_label('code', '', config, 'read', '2.0').version == '2.0'
+    executable.unlink()
+    assert pool.resolve_label('code', '', config, 'read', None) is settings
+    # the settings are identified by the content of the configuration, not by the configuration object
+    copy = Config(dict(config), file_path=config.file_path)
+    assert pool.resolve_label('code', '', copy, 'read', None) is settings
+
+
+@pytest.mark.parametrize('reuse_codes', [True, False])
+def test_test_variables_without_environment(tmp_path, reuse_codes):
+    """
+    Check which variables of the test reach calculations that do not inherit the environment of the test,
+    e.g. when run by a daemon: none for shared codes, all without reusing codes.
+    """
+    pool = _CodePool(reuse_codes=reuse_codes)
+    prepend_texts = []
+
+    def _create(prepend_text):
+        prepend_texts.append(prepend_text)
+        return SimpleNamespace(uuid='code')
+
+    try:
+        pool.get_code(
+            SimpleNamespace(uuid='computer'), 'entry_point', _variables(tmp_path, 'test_a'), _create
+        )
+        variables = MockVariables.from_env(_parse_env(prepend_texts[0]))
+    finally:
+        pool.close()
+
+    test_variables = (variables.log_file, variables.test_name, variables.test_id)
+    if reuse_codes:
+        assert test_variables == (Path(os.devnull), '', None)
+    else:
+        assert test_variables == (
+            tmp_path / 'test_a' / 'mock.log', 'test_a', 'test_file.py::test_a'
+        )
@@ -143,6 +143,7 @@ def test_regenerate_test_data(mock_code_factory, generate_diff_inputs, datadir):
         data_dir_abspath=TEST_DATA_DIR,
         entry_point=CALC_ENTRY_POINT,
         ignore_paths=('_aiidasubmit.sh', ),
+        retrieve_only=False,
         _regenerate_test_data=True,
     )
 
@@ -171,6 +172,7 @@ def test_regenerate_test_data_relative(mock_code_factory, generate_diff_inputs,
         data_dir_abspath=TEST_DATA_DIR,
         entry_point=CALC_ENTRY_POINT,
         ignore_paths=('_aiidasubmit.sh', ),
+        retrieve_only=False,
         _regenerate_test_data=True,
     )
 
@@ -199,6 +201,7 @@ def test_regenerate_test_data_executable(mock_code_factory, generate_diff_inputs
         entry_point=CALC_ENTRY_POINT,
         ignore_paths=('_aiidasubmit.sh', ),
         executable_name='diff',
+        retrieve_only=False,
         _regenerate_test_data=True,
     )
 
@@ -242,3 +245,25 @@ def test_disable_mpi(mock_code_factory, generate_diff_inputs):  # pylint: disabl
     job_tmpl = json.loads(node.base.repository.get_object_content('.aiida/job_tmpl.json'))
     assert not job_tmpl['codes_info'][0]['prepend_cmdline_params']
     assert 'mpirun' not in node.base.repository.get_object_content('_aiidasubmit.sh')
+
+
+def test_replay_in_process(mock_code_factory, generate_diff_inputs):
+    """
+    Check that cache hits are restored inside the pytest process, without running the submit script.
+    """
+    from aiida_testing.mock_code._replay import REPLAY_JOB_ID_PREFIX  # pylint: disable=import-outside-toplevel
+
+    mock_code = mock_code_factory(
+        label='diff',
+        data_dir_abspath=TEST_DATA_DIR,
+        entry_point=CALC_ENTRY_POINT,
+        ignore_paths=('_aiidasubmit.sh', 'file*txt'),
+        _replay_in_process=True,
+    )
+
+    res, node = run_get_node(
+        CalculationFactory(CALC_ENTRY_POINT), code=mock_code, **generate_diff_inputs()
+    )
+    assert node.is_finished_ok
+    check_diff_output(res)
+    assert node.get_job_id().startswith(REPLAY_JOB_ID_PREFIX)
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Test recording the usage of results and garbage collection of data directories.
+"""
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from aiida_testing.mock_code._data_dir import DataDirectory
+from aiida_testing.mock_code._manage import collect_garbage, main
+from aiida_testing.mock_code._storage import ObjectStore, entry_name, write_manifest
+from aiida_testing.mock_code._usage import UsageLog, new_session_id
+
+
+def _create_entries(data_dir, count):
+    """Create results directories of 100 bytes, older ones first, and return their names."""
+    names = []
+    for idx in range(count):
+        name = entry_name('code', f'{idx:032x}')
+        (data_dir / name).mkdir()
+        (data_dir / name / 'aiida.out').write_bytes(b'x' * 100)
+        os.utime(data_dir / name, (1e9 + idx, 1e9 + idx))
+        names.append(name)
+    return names
+
+
+def _record_session(usage, session, names, full=True):
+    """Record a finished test session using the given results."""
+    for name in names:
+        usage.record(session, name)
+    usage.finish(session, full)
+
+
+def test_keep_sessions(tmp_path):
+    """Check that results not used by the last full sessions, or any session since, are removed."""
+    names = _create_entries(tmp_path, 5)
+    usage = UsageLog(tmp_path)
+    _record_session(usage, 'session-1', names[:3])
+    _record_session(usage, 'session-2', names[1:3])
+    _record_session(usage, 'session-3', names[3:4], full=False)
+    assert [session.full for session in usage.sessions()] == [True, True, False]
+
+    data_directory = DataDirectory(tmp_path)
+    garbage = collect_garbage(data_directory, keep_sessions=1, dry_run=True)
+    assert [item.name for item in garbage] == [names[0], names[4]]
+    assert all(data_directory.contains(name) for name in names)
+
+    collect_garbage(data_directory, keep_sessions=1)
+    assert data_directory.names() == names[1:4]
+    assert [session.id for session in usage.sessions()] == ['session-2', 'session-3']
+
+    with pytest.raises(ValueError):
+        collect_garbage(DataDirectory(tmp_path / 'empty'), keep_sessions=1)
+
+
+def test_max_size(tmp_path, capsys):
+    """Check that the most recently used results are kept up to the size budget."""
+    names = _create_entries(tmp_path, 5)
+    _record_session(UsageLog(tmp_path), new_session_id(), names[:1])
+
+    main(['gc', str(tmp_path), '--max-size', '250', '--dry-run'])
+    assert "Would reclaim 300.0 B from 3 results" in capsys.readouterr().out
+    main(['gc', str(tmp_path), '--max-size', '250'])
+    assert "Reclaimed 300.0 B from 3 results" in capsys.readouterr().out
+    assert DataDirectory(tmp_path).names() == sorted([names[0], names[4]])
+
+    with pytest.raises(SystemExit):
+        main(['gc', str(tmp_path)])
+
+
+def _store_size(object_store):
+    """Return the total size of the objects in the store."""
+    return sum(path.stat().st_size for path in object_store.path.rglob('*') if path.is_file())
+
+
+def test_sweep_objects(tmp_path, capsys):
+    """Check that objects and chunks no longer referenced by any results directory are removed."""
+    names = _create_entries(tmp_path, 3)
+    object_store = ObjectStore.for_data_dir(tmp_path)
+    shared = object_store.add_bytes(b'shared' * 1000)
+    for idx, name in enumerate(names):
+        own = object_store.add_bytes(bytes([idx]) * 1000)
+        chunks = [object_store.add_bytes(bytes([idx]) * 500), shared]
+        write_manifest(tmp_path / name, {'out.dat': own}, {'chunked.dat': chunks})
+    orphan = object_store.add_bytes(b'orphan')
+    for path in object_store.path.rglob('*'):
+        os.utime(path, (1e9, 1e9))
+    _record_session(UsageLog(tmp_path), new_session_id(), names[2:])
+
+    size_before = _store_size(object_store)
+    main(['gc', str(tmp_path), '--keep-sessions', '1', '--dry-run'])
+    assert "Would reclaim" in capsys.readouterr().out
+    assert _store_size(object_store) == size_before
+
+    garbage = collect_garbage(DataDirectory(tmp_path), keep_sessions=1)
+    assert {item.name for item in garbage if item.reason == 'unused'} == set(names[:2])
+    assert len([item for item in garbage if item.reason == 'object']) == 5
+    assert _store_size(object_store) == size_before - sum(
+        item.size for item in garbage if item.reason == 'object'
+    )
+    assert _store_size(object_store) == 6000 + 1000 + 500
+    assert not object_store.object_path(orphan).exists()
+    assert object_store.object_path(shared).exists()
+
+
+def test_stale_locks(tmp_path):
+    """Check that lock files of absent results are removed, unless a process holds the lock."""
+    names = _create_entries(tmp_path, 2)
+    data_directory = DataDirectory(tmp_path)
+    absent = [entry_name('code', f'{idx:032x}') for idx in range(2, 4)]
+    for name in names + absent:
+        with data_directory.lock(name):
+            pass
+    with data_directory.lock(absent[1]):
+        garbage = collect_garbage(data_directory)
+    assert [(item.name, item.reason) for item in garbage] == [(absent[0], 'lock')]
+    assert data_directory.lock_names() == [*names, absent[1]]
+
+    garbage = collect_garbage(data_directory, max_size=100)
+    assert [(item.name, item.reason)
+            for item in garbage] == [(names[0], 'size'), (names[0], 'lock'), (absent[1], 'lock')]
+    assert data_directory.lock_names() == names[1:]
+
+
+def test_sweep_shared_object_store(tmp_path):
+    """Check that objects referenced by another data directory sharing the object store are kept."""
+    data_dir, other_dir = tmp_path / 'data', tmp_path / 'other'
+    data_dir.mkdir()
+    other_dir.mkdir()
+    object_store = ObjectStore(tmp_path / 'objects')
+    digest = object_store.add_bytes(b'content')
+    names = _create_entries(other_dir, 1)
+    write_manifest(other_dir / names[0], {'out.dat': digest})
+    os.utime(object_store.object_path(digest), (1e9, 1e9))
+    _record_session(UsageLog(data_dir), new_session_id(), [])
+
+    collect_garbage(
+        DataDirectory(data_dir, object_store.path),
+        keep_sessions=1,
+        shared_data_dirs=[DataDirectory(other_dir, object_store.path)],
+    )
+    assert object_store.object_path(digest).exists()
+    collect_garbage(DataDirectory(data_dir, object_store.path), keep_sessions=1)
+    assert not object_store.object_path(digest).exists()
+
+
+def test_record_use(tmp_path, mock_code_env):
+    """Check that the mock code executable records the results it generates and restores."""
+    mock_executable = shutil.which('aiida-mock-code')
+    if mock_executable is None:
+        pytest.skip("'aiida-mock-code' executable not found in the PATH")
+
+    executable = tmp_path / 'code.sh'
+    executable.write_text("#!/bin/bash\ncat input.txt > output.txt\n")
+    executable.chmod(0o755)
+    data_dir = tmp_path / 'data'
+    _, env = mock_code_env(executable, session='session-1')
+
+    for idx in range(2):
+        workdir = tmp_path / f'workdir{idx}'
+        workdir.mkdir()
+        (workdir / 'input.txt').write_text('input')
+        subprocess.run([mock_executable], cwd=workdir, env=env, check=True)
+
+    sessions = UsageLog(data_dir).sessions()
+    assert len(sessions) == 1
+    session = sessions[0]
+    assert session.id == 'session-1'
+    assert session.finished is None
+    assert session.names == frozenset(DataDirectory(data_dir).names())
+    assert len((data_dir / '.usage' / 'session-1.log').read_text().splitlines()) == 2
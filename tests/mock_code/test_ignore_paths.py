@@ -6,7 +6,9 @@ import os
 from pathlib import Path
 import pytest
 
-from aiida_testing.mock_code._cli import copy_files
+from aiida_testing.mock_code._cli import copy_files, select_files, store_files
+from aiida_testing.mock_code._restore import FileRestorer
+from aiida_testing.mock_code._storage import MANIFEST_FILE, ObjectStore, restore_entry
 
 OUTPUT_PATHS = (
     Path('file1.txt'),
@@ -94,3 +96,27 @@ def test_ignore_files(run_directory, tmp_path_factory):  # pylint: disable=redef
     # all should be there
     copy_files(src_dir=run_directory, dest_dir=storage_directory, ignore_files=(), ignore_paths=())
     assert (storage_directory / 'my' / 'subfolder' / 'file3.txt').is_file()
+
+
+def test_object_store(run_directory, tmp_path_factory):  # pylint: disable=redefined-outer-name
+    """Test that the 'objects' storage layout deduplicates files and restores all of them."""
+    data_dir = tmp_path_factory.mktemp('data')
+    object_store = ObjectStore.for_data_dir(data_dir)
+    for name in ('entry1', 'entry2'):
+        (data_dir / name).mkdir()
+        store_files(
+            run_directory,
+            data_dir / name,
+            select_files(run_directory, ignore_files=(), ignore_paths=('_aiidasubmit.sh', )),
+            object_store=object_store,
+        )
+        assert [path.name for path in (data_dir / name).iterdir()] == [MANIFEST_FILE]
+
+    # all files have the same content, so there is a single object
+    assert len([path for path in object_store.path.rglob('*') if path.is_file()]) == 1
+
+    restore_dir = tmp_path_factory.mktemp('restore')
+    restore_entry(data_dir / 'entry2', restore_dir, FileRestorer(), object_store)
+    assert sorted(path.relative_to(restore_dir) for path in restore_dir.rglob('*') if path.is_file()) == \
+        sorted(path for path in OUTPUT_PATHS if path.name != '_aiidasubmit.sh')
+    assert (restore_dir / 'my' / 'subfolder' / 'file3.txt').read_text() == "Test content"
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Test the impact analysis of changes on the tests using mock codes.
+"""
+from aiida_testing.mock_code._impact import affected_tests, build_impact_map, read_impact_map, \
+    write_impact_map
+from aiida_testing.mock_code._pack import PACK_FILE
+from aiida_testing.mock_code._storage import entry_name
+
+
+def test_affected_tests(tmp_path):
+    """Check which changes affect which tests, and which changes can not be attributed."""
+    data_dir = tmp_path / 'tests' / 'data'
+    names = [entry_name('code', f'{idx:032x}') for idx in range(3)]
+    records = [
+        {
+            'test_id': 'tests/test_a.py::test_a',
+            'data_dir': str(data_dir),
+            'key': names[0],
+            'inputs': ['aiida.in', '_aiidasubmit.sh'],
+            'hasher': f"{tmp_path / 'tests' / 'conftest.py'}::MyHasher",
+        },
+        {
+            'test_id': 'tests/test_b.py::test_b',
+            'data_dir': str(data_dir),
+            'key': names[1],
+        },
+        {
+            'test_id': 'tests/test_b.py::test_b',
+            'data_dir': str(data_dir),
+            'key': names[2],
+        },
+        {
+            'test': 'test_without_id',
+            'data_dir': str(data_dir),
+            'key': names[2],
+        },
+    ]
+    impact_map = build_impact_map(records, tmp_path)
+    assert impact_map['tests/test_a.py::test_a'] == {
+        'file':
+        'tests/test_a.py',
+        'hashers': ['tests/conftest.py'],
+        'entries': [{
+            'data_dir': 'tests/data',
+            'key': names[0],
+            'inputs': ['aiida.in', '_aiidasubmit.sh']
+        }],
+    }
+    map_path = tmp_path / 'impact.json'
+    write_impact_map(map_path, impact_map)
+    assert read_impact_map(map_path) == impact_map
+
+    def _affected(*changes):
+        return affected_tests(impact_map, changes, tmp_path)
+
+    assert _affected(f'tests/data/{names[1]}/aiida.out') == ({'tests/test_b.py::test_b'}, [])
+    assert _affected(f'tests/data/code/00/{0:032x}/aiida.out') == ({'tests/test_a.py::test_a'}, [])
+    assert _affected(names[2], 'tests/conftest.py') == (set(impact_map), [])
+    assert _affected(f'tests/data/{PACK_FILE}') == (set(impact_map), [])
+    assert _affected('tests/test_a.py') == ({'tests/test_a.py::test_a'}, [])
+    assert _affected('tests/data/mock-code-unused/aiida.out',
+                     'tests/data/.usage/x.log') == (set(), [])
+    assert _affected('aiida_plugin/calculations.py') == (set(), ['aiida_plugin/calculations.py'])
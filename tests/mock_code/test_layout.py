@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Test the layouts of results directories in the data directory.
+"""
+from aiida_testing.mock_code._data_dir import DataDirectory
+from aiida_testing.mock_code._manage import main
+from aiida_testing.mock_code._restore import FileRestorer
+from aiida_testing.mock_code._storage import entry_name
+
+
+def _create_entry(data_directory, label, idx):
+    """Create a results directory in the layout of the data directory and return its name."""
+    name = entry_name(label, f'{idx:032x}')
+    res_dir = data_directory.entry_dir(name)
+    res_dir.mkdir(parents=True)
+    (res_dir / 'aiida.out').write_text(f"output {idx}\n")
+    return name
+
+
+def test_sharded_layout(tmp_path):
+    """Check that results are found in both layouts, independent of the layout of new results."""
+    flat = DataDirectory(tmp_path)
+    sharded = DataDirectory(tmp_path, layout='sharded')
+    flat_name = _create_entry(flat, 'code', 1)
+    sharded_name = _create_entry(sharded, 'code', 2)
+
+    assert flat.entry_dir(flat_name) == tmp_path / flat_name
+    assert sharded.entry_dir(sharded_name) == tmp_path / 'code' / '00' / f'{2:032x}'
+    for data_directory in (flat, sharded):
+        assert data_directory.names() == sorted([flat_name, sharded_name])
+        for name in (flat_name, sharded_name):
+            assert data_directory.contains(name)
+        assert not data_directory.contains(entry_name('code', f'{3:032x}'))
+
+    restore_dir = tmp_path / 'restore'
+    restore_dir.mkdir()
+    flat.restore(sharded_name, restore_dir, FileRestorer())
+    assert (restore_dir / 'aiida.out').read_text() == "output 2\n"
+
+    sharded.remove(sharded_name)
+    assert not sharded.contains(sharded_name)
+    assert not (tmp_path / 'code').exists()
+
+
+def test_migrate(tmp_path, capsys):
+    """Check migrating a data directory between layouts and back."""
+    flat = DataDirectory(tmp_path)
+    names = [_create_entry(flat, label, idx) for label in ('code-a', 'code-b') for idx in range(5)]
+
+    main(['migrate', str(tmp_path)])
+    assert "Moved 10 results directories" in capsys.readouterr().out
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['code-a', 'code-b']
+    sharded = DataDirectory(tmp_path, layout='sharded')
+    for name in names:
+        assert sharded.find_dir(name) == sharded.entry_dir(name)
+
+    main(['migrate', str(tmp_path), '--to', 'flat'])
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted(names)
+
+
+def test_versioned_entries(tmp_path):
+    """Check that results of different versions of a code coexist in both layouts."""
+    names = [entry_name('code', f'{1:032x}', version) for version in (None, '7.1', '7.2')]
+    assert names[1:] == [f'mock-code@7.1-{1:032x}', f'mock-code@7.2-{1:032x}']
+
+    for layout in ('flat', 'sharded'):
+        data_directory = DataDirectory(tmp_path / layout, layout=layout)
+        for idx, name in enumerate(names):
+            res_dir = data_directory.entry_dir(name)
+            res_dir.mkdir(parents=True)
+            (res_dir / 'aiida.out').write_text(f"output {idx}\n")
+        assert data_directory.names() == sorted(names)
+        assert len({data_directory.entry_dir(name) for name in names}) == 3
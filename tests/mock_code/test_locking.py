@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+Test that concurrent cache misses for the same inputs run the actual code only once.
+"""
+import shutil
+import subprocess
+
+import pytest
+
+NUM_PROCESSES = 4
+
+
+@pytest.mark.parametrize('regenerate_data', [False, True])
+def test_concurrent_misses(tmp_path, regenerate_data, mock_code_env):
+    """Check that concurrent mock code processes share a single run of the actual code."""
+    mock_executable = shutil.which('aiida-mock-code')
+    if mock_executable is None:
+        pytest.skip("'aiida-mock-code' executable not found in the PATH")
+
+    executable = tmp_path / 'code.sh'
+    executable.write_text(
+        f"#!/bin/bash\necho run >> {tmp_path / 'runs.txt'}\nsleep 1\ncat input.txt > output.txt\n",
+        encoding='utf8'
+    )
+    executable.chmod(0o755)
+    data_dir = tmp_path / 'data'
+    variables, env = mock_code_env(executable, label='label', regenerate_data=regenerate_data)
+
+    processes = []
+    for idx in range(NUM_PROCESSES):
+        workdir = tmp_path / f'workdir{idx}'
+        workdir.mkdir()
+        (workdir / 'input.txt').write_text('input', encoding='utf8')
+        processes.append(subprocess.Popen([mock_executable], cwd=workdir, env=env))  # pylint: disable=consider-using-with
+    assert all(process.wait() == 0 for process in processes)
+
+    assert (tmp_path / 'runs.txt').read_text(encoding='utf8').splitlines() == ['run']
+    for idx in range(NUM_PROCESSES):
+        assert (tmp_path / f'workdir{idx}' / 'output.txt').read_text(encoding='utf8') == 'input'
+    assert len(list(data_dir.glob('mock-*'))) == 1
+    assert not any(path.is_dir() for path in (data_dir / '.staging').iterdir())
+    assert variables.log_file.read_text(encoding='utf8'
+                                        ).count('Cache hit after waiting') == NUM_PROCESSES - 1
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Test the declarative normalization of input files before hashing.
+"""
+
+import pytest
+
+from aiida_testing._config import Config
+from aiida_testing.mock_code import InputHasher
+from aiida_testing.mock_code._env_keys import MockVariables
+from aiida_testing.mock_code._normalize import NormalizationRules, compile_rules
+
+
+def test_rules():
+    """Check each kind of rule."""
+    rules = NormalizationRules({
+        'exclude': ['*.xml', 'out/*'],
+        'remove_lines': [r'^\s*! date', 'host ='],
+        'mask': [{
+            'path': 'header.bin',
+            'start': 2,
+            'end': -2
+        }],
+        'round': {
+            'digits': 3,
+            'path': '*.in'
+        },
+    })
+    assert rules.apply('data-file.xml', b'') is None
+    assert rules.apply('sub/data-file.xml', b'') is None
+    assert rules.apply('out/aiida.out', b'') is None
+    assert rules.apply('aiida.in', b'a\n  ! date 2024\nb host = x\nc\n') == b'a\nc\n'
+    assert rules.apply('header.bin', b'abcdefg') == b'ab\0\0\0fg'
+    assert rules.apply('sub/header.bin', b'abc') == b'abc'
+    assert rules.apply(
+        'aiida.in', b'x = 1.23456 y = -2.0000001d-3 n = 12\n'
+    ) == b'x = 1.23 y = -0.002 n = 12\n'
+    assert rules.apply('other.txt', b'x = 1.23456') == b'x = 1.23456'
+
+    assert compile_rules({'exclude': ['*.xml']}) is compile_rules({'exclude': ['*.xml']})
+    with pytest.raises(ValueError):
+        NormalizationRules({'remove_lines': ['(']})
+    with pytest.raises(ValueError):
+        NormalizationRules({'drop': []})
+
+
+@pytest.mark.parametrize(
+    'rules', [
+        {
+            'mask': [{
+                'path': 'header.bin',
+                'start': 2
+            }]
+        },
+        {
+            'mask': [{
+                'start': 0,
+                'end': 2
+            }]
+        },
+        {
+            'mask': ['header.bin']
+        },
+        {
+            'mask': [{
+                'path': 'header.bin',
+                'start': 'begin',
+                'end': 2
+            }]
+        },
+        {
+            'round': {
+                'path': '*.in'
+            }
+        },
+        {
+            'round': {
+                'digits': None
+            }
+        },
+        {
+            'round': 3
+        },
+    ]
+)
+def test_invalid_rules(rules):
+    """Check that incomplete mask and round rules are rejected."""
+    with pytest.raises(ValueError):
+        NormalizationRules(rules)
+
+
+def test_hash_with_rules(tmp_path):
+    """Check that the rules are applied when hashing the inputs, and accepted by the configuration file."""
+    config = Config({'mock_code': {'code': {'normalize': {'remove_lines': ['^# generated']}}}})
+    variables = MockVariables(
+        log_file=tmp_path / 'mock.log',
+        label='code',
+        test_name='test',
+        data_dir=tmp_path,
+        executable_path='',
+        ignore_files=(),
+        ignore_paths=(),
+        regenerate_data=False,
+        fail_on_missing=False,
+        _hasher=InputHasher,
+        normalize=config['mock_code']['code']['normalize'],
+    )
+    hashes = []
+    for idx in range(2):
+        workdir = tmp_path / f'workdir{idx}'
+        workdir.mkdir()
+        (workdir / 'aiida.in').write_text(f'# generated at {idx}\ninput\n')
+        hasher = InputHasher(variables, lambda msg: None)
+        hashes.append(hasher(workdir))
+    assert hashes[0] == hashes[1]
+    assert hasher.hashed_paths == ['aiida.in']
+
+    environ = {'AIIDA_MOCK_SNAPSHOT': str(variables.write_snapshot(tmp_path))}
+    assert MockVariables.from_env(environ).normalize == variables.normalize
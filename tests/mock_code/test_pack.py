@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Test the pack file layout of the data directory.
+"""
+import os
+import time
+
+from aiida_testing.mock_code._cli import select_files, store_files
+from aiida_testing.mock_code._data_dir import DataDirectory
+from aiida_testing.mock_code._manage import main, pack_data_dir
+from aiida_testing.mock_code._pack import PACK_FILE
+from aiida_testing.mock_code._restore import FileRestorer
+
+
+def _create_results(data_dir, tmp_path, num_entries, storage='files'):
+    """Create results directories with a few output files each."""
+    data_directory = DataDirectory(data_dir)
+    names = []
+    for idx in range(num_entries):
+        run_dir = tmp_path / f'run-{storage}-{idx}'
+        (run_dir / 'out').mkdir(parents=True)
+        (run_dir / 'aiida.out').write_text(f"output {idx}\n" * 100)
+        (run_dir / 'out' / 'data.bin').write_bytes(os.urandom(1024))
+        res_dir = data_dir / f'mock-code-{storage}{idx:030x}'
+        res_dir.mkdir(parents=True)
+        names.append(res_dir.name)
+        store_files(
+            run_dir,
+            res_dir,
+            select_files(run_dir, ignore_files=(), ignore_paths=()),
+            object_store=data_directory.object_store if storage != 'files' else None,
+            chunked=storage == 'chunks'
+        )
+    return names
+
+
+def _read_tree(path):
+    """Return the relative paths and contents of all files in a directory."""
+    return {
+        file_path.relative_to(path).as_posix(): file_path.read_bytes()
+        for file_path in path.rglob('*') if file_path.is_file()
+    }
+
+
+def test_pack_roundtrip(tmp_path):
+    """Check that results restored from the pack are identical to the results directories."""
+    data_dir = tmp_path / 'data'
+    names = []
+    for storage in ('files', 'objects', 'chunks'):
+        names += _create_results(data_dir, tmp_path, 3, storage=storage)
+
+    expected = {}
+    for name in names:
+        dest_dir = tmp_path / 'expected' / name
+        dest_dir.mkdir(parents=True)
+        DataDirectory(data_dir).restore(name, dest_dir, FileRestorer())
+        expected[name] = _read_tree(dest_dir)
+
+    main(['pack', str(data_dir), '--remove'])
+    assert not list(data_dir.glob('mock-*'))
+    assert (data_dir / PACK_FILE).is_file()
+
+    data_directory = DataDirectory(data_dir)
+    assert data_directory.names() == sorted(names)
+    assert not data_directory.contains('mock-code-missing')
+    for name in names:
+        assert data_directory.contains(name)
+        dest_dir = tmp_path / 'packed' / name
+        dest_dir.mkdir(parents=True)
+        data_directory.restore(name, dest_dir, FileRestorer())
+        assert _read_tree(dest_dir) == expected[name]
+
+    main(['unpack', str(data_dir), '--remove'])
+    assert not (data_dir / PACK_FILE).exists()
+    assert sorted(path.name for path in data_dir.glob('mock-*')) == sorted(names)
+
+
+def test_pack_close(tmp_path):
+    """Check that the data directory closes its pack file, and maps a rewritten pack file again."""
+    data_dir = tmp_path / 'data'
+    names = _create_results(data_dir, tmp_path, 2)
+    with DataDirectory(data_dir) as data_directory:
+        pack_data_dir(data_directory, remove_directories=True)
+        pack = data_directory.pack
+        assert pack is not None
+        assert data_directory.names() == sorted(names)
+
+        names += _create_results(data_dir, tmp_path / 'more', 1, storage='objects')
+        pack_data_dir(data_directory, remove_directories=True)
+        assert pack._mmap.closed  # pylint: disable=protected-access
+        assert data_directory.names() == sorted(names)
+        pack = data_directory.pack
+    assert pack._mmap.closed  # pylint: disable=protected-access
+
+
+def test_pack_benchmark(tmp_path):
+    """Benchmark lookup and restore of results in a pack file against results directories."""
+    num_entries = 500
+    timings = {}
+    for layout in ('directories', 'pack'):
+        data_dir = tmp_path / layout
+        names = _create_results(data_dir, tmp_path / f'runs-{layout}', num_entries)
+        if layout == 'pack':
+            main(['pack', str(data_dir), '--remove'])
+
+        start = time.perf_counter()
+        data_directory = DataDirectory(data_dir)
+        for idx, name in enumerate(names[::10]):
+            dest_dir = tmp_path / f'restore-{layout}-{idx}'
+            dest_dir.mkdir()
+            assert data_directory.contains(name)
+            data_directory.restore(name, dest_dir, FileRestorer())
+        timings[layout] = time.perf_counter() - start
+        print(f"{layout}: {timings[layout] / len(names[::10]) * 1e3:.2f} ms per lookup and restore")
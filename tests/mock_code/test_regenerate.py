@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Test the selective regeneration of test data by executable fingerprint and age.
+"""
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from aiida_testing.mock_code import _fingerprint
+from aiida_testing.mock_code._data_dir import DataDirectory
+from aiida_testing.mock_code._fingerprint import executable_fingerprint, fingerprint_changed, probe_version
+
+
+def test_fingerprint(tmp_path):
+    """Check the fingerprint of an executable, and which changes outdate its results."""
+    executable = tmp_path / 'code.sh'
+    executable.write_text("#!/bin/bash\necho 'code 1.0'\ntouch written\n")
+    executable.chmod(0o755)
+
+    fingerprint = executable_fingerprint(str(executable), ['--version'])
+    assert fingerprint['path'] == str(executable)
+    assert fingerprint['digest'].startswith('sha256:')
+    assert fingerprint['version'] == 'code 1.0'
+    assert not (tmp_path / 'written').exists()
+
+    moved = dict(fingerprint, path='/elsewhere/code.sh')
+    assert not fingerprint_changed(fingerprint, moved)
+    assert not fingerprint_changed(None, fingerprint)
+    assert fingerprint_changed(fingerprint, dict(fingerprint, version='code 2.0'))
+
+    executable.write_text("#!/bin/bash\necho 'code 2.0'\n")
+    os.utime(executable, ns=(0, 0))
+    upgraded = executable_fingerprint(str(executable), ['--version'])
+    assert upgraded['version'] == 'code 2.0'
+    assert fingerprint_changed(fingerprint, upgraded)
+    assert probe_version(upgraded) == '2.0'
+    assert probe_version({'digest': 'sha256:0123456789abcdef'}) == '0123456789ab'
+
+
+def test_fingerprint_cache(tmp_path, fingerprint_cache, monkeypatch):
+    """Check that fingerprints are cached across processes, until the executable is modified."""
+    runs = tmp_path / 'runs.txt'
+    executable = tmp_path / 'code.sh'
+    executable.write_text(f"#!/bin/bash\necho run >> {runs}\necho 'code 1.0'\n")
+    executable.chmod(0o755)
+
+    fingerprint = executable_fingerprint(str(executable), ['--version'])
+    assert len(list(fingerprint_cache.iterdir())) == 1
+    # a new process only has the cache directory
+    monkeypatch.setattr(_fingerprint, '_FINGERPRINTS', {})
+    assert executable_fingerprint(str(executable), ['--version']) == fingerprint
+    assert len(runs.read_text().splitlines()) == 1
+
+    executable.write_text(f"#!/bin/bash\necho run >> {runs}\necho 'code 2.0'\n")
+    os.utime(executable, ns=(0, 0))
+    assert executable_fingerprint(str(executable), ['--version'])['version'] == 'code 2.0'
+    assert len(runs.read_text().splitlines()) == 2
+
+
+def test_selective_regeneration(tmp_path, mock_code_env):
+    """Check that only results selected by fingerprint or age are regenerated."""
+    mock_executable = shutil.which('aiida-mock-code')
+    if mock_executable is None:
+        pytest.skip("'aiida-mock-code' executable not found in the PATH")
+
+    runs = tmp_path / 'runs.txt'
+    executable = tmp_path / 'code.sh'
+    executable.write_text(f"#!/bin/bash\necho run >> {runs}\necho output > output.txt\n")
+    executable.chmod(0o755)
+    data_dir = tmp_path / 'data'
+
+    def _run(idx, **kwargs):
+        _, env = mock_code_env(executable, **kwargs)
+        workdir = tmp_path / f'workdir{idx}'
+        workdir.mkdir()
+        (workdir / 'input.txt').write_text('input')
+        subprocess.run([mock_executable], cwd=workdir, env=env, check=True)
+        return len(runs.read_text().splitlines())
+
+    old = {'path': str(executable), 'digest': 'sha256:old'}
+    new = {'path': str(executable), 'digest': 'sha256:new'}
+    assert _run(0, fingerprint=old) == 1
+    name, = DataDirectory(data_dir).names()
+    assert DataDirectory(data_dir).read_metadata(name)['fingerprint'] == old
+
+    # a changed fingerprint only regenerates the results if requested
+    assert _run(1, fingerprint=new) == 1
+    assert _run(2, fingerprint=new, regenerate_outdated=True) == 2
+    assert DataDirectory(data_dir).read_metadata(name)['fingerprint'] == new
+    assert _run(3, fingerprint=new, regenerate_outdated=True) == 2
+
+    assert _run(4, fingerprint=new, regenerate_older_than=3600.) == 2
+    assert _run(5, fingerprint=new, regenerate_older_than=0.) == 3
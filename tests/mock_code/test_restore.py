@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Test the strategies for restoring cached outputs.
+"""
+import os
+import stat
+import time
+
+import pytest
+
+from aiida_testing.mock_code._restore import FileRestorer, RESTORE_STRATEGIES
+
+
+def _create_entry(path, num_files, size):
+    """Create a synthetic cache entry with random file contents."""
+    (path / 'subfolder').mkdir(parents=True)
+    for idx in range(num_files):
+        subdir = path / 'subfolder' if idx % 2 else path
+        (subdir / f'file{idx}.dat').write_bytes(os.urandom(size))
+    return path
+
+
+def _assert_restored(res_dir, dest_dir):
+    """Check that all files of the entry are restored with identical content."""
+    for dirpath, _, filenames in os.walk(res_dir):
+        for filename in filenames:
+            src = os.path.join(dirpath, filename)
+            dest = dest_dir / os.path.relpath(src, res_dir)
+            assert dest.read_bytes() == open(src, 'rb').read()  # pylint: disable=consider-using-with
+
+
+@pytest.mark.parametrize('strategy', ('auto', ) + RESTORE_STRATEGIES)
+def test_restore_strategies(strategy, tmp_path):
+    """Check that every strategy restores the full entry, falling back if unsupported."""
+    res_dir = _create_entry(tmp_path / 'entry', num_files=12, size=1024)
+    dest_dir = tmp_path / 'workdir'
+    dest_dir.mkdir()
+
+    restorer = FileRestorer(strategy)
+    restorer.restore_tree(res_dir, dest_dir)
+
+    _assert_restored(res_dir, dest_dir)
+    assert sum(restorer.counts.values()) == 12
+    assert 'hardlink' not in restorer.counts
+
+
+def test_restore_hardlink_read_only(tmp_path):
+    """Check that read-only files of an entry are hard-linked, if reflinks are not possible."""
+    res_dir = _create_entry(tmp_path / 'entry', num_files=2, size=16)
+    for path in res_dir.rglob('*.dat'):
+        path.chmod(stat.S_IRUSR | stat.S_IRGRP)
+    dest_dir = tmp_path / 'workdir'
+    dest_dir.mkdir()
+
+    restorer = FileRestorer('hardlink')
+    restorer.restore_tree(res_dir, dest_dir)
+
+    _assert_restored(res_dir, dest_dir)
+    assert restorer.counts['hardlink'] == 2
+    assert os.path.samefile(res_dir / 'file0.dat', dest_dir / 'file0.dat')
+
+
+def test_restore_auto_no_hardlink(tmp_path):
+    """Check that read-only files are not hard-linked unless requested explicitly."""
+    res_dir = _create_entry(tmp_path / 'entry', num_files=2, size=16)
+    for path in res_dir.rglob('*.dat'):
+        path.chmod(stat.S_IRUSR | stat.S_IRGRP)
+    dest_dir = tmp_path / 'workdir'
+    dest_dir.mkdir()
+
+    FileRestorer('auto').restore_tree(res_dir, dest_dir)
+
+    _assert_restored(res_dir, dest_dir)
+    assert not os.path.samefile(res_dir / 'file0.dat', dest_dir / 'file0.dat')
+
+
+def test_restore_unknown_strategy():
+    """Check that an unknown strategy is rejected."""
+    with pytest.raises(ValueError):
+        FileRestorer('teleport')
+
+
+@pytest.mark.parametrize('strategy', RESTORE_STRATEGIES)
+def test_restore_large_files(strategy, tmp_path):
+    """Check that files larger than a single kernel copy or copy buffer are restored completely."""
+    res_dir = _create_entry(tmp_path / 'entry', num_files=2, size=3 * 1024**2 + 1)
+    dest_dir = tmp_path / 'workdir'
+    dest_dir.mkdir()
+
+    restorer = FileRestorer(strategy)
+    restorer.restore_tree(res_dir, dest_dir)
+
+    _assert_restored(res_dir, dest_dir)
+    assert restorer.restored_bytes == 2 * (3 * 1024**2 + 1)
+
+
+def test_restore_benchmark(tmp_path):
+    """Benchmark the restore strategies on a large synthetic entry."""
+    res_dir = _create_entry(tmp_path / 'entry', num_files=16, size=4 * 1024**2)
+    timings = {}
+    for strategy in RESTORE_STRATEGIES:
+        dest_dir = tmp_path / f'workdir-{strategy}'
+        dest_dir.mkdir()
+        restorer = FileRestorer(strategy)
+        start = time.perf_counter()
+        restorer.restore_tree(res_dir, dest_dir)
+        timings[strategy] = time.perf_counter() - start
+        _assert_restored(res_dir, dest_dir)
+        assert sum(restorer.counts.values()) == 16
+        print(f"{strategy}: {timings[strategy] * 1e3:.1f} ms ({restorer.summary()})")
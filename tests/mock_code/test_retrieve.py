@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Test storing and restoring only the files retrieved by AiiDA.
+"""
+import json
+
+from aiida_testing.mock_code._cli import copy_files, select_files, store_files
+from aiida_testing.mock_code._data_dir import DataDirectory
+from aiida_testing.mock_code._restore import FileRestorer
+from aiida_testing.mock_code._retrieve import RetrieveFilter, load_retrieve_patterns
+
+
+def _create_workdir(path):
+    """Create a working directory with outputs, scratch files and the AiiDA metadata."""
+    (path / '.aiida').mkdir(parents=True)
+    (path / '.aiida' / 'calcinfo.json').write_text(
+        json.dumps({
+            'retrieve_list': ['aiida.out', ['out/*.xml', '.', 0], '/abs/path'],
+            'retrieve_temporary_list': ['results'],
+        })
+    )
+    (path / '.aiida' / 'job_tmpl.json').write_text(
+        json.dumps({
+            'sched_output_path': '_scheduler-stdout.txt',
+            'sched_error_path': '_scheduler-stderr.txt'
+        })
+    )
+    for relative_path in (
+        'aiida.out', '_scheduler-stdout.txt', '_scheduler-stderr.txt', 'out/data.xml',
+        'out/wfc1.dat', 'results/a/b.txt', 'charge-density.dat'
+    ):
+        (path / relative_path).parent.mkdir(parents=True, exist_ok=True)
+        (path / relative_path).write_text(relative_path)
+
+
+RETRIEVED = {
+    'aiida.out', '_scheduler-stdout.txt', '_scheduler-stderr.txt', 'out/data.xml', 'results/a/b.txt'
+}
+
+
+def test_retrieve_filter(tmp_path):
+    """Check the patterns read from the working directory and the files they select."""
+    _create_workdir(tmp_path)
+    patterns = load_retrieve_patterns(tmp_path)
+    assert patterns == [
+        'aiida.out', 'out/*.xml', 'results', '_scheduler-stdout.txt', '_scheduler-stderr.txt'
+    ]
+    include = RetrieveFilter(patterns)
+    assert include('results/a/b.txt')
+    assert include('out/data.xml')
+    assert not include('out/wfc1.dat')
+    assert not include('out')
+    assert load_retrieve_patterns(tmp_path / 'missing') is None
+
+
+def test_store_and_restore_retrieved(tmp_path):
+    """Check that only retrieved files are stored, and only retrieved files are restored."""
+    workdir = tmp_path / 'workdir'
+    _create_workdir(workdir)
+    include = RetrieveFilter(load_retrieve_patterns(workdir))
+    data_directory = DataDirectory(tmp_path / 'data')
+
+    for storage, res_dir in (('files', 'mock-code-0'), ('objects', 'mock-code-1')):
+        (data_directory.path / res_dir).mkdir(parents=True)
+        store_files(
+            workdir,
+            data_directory.path / res_dir,
+            select_files(workdir, ignore_files=(), ignore_paths=(), include=include),
+            object_store=data_directory.object_store if storage == 'objects' else None,
+        )
+        restore_dir = tmp_path / f'restore-{storage}'
+        restore_dir.mkdir()
+        data_directory.restore(res_dir, restore_dir, FileRestorer())
+        assert {
+            path.relative_to(restore_dir).as_posix()
+            for path in restore_dir.rglob('*') if path.is_file()
+        } == RETRIEVED
+
+    # results stored before filtering are filtered on restore
+    (data_directory.path / 'mock-code-2').mkdir()
+    copy_files(workdir, data_directory.path / 'mock-code-2', ignore_files=(), ignore_paths=())
+    restore_dir = tmp_path / 'restore-filtered'
+    restore_dir.mkdir()
+    data_directory.restore('mock-code-2', restore_dir, FileRestorer(), include=include)
+    assert {
+        path.relative_to(restore_dir).as_posix()
+        for path in restore_dir.rglob('*') if path.is_file()
+    } == RETRIEVED
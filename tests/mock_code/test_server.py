@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Test replaying cached results through the mock code server.
+"""
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from aiida_testing.mock_code import InputHasher
+from aiida_testing.mock_code._cli import run_on_server
+from aiida_testing.mock_code._server import MockCodeServer
+
+
+@pytest.fixture
+def mock_server():
+    """Start a mock code server on a short socket path."""
+    with tempfile.TemporaryDirectory(prefix='aiida-mock-') as socket_dir:
+        server = MockCodeServer(Path(socket_dir) / 'server.sock')
+        server.start()
+        yield server
+        server.stop()
+
+
+def _setup_variables(mock_code_env, server_socket, monkeypatch):
+    """Create the mock code variables and export them to the environment."""
+    variables, env = mock_code_env(
+        label='label',
+        ignore_files=(),
+        ignore_paths=(),
+        fail_on_missing=True,
+        server_socket=server_socket,
+    )
+    for key, value in env.items():
+        monkeypatch.setenv(key, value)
+    return variables
+
+
+def test_server_hit(mock_server, tmp_path, monkeypatch, mock_code_env):  # pylint: disable=redefined-outer-name
+    """Check that the server restores cached results into the working directory."""
+    variables = _setup_variables(mock_code_env, mock_server.socket_path, monkeypatch)
+    workdir = tmp_path / 'workdir'
+    workdir.mkdir()
+    (workdir / 'input.txt').write_text('input', encoding='utf8')
+
+    hash_digest = InputHasher(variables, lambda msg: None)(workdir)
+    res_dir = variables.data_dir / f"mock-label-{hash_digest}"
+    res_dir.mkdir()
+    (res_dir / 'output.txt').write_text('output', encoding='utf8')
+
+    assert run_on_server(workdir, variables.server_socket)
+    assert (workdir / 'output.txt').read_text(encoding='utf8') == 'output'
+    assert 'Cache hit (server)' in variables.log_file.read_text(encoding='utf8')
+
+
+def test_server_miss(mock_server, tmp_path, monkeypatch, mock_code_env):  # pylint: disable=redefined-outer-name
+    """Check that the client is told to run itself on a cache miss."""
+    variables = _setup_variables(mock_code_env, mock_server.socket_path, monkeypatch)
+    workdir = tmp_path / 'workdir'
+    workdir.mkdir()
+    (workdir / 'input.txt').write_text('input', encoding='utf8')
+
+    assert not run_on_server(workdir, variables.server_socket)
+    assert not (workdir / 'output.txt').exists()
+
+
+def test_no_server(tmp_path, monkeypatch, mock_code_env):
+    """Check that the client falls back to running in-process if the socket does not exist."""
+    variables = _setup_variables(mock_code_env, tmp_path / 'missing.sock', monkeypatch)
+    assert not run_on_server(tmp_path, variables.server_socket)
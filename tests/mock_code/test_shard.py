@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Test the cost profile of tests and their partitioning into shards.
+"""
+from aiida_testing.mock_code._shard import build_profile, expected_cost, partition, read_profile, \
+    write_profile
+from aiida_testing.mock_code._storage import entry_name
+
+
+def test_expected_cost(tmp_path):
+    """Check that the expected cost includes the run time of results missing from the data directory."""
+    data_dir = tmp_path / 'data'
+    cached, missing = entry_name('code', 'a' * 32), entry_name('code', 'b' * 32)
+    (data_dir / cached).mkdir(parents=True)
+    records = [
+        {
+            'label': 'code',
+            'key': cached,
+            'test_id': 'test.py::test_a',
+            'data_dir': str(data_dir),
+            'hit': False,
+            'hash_time': 0.5,
+            'copy_time': 0.5,
+            'run_time': 60.
+        },
+        {
+            'label': 'code',
+            'key': missing,
+            'test_id': 'test.py::test_a',
+            'data_dir': str(data_dir),
+            'hit': True,
+            'hash_time': 0.5,
+            'restore_time': 0.5,
+            'run_time': 30.
+        },
+        {
+            'label': 'code',
+            'key': cached,
+            'test_id': 'test.py::test_unknown',
+            'data_dir': str(data_dir),
+            'hit': True,
+        },
+    ]
+    profile = build_profile(records, {'test.py::test_a': 65., 'test.py::test_b': 2.})
+    assert set(profile) == {'test.py::test_a', 'test.py::test_b'}
+    entry = profile['test.py::test_a']
+    assert (entry.invocations, entry.hits, entry.misses) == (2, 1, 1)
+    assert entry.mock_time == 2.
+    assert entry.runs[0].run_time == 60.
+
+    # the first results are cached now, the second ones were removed
+    assert expected_cost(entry) == 65. - 60. + 30.
+    assert expected_cost(entry, regenerate=True) == 65. + 30.
+    assert expected_cost(profile['test.py::test_b']) == 2.
+
+    profile_path = tmp_path / 'profile.json'
+    write_profile(profile_path, {'test.py::test_a': entry})
+    write_profile(profile_path, {'test.py::test_b': profile['test.py::test_b']})
+    assert read_profile(profile_path) == profile
+
+
+def test_partition():
+    """Check that shards are balanced by cost, and tests without known cost are distributed."""
+    costs = {'a': 10., 'b': 6., 'c': 5., 'd': None, 'e': 1., 'f': None}
+    shards = partition(costs, 2)
+    assert shards == [['a', 'e', 'f'], ['b', 'c', 'd']]
+    assert sorted(test for shard in shards for test in shard) == sorted(costs)
+    assert partition(costs, 2) == shards
+    assert partition({}, 3) == [[], [], []]
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Test passing the variables of a mock code via a snapshot file.
+"""
+import os
+import shlex
+import shutil
+import subprocess
+
+import pytest
+
+from aiida_testing.mock_code import InputHasher
+from aiida_testing.mock_code._data_dir import DataDirectory
+from aiida_testing.mock_code._env_keys import MockVariables
+
+
+def _variables(tmp_path, **kwargs):
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir(exist_ok=True)
+    executable = tmp_path / 'code.sh'
+    executable.write_text("#!/bin/bash\ncat input.txt > output.txt\n", encoding='utf8')
+    executable.chmod(0o755)
+    return MockVariables(
+        log_file=tmp_path / 'mock.log',
+        label='code',
+        test_name='test_code',
+        data_dir=data_dir,
+        executable_path=str(executable),
+        ignore_files=['_aiidasubmit.sh'],
+        ignore_paths=['_aiidasubmit.sh'],
+        regenerate_data=False,
+        fail_on_missing=False,
+        _hasher=InputHasher,
+        **kwargs,
+    )
+
+
+def test_snapshot_roundtrip(tmp_path):
+    """Check that the variables are restored from a snapshot, with the variables of the test from the environment."""
+    variables = _variables(
+        tmp_path, backend={
+            'type': 'local',
+            'path': 'remote'
+        }, test_id='test.py::test_code'
+    )
+    path = variables.write_snapshot(tmp_path)
+    assert variables.write_snapshot(tmp_path) == path
+    assert MockVariables.snapshot_to_env(path).startswith('export AIIDA_MOCK_SNAPSHOT=')
+
+    environ = {'AIIDA_MOCK_SNAPSHOT': str(path)}
+    assert MockVariables.from_env(environ) == variables
+
+    shared = variables.write_snapshot(tmp_path, per_test=False)
+    assert shared != path
+    other = _variables(tmp_path, backend=variables.backend, test_id='test.py::test_other')
+    other.test_name = 'test_other'
+    environ = {'AIIDA_MOCK_SNAPSHOT': str(shared), **other.test_env()}
+    assert MockVariables.from_env(environ) == other
+
+
+def test_run_with_snapshot(tmp_path):
+    """Check that the mock code runs with only the pointer to the snapshot in its environment."""
+    mock_executable = shutil.which('aiida-mock-code')
+    if mock_executable is None:
+        pytest.skip("'aiida-mock-code' executable not found in the PATH")
+
+    variables = _variables(tmp_path)
+    env = {key: value for key, value in os.environ.items() if not key.startswith('AIIDA_MOCK_')}
+    key, value = shlex.split(MockVariables.snapshot_to_env(variables.write_snapshot(tmp_path))
+                             )[1].split('=', 1)
+    env[key] = value
+
+    for idx in range(2):
+        workdir = tmp_path / f'workdir{idx}'
+        workdir.mkdir()
+        (workdir / 'input.txt').write_text('input', encoding='utf8')
+        subprocess.run([mock_executable], cwd=workdir, env=env, check=True)
+        assert (workdir / 'output.txt').read_text(encoding='utf8') == 'input'
+    assert len(DataDirectory(variables.data_dir).names()) == 1
+    assert 'Cache hit' in variables.log_file.read_text(encoding='utf8')
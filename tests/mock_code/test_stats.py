@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Test the statistics of mock code invocations.
+"""
+import shutil
+import subprocess
+
+import pytest
+
+from aiida_testing.mock_code._data_dir import DataDirectory
+from aiida_testing.mock_code._stats import format_summary, read_records, summarize
+
+
+def test_invocation_records(tmp_path, mock_code_env):
+    """Check the records of a cache miss and a cache hit, and the run time stored with the results."""
+    mock_executable = shutil.which('aiida-mock-code')
+    if mock_executable is None:
+        pytest.skip("'aiida-mock-code' executable not found in the PATH")
+
+    executable = tmp_path / 'code.sh'
+    executable.write_text("#!/bin/bash\nsleep 0.2\nhead -c 1000 /dev/zero > output.bin\n")
+    executable.chmod(0o755)
+    data_dir = tmp_path / 'data'
+    variables, env = mock_code_env(executable, stats_file=tmp_path / 'stats.jsonl')
+
+    for idx in range(2):
+        workdir = tmp_path / f'workdir{idx}'
+        workdir.mkdir()
+        (workdir / 'input.txt').write_text('input')
+        subprocess.run([mock_executable], cwd=workdir, env=env, check=True)
+        assert sorted(path.name for path in workdir.iterdir()) == ['input.txt', 'output.bin']
+
+    records = read_records(variables.stats_file)
+    assert len(records) == 2
+    miss, hit = records[0], records[1]
+    assert DataDirectory(data_dir).names() == [miss['key']]
+    assert hit['key'] == miss['key']
+    assert (miss['hit'], hit['hit']) == (False, True)
+    assert miss['run_time'] >= 0.2
+    assert hit['run_time'] == miss['run_time']
+    assert miss['bytes'] == hit['bytes'] == 1005
+    assert miss['copy_time'] > 0 and hit['restore_time'] > 0
+    assert DataDirectory(data_dir).read_metadata(miss['key'])['run_time'] == miss['run_time']
+
+
+def test_summarize():
+    """Check the aggregation of records per label."""
+    records = [
+        {
+            'label': 'a',
+            'key': 'mock-a-1',
+            'test': 'test_1',
+            'hit': False,
+            'hash_time': 0.1,
+            'copy_time': 0.2,
+            'bytes': 100,
+            'run_time': 10.
+        },
+        {
+            'label': 'a',
+            'key': 'mock-a-1',
+            'test': 'test_2',
+            'hit': True,
+            'hash_time': 0.3,
+            'restore_time': 0.1,
+            'bytes': 100,
+            'run_time': 10.
+        },
+        {
+            'label': 'b',
+            'key': 'mock-b-1',
+            'test': 'test_3',
+            'hit': True,
+            'hash_time': 0.2,
+            'restore_time': 0.5,
+            'bytes': 50,
+            'run_time': None
+        },
+    ]
+    summary = summarize(records)
+    assert summary['hits'] == 2
+    assert summary['time_saved'] == 10.
+    assert summary['hits_without_run_time'] == 1
+    assert summary['labels']['a']['hit_rate'] == 0.5
+    assert summary['labels']['b']['misses'] == 0
+    assert [record['test']
+            for record in summary['slowest_hashes']] == ['test_2', 'test_3', 'test_1']
+    assert [record['test'] for record in summary['slowest_restores']] == ['test_3', 'test_2']
+
+    lines = format_summary(summary)
+    assert len(lines) == 3 + 1 + 4 + 3
+    assert "saved by replay: 10.00s (1 hits without recorded run time)" in lines[3]
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Test the deduplicating storage layouts of the data directory.
+"""
+import io
+import os
+
+from aiida_testing.mock_code._cli import select_files, store_files
+from aiida_testing.mock_code._manage import dedup_report, main
+from aiida_testing.mock_code._restore import FileRestorer
+from aiida_testing.mock_code._storage import MAX_CHUNK_SIZE, ObjectStore, iter_chunks, restore_entry
+
+
+def _log_content(timing: str) -> bytes:
+    """Generate the content of a large log file, containing a single timing in the middle."""
+    lines = [f"iteration {idx}: energy = {idx * 0.125:.6f}\n" for idx in range(20000)]
+    lines[10000] = f"total time: {timing}\n"
+    return ''.join(lines).encode()
+
+
+def test_chunks_resync():
+    """Check that a local change only affects the chunks around it."""
+    chunks_1 = list(iter_chunks(io.BytesIO(_log_content('1.0s'))))
+    chunks_2 = list(iter_chunks(io.BytesIO(_log_content('2.0s'))))
+    assert b''.join(chunks_1) == _log_content('1.0s')
+    assert len(chunks_1) > 10
+    assert len(set(chunks_1).symmetric_difference(chunks_2)) <= 2
+
+
+def test_chunks_resync_without_lines():
+    """Check that an insertion into a file without line breaks only affects the chunks around it."""
+    content = os.urandom(1024**2).replace(b'\n', b' ')
+    changed = content[:500000] + b'inserted' + content[500000:]
+    chunks_1 = list(iter_chunks(io.BytesIO(content)))
+    chunks_2 = list(iter_chunks(io.BytesIO(changed)))
+    assert b''.join(chunks_2) == changed
+    assert max(len(chunk) for chunk in chunks_2) <= MAX_CHUNK_SIZE
+    assert len(chunks_2) > 10
+    assert len(set(chunks_2).difference(chunks_1)) <= 2
+
+
+def test_chunks_storage(tmp_path, capsys):
+    """Check storing and restoring results directories with the 'chunks' layout."""
+    data_dir = tmp_path / 'data'
+    object_store = ObjectStore.for_data_dir(data_dir)
+    for idx, timing in enumerate(('1.0s', '2.0s')):
+        run_dir = tmp_path / f'run{idx}'
+        run_dir.mkdir()
+        (run_dir / 'aiida.out').write_bytes(_log_content(timing))
+        res_dir = data_dir / f'mock-code-{idx:032x}'
+        res_dir.mkdir(parents=True)
+        store_files(
+            run_dir,
+            res_dir,
+            select_files(run_dir, ignore_files=(), ignore_paths=()),
+            object_store=object_store,
+            chunked=True
+        )
+
+    restore_dir = tmp_path / 'restore'
+    restore_dir.mkdir()
+    restorer = FileRestorer()
+    restore_entry(data_dir / f'mock-code-{1:032x}', restore_dir, restorer, object_store)
+    assert (restore_dir / 'aiida.out').read_bytes() == _log_content('2.0s')
+    assert restorer.counts['chunks'] == 1
+
+    report = dedup_report(data_dir, object_store)
+    assert report['code']['entries'] == 2
+    assert report['code']['logical'] == 2 * len(_log_content('1.0s'))
+    assert report['code']['logical'] / report['code']['stored'] > 1.8
+
+    main(['dedup-report', str(data_dir)])
+    assert 'code' in capsys.readouterr().out
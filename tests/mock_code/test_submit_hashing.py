@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Test the canonical hashing of the submit script.
+"""
+import json
+
+from aiida_testing.mock_code import InputHasher
+from aiida_testing.mock_code._env_keys import MockVariables
+
+
+def _job_template(cmdline_params, **kwargs):
+    template = {
+        'shebang':
+        '#!/bin/bash',
+        'job_name':
+        'aiida-1',
+        'working_directory':
+        '/scratch/1',
+        'prepend_text':
+        'export AIIDA_MOCK_LABEL="code"\nmodule load code',
+        'append_text':
+        '',
+        'job_environment': {
+            'OMP_NUM_THREADS': '1'
+        },
+        'environment_variables_double_quotes':
+        False,
+        'codes_run_mode':
+        0,
+        'codes_info': [{
+            'prepend_cmdline_params': ['mpirun', '-np', '1'],
+            'cmdline_params': ['/venv/bin/aiida-mock-code', *cmdline_params],
+            'use_double_quotes': [False, False],
+            'wrap_cmdline_params': False,
+            'stdin_name': 'aiida.in',
+            'stdout_name': 'aiida.out',
+            'stderr_name': None,
+            'join_files': False,
+        }],
+    }
+    template.update(kwargs)
+    return template
+
+
+def _hash(tmp_path, name, script, job_template, submit_hashing):
+    variables = MockVariables(
+        log_file=tmp_path / 'mock.log',
+        label='code',
+        test_name='test',
+        data_dir=tmp_path,
+        executable_path='',
+        ignore_files=(),
+        ignore_paths=(),
+        regenerate_data=False,
+        fail_on_missing=False,
+        _hasher=InputHasher,
+        submit_hashing=submit_hashing,
+    )
+    workdir = tmp_path / f'{name}-{submit_hashing}'
+    (workdir / '.aiida').mkdir(parents=True, exist_ok=True)
+    (workdir / 'aiida.in').write_text('input')
+    (workdir / InputHasher.SUBMIT_FILE).write_text(script)
+    if job_template is not None:
+        (workdir / InputHasher.JOB_TEMPLATE_FILE).write_text(json.dumps(job_template))
+    return InputHasher(variables, lambda msg: None)(workdir)
+
+
+def test_canonical_submit_hashing(tmp_path):
+    """Check that the canonical hash only depends on the semantic parts of the submit script."""
+    old_script = "#!/bin/bash\nexport OMP_NUM_THREADS=1\n'aiida-mock-code' '-v' < 'aiida.in' > 'aiida.out'\n"
+    new_script = "#!/bin/bash -l\n#SBATCH --no-requeue\nexport OMP_NUM_THREADS=\"1\"\n" \
+        "'aiida-mock-code' '-v' < 'aiida.in' > 'aiida.out'\n"
+    template = _job_template(['-v'])
+    upgraded = _job_template(['-v'],
+                             shebang='#!/bin/bash -l',
+                             environment_variables_double_quotes=True)
+    upgraded['prepend_text'] = 'export AIIDA_MOCK_SNAPSHOT="/tmp/x.json"\n\nmodule load code\n'
+    upgraded['codes_info'][0]['prepend_cmdline_params'] = []
+
+    for mode in ('script', 'canonical'):
+        old = _hash(tmp_path, 'old', old_script, template, mode)
+        new = _hash(tmp_path, 'new', new_script, upgraded, mode)
+        assert (old == new) == (mode == 'canonical')
+
+    changed = _job_template(['-v', '-x'])
+    assert _hash(tmp_path, 'changed', old_script, changed, 'canonical') != \
+        _hash(tmp_path, 'old', old_script, template, 'canonical')
+    environment = _job_template(['-v'], job_environment={'OMP_NUM_THREADS': '2'})
+    assert _hash(tmp_path, 'environment', old_script, environment, 'canonical') != \
+        _hash(tmp_path, 'old', old_script, template, 'canonical')
+
+    # without a job template, the submit script is hashed
+    assert _hash(tmp_path, 'missing', old_script, None, 'canonical') == \
+        _hash(tmp_path, 'missing', old_script, None, 'script')
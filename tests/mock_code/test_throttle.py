@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Test limiting the number of concurrent runs of actual executables.
+"""
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from aiida_testing.mock_code import InputHasher
+from aiida_testing.mock_code._cli import acquire_run_slot
+from aiida_testing.mock_code._env_keys import MockVariables
+from aiida_testing.mock_code import _throttle
+from aiida_testing.mock_code._throttle import RunSlots, cpu_partition, remove_session_slots, session_slots_dir
+
+
+def _max_overlap(intervals):
+    """Return the maximum number of overlapping (start, end) intervals."""
+    events = sorted([(start, 1) for start, _ in intervals] + [(end, -1) for _, end in intervals])
+    current = maximum = 0
+    for _, change in events:
+        current += change
+        maximum = max(maximum, current)
+    return maximum
+
+
+@pytest.mark.parametrize('limit', ['session', 'label'])
+def test_max_concurrent_runs(tmp_path, limit, mock_code_env):
+    """Check that no more than the given number of actual executables run at the same time."""
+    mock_executable = shutil.which('aiida-mock-code')
+    if mock_executable is None:
+        pytest.skip("'aiida-mock-code' executable not found in the PATH")
+
+    executable = tmp_path / 'code.sh'
+    executable.write_text(
+        "#!/bin/bash\nstart=$(date +%s.%N)\nsleep 0.5\n"
+        f"echo $start $(date +%s.%N) >> {tmp_path / 'runs.txt'}\n"
+    )
+    executable.chmod(0o755)
+    variables, env = mock_code_env(
+        executable,
+        label=f'throttle-{os.getpid()}-{limit}',
+        max_concurrent_runs=2 if limit == 'session' else None,
+        label_max_concurrent_runs=2 if limit == 'label' else None,
+        cpu_affinity=True
+    )
+
+    processes = []
+    for idx in range(5):
+        workdir = tmp_path / f'workdir{idx}'
+        workdir.mkdir()
+        (workdir / 'input.txt').write_text(f'input {idx}')
+        processes.append(subprocess.Popen([mock_executable], cwd=workdir, env=env))  # pylint: disable=consider-using-with
+    assert all(process.wait() == 0 for process in processes)
+
+    intervals = [
+        tuple(map(float, line.split()))
+        for line in (tmp_path / 'runs.txt').read_text(encoding='utf8').splitlines()
+    ]
+    assert len(intervals) == 5
+    assert _max_overlap(intervals) == 2
+    assert variables.log_file.read_text(encoding='utf8').count('Running on CPU cores') == 5
+
+
+def test_run_slots(tmp_path):
+    """Check that slots are exclusive and released after use."""
+    slots = RunSlots('test', 2, directory=tmp_path)
+    with slots.acquire() as slot_1, slots.acquire() as slot_2:
+        assert {slot_1, slot_2} == {0, 1}
+    with slots.acquire() as slot:
+        assert slot == 0
+    with pytest.raises(ValueError):
+        RunSlots('test', 0, directory=tmp_path)
+
+
+def test_session_slots(tmp_path, monkeypatch):
+    """Check that test sessions do not share slots, and that the slots are removed with the session."""
+    monkeypatch.setattr(_throttle, 'DEFAULT_SLOTS_DIR', tmp_path)
+    first = RunSlots('all', 1, directory=session_slots_dir('session-1'))
+    second = RunSlots('all', 1, directory=session_slots_dir('session-2'))
+    with first.acquire() as slot_1, second.acquire() as slot_2:
+        assert slot_1 == slot_2 == 0
+    assert session_slots_dir('session-1').is_dir()
+    remove_session_slots('session-1')
+    assert not session_slots_dir('session-1').exists()
+    assert session_slots_dir('session-2').is_dir()
+
+
+def test_cpu_partition():
+    """Check that the CPU partitions of all slots are disjoint and cover all cores."""
+    cores = os.sched_getaffinity(0)
+    partitions = [cpu_partition(slot, 2) for slot in range(2)]
+    if len(cores) >= 2:
+        assert not partitions[0] & partitions[1]
+        assert partitions[0] | partitions[1] == cores
+    else:
+        assert partitions[0] == partitions[1] == cores
+
+
+def test_cpu_affinity_unsupported(tmp_path, monkeypatch):
+    """Check that CPU affinity is skipped, and logged, on platforms without ``sched_setaffinity``."""
+    monkeypatch.delattr(os, 'sched_setaffinity', raising=False)
+    variables = MockVariables(
+        log_file=tmp_path / 'mock.log',
+        label=f'affinity-{os.getpid()}',
+        test_name='test',
+        data_dir=tmp_path / 'data',
+        executable_path='true',
+        ignore_files=(),
+        ignore_paths=(),
+        regenerate_data=False,
+        fail_on_missing=False,
+        _hasher=InputHasher,
+        label_max_concurrent_runs=1,
+        cpu_affinity=True,
+    )
+    messages = []
+    with acquire_run_slot(variables, lambda message, **kwargs: messages.append(message)):
+        pass
+    assert any('CPU affinity is not supported' in message for message in messages)
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Test the timeline tracing of mock codes.
+"""
+import json
+import os
+import shutil
+import subprocess
+import tracemalloc
+
+import pytest
+
+from aiida_testing.mock_code._trace import configure, merge_traces, set_test_name, span
+
+
+@pytest.fixture
+def tracer(tmp_path):
+    """Enable tracing of the test process into a temporary trace directory."""
+    trace_dir = tmp_path / 'trace'
+    trace_dir.mkdir()
+    yield configure(trace_dir, 'pytest', memory=True)
+    configure(None, 'pytest')
+
+
+def test_spans(tracer, tmp_path):  # pylint: disable=redefined-outer-name
+    """Check the events of nested spans, and their merge into a single trace file."""
+    set_test_name('test_a')
+    with span('outer', 'test', key='a') as args:
+        with span('inner', 'hash', test='test_b'):
+            data = [0] * 100000
+        del data
+        args['hit'] = True
+    with span('unrelated', 'test'):
+        pass
+
+    assert merge_traces(tmp_path / 'trace', tmp_path / 'trace.json') == 4
+    events = json.loads((tmp_path / 'trace.json').read_text())['traceEvents']
+    metadata, inner, outer, _ = events
+    assert metadata['ph'] == 'M' and metadata['args']['name'] == f'pytest ({os.getpid()})'
+    assert (inner['name'], outer['name']) == ('inner', 'outer')
+    assert inner['pid'] == outer['pid'] == tracer.pid
+    assert outer['ts'] <= inner['ts'] and inner['ts'] + inner['dur'] <= outer['ts'] + outer['dur']
+    assert outer['args'] == {'test': 'test_a', 'key': 'a', 'hit': True, **outer['args']}
+    assert inner['args']['test'] == 'test_b'
+    if hasattr(tracemalloc, 'reset_peak'):
+        assert inner['args']['peak_memory'] >= 800000
+        assert outer['args']['peak_memory'] >= inner['args']['peak_memory']
+
+
+def test_executable_trace(tmp_path, mock_code_env):
+    """Check the spans of the mock code executable for a cache miss and a cache hit."""
+    mock_executable = shutil.which('aiida-mock-code')
+    if mock_executable is None:
+        pytest.skip("'aiida-mock-code' executable not found in the PATH")
+
+    executable = tmp_path / 'code.sh'
+    executable.write_text("#!/bin/bash\necho output > output.txt\n")
+    executable.chmod(0o755)
+    trace_dir = tmp_path / 'trace'
+    trace_dir.mkdir()
+    _, env = mock_code_env(executable, test_name='test_code', trace_dir=trace_dir)
+
+    for idx in range(2):
+        workdir = tmp_path / f'workdir{idx}'
+        workdir.mkdir()
+        (workdir / 'input.txt').write_text('input')
+        subprocess.run([mock_executable], cwd=workdir, env=env, check=True)
+
+    merge_traces(trace_dir, tmp_path / 'trace.json')
+    events = json.loads((tmp_path / 'trace.json').read_text())['traceEvents']
+    spans = [event for event in events if event['ph'] == 'X']
+    assert len({event['pid'] for event in spans}) == 2
+    assert all(event['args']['test'] == 'test_code' for event in spans)
+    names = {event['name'] for event in spans}
+    assert {
+        'aiida-mock-code', 'hash', 'hash file', 'lookup', 'actual code', 'store', 'restore'
+    } <= names
+    assert 'modify_content' not in names
+    assert sorted(event['args']['hit'] for event in spans
+                  if event['name'] == 'lookup') == [False, True]
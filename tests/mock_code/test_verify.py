@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Test the verification of cache hits against the actual executable.
+"""
+import json
+import shutil
+import subprocess
+
+import pytest
+
+from aiida_testing.mock_code._cli import _redirects
+from aiida_testing.mock_code._data_dir import DataDirectory
+from aiida_testing.mock_code._stats import read_records
+from aiida_testing.mock_code._usage import UsageLog
+from aiida_testing.mock_code._verify import VERIFY_MARKER, compare_outputs, select_for_verification
+
+
+def test_compare_outputs(tmp_path):
+    """Check the comparison of outputs, with a normalization ignoring timings and a file."""
+    expected, actual = tmp_path / 'expected', tmp_path / 'actual'
+    for path, timing in ((expected, '1.0'), (actual, '2.0')):
+        (path / 'sub').mkdir(parents=True)
+        (path / 'aiida.out').write_text(f"energy 1.0\ntime {timing}\n")
+        (path / 'sub' / 'timings.txt').write_text(timing)
+    (expected / 'missing.txt').write_text('missing')
+    (actual / 'sub' / 'extra.txt').write_text('extra')
+
+    def _normalize(path, content):
+        if path.name == 'timings.txt':
+            return None
+        return b'\n'.join(line for line in content.splitlines() if not line.startswith(b'time'))
+
+    assert compare_outputs(expected, actual, _normalize) == ['missing.txt', 'sub/extra.txt']
+    assert compare_outputs(expected, actual, lambda path, content: content) == [
+        'aiida.out', 'missing.txt', 'sub/extra.txt', 'sub/timings.txt'
+    ]
+
+
+def test_verify_hits(tmp_path, mock_code_env):
+    """Check that sampled cache hits are verified, and that mismatches are recorded."""
+    mock_executable = shutil.which('aiida-mock-code')
+    if mock_executable is None:
+        pytest.skip("'aiida-mock-code' executable not found in the PATH")
+
+    mode = tmp_path / 'mode.txt'
+    mode.write_text('a', encoding='utf8')
+    executable = tmp_path / 'code.sh'
+    executable.write_text(f"#!/bin/bash\ncat {mode} > output.txt\n", encoding='utf8')
+    executable.chmod(0o755)
+    data_dir = tmp_path / 'data'
+    variables, env = mock_code_env(
+        executable, verify_sample=1., verify_file=tmp_path / 'verify.jsonl'
+    )
+
+    def _run(idx, request=False):
+        workdir = tmp_path / f'workdir{idx}'
+        (workdir / '.aiida').mkdir(parents=True)
+        (workdir / 'input.txt').write_text('input', encoding='utf8')
+        if request:
+            (workdir / VERIFY_MARKER).touch()
+        subprocess.run([mock_executable], cwd=workdir, env=env, check=True)
+        return (workdir / 'output.txt').read_text(encoding='utf8')
+
+    assert _run(0) == 'a'
+    name, = DataDirectory(data_dir).names()
+    assert _run(1) == 'a'
+    assert [(record['key'], record['match'])
+            for record in read_records(variables.verify_file)] == [(name, True)]
+
+    # results verified just now are not sampled again, unless requested
+    mode.write_text('b', encoding='utf8')
+    assert not select_for_verification(variables, DataDirectory(data_dir), name)
+    assert _run(2) == 'a'
+    assert _run(3, request=True) == 'a'
+    *_, record = read_records(variables.verify_file)
+    assert (record['match'], record['differences']) == (False, ['output.txt'])
+    assert len(read_records(variables.verify_file)) == 2
+    assert name in UsageLog(data_dir).last_verified()
+
+    variables.verify_budget = 0.
+    UsageLog(data_dir).path.joinpath('verified.jsonl').unlink()
+    assert not select_for_verification(variables, DataDirectory(data_dir), name)
+
+
+def test_redirects(tmp_path):
+    """Check that the standard streams of the actual code are redirected as in the job template."""
+    (tmp_path / '.aiida').mkdir()
+    (tmp_path / 'aiida.in').write_text('input', encoding='utf8')
+    codes_info = [
+        {
+            'cmdline_params': ['/path/to/other-code'],
+            'stdout_name': 'other.out'
+        },
+        {
+            'cmdline_params': ['/path/to/aiida-mock-code', '-in'],
+            'stdin_name': 'aiida.in',
+            'stdout_name': 'aiida.out',
+            'join_files': True
+        },
+    ]
+    with open(tmp_path / '.aiida' / 'job_tmpl.json', 'w', encoding='utf8') as handle:
+        json.dump({'codes_info': codes_info}, handle)
+
+    with _redirects(tmp_path, '/usr/bin/aiida-mock-code') as streams:
+        assert streams['stdin'].read() == b'input'
+        assert streams['stdout'].name == str(tmp_path / 'aiida.out')
+        assert streams['stderr'] == subprocess.STDOUT
+
+    (tmp_path / '.aiida' / 'job_tmpl.json').unlink()
+    with _redirects(tmp_path, '/usr/bin/aiida-mock-code') as streams:
+        assert streams == dict.fromkeys(('stdin', 'stdout', 'stderr'), subprocess.DEVNULL)
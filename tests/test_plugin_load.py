@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Test that loading the pytest plugins does not import heavy dependencies.
+"""
+from pathlib import Path
+import statistics
+import subprocess
+import sys
+import time
+
+import pytest
+
+HEAVY_MODULES = ('aiida', 'click', 'pkg_resources')
+
+#: Loads a plugin module like pytest does for a ``pytest11`` entry point, and prints the loaded modules
+_LOAD_PLUGIN = '''
+import importlib, sys
+from _pytest.config import PytestPluginManager
+plugin_manager = PytestPluginManager()
+module = importlib.import_module({module!r})
+plugin_manager.register(module, {module!r})
+plugin_manager.consider_module(module)
+print("\\n".join(sys.modules))
+'''
+
+
+def _pytest11_modules():
+    """Return the plugin modules of the ``pytest11`` entry points in ``pyproject.toml``."""
+    modules = []
+    in_table = False
+    pyproject = Path(__file__).parent.parent / 'pyproject.toml'
+    for line in pyproject.read_text(encoding='utf8').splitlines():
+        line = line.strip()
+        if line.startswith('['):
+            in_table = line == '[project.entry-points."pytest11"]'
+        elif in_table and '=' in line:
+            modules.append(line.split('=', 1)[1].strip().strip('"\''))
+    return modules
+
+
+PLUGIN_MODULES = _pytest11_modules()
+
+
+def _import_in_subprocess(module: str) -> float:
+    """Import a module in a fresh interpreter and return the wall time in seconds."""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', f'import {module}'], check=True)
+    return time.perf_counter() - start
+
+
+def test_pytest11_modules():
+    """Check that the plugin modules are read from the entry points."""
+    assert PLUGIN_MODULES == ['aiida_testing.mock_code', 'aiida_testing.archive_cache']
+
+
+@pytest.mark.parametrize('module', PLUGIN_MODULES)
+def test_plugin_lean_import(module):
+    """Check that loading a plugin, including its hooks and ``pytest_plugins``, does not import aiida."""
+    result = subprocess.run(
+        [sys.executable, '-c', _LOAD_PLUGIN.format(module=module)],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    loaded = {name.split('.')[0] for name in result.stdout.splitlines()}
+    assert not loaded.intersection(HEAVY_MODULES)
+
+
+def test_plugin_load_time():
+    """
+    Report the time of loading the plugins, compared to importing the ORM of AiiDA.
+    """
+    repeat = 5
+    times = {
+        module: statistics.median(_import_in_subprocess(module) for _ in range(repeat))
+        for module in (*PLUGIN_MODULES, 'aiida.orm')
+    }
+    print(', '.join(f"{module}: {duration * 1e3:.1f} ms" for module, duration in times.items()))